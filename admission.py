@@ -0,0 +1,228 @@
+# admission.py
+
+import asyncio
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+
+# Questions being answered at once; more wait in a bounded queue.
+ADMISSION_MAX_CONCURRENT = int(os.getenv("ADMISSION_MAX_CONCURRENT", "8"))
+ADMISSION_QUEUE_SIZE = int(os.getenv("ADMISSION_QUEUE_SIZE", "32"))
+# No tenant may hold more than this many of the queue's places.
+ADMISSION_TENANT_QUEUE = int(os.getenv("ADMISSION_TENANT_QUEUE", "8"))
+# A question still queued after this long is turned away with a "busy" reply.
+ADMISSION_MAX_QUEUE_MS = float(os.getenv("ADMISSION_MAX_QUEUE_MS", "2000"))
+
+# Concurrency limits of the stages inside the question path. The LLM stage is
+# limited by the scheduler (LLM_MAX_CONCURRENCY in llm_scheduler.py).
+STAGE_LIMITS = {
+    "embedding": int(os.getenv("EMBED_STAGE_CONCURRENCY", "4")),
+    "search": int(os.getenv("SEARCH_STAGE_CONCURRENCY", "8")),
+}
+
+# Async callers wait for admission and stage slots on these threads, off the event loop.
+_waiters = ThreadPoolExecutor(
+    max_workers=ADMISSION_QUEUE_SIZE + len(STAGE_LIMITS) * ADMISSION_MAX_CONCURRENT, thread_name_prefix="admission")
+
+class Overloaded(Exception):
+    """Raised when a request is shed instead of being admitted."""
+
+class _Waiter:
+    def __init__(self, tenant):
+        self.tenant = tenant
+        self.granted = threading.Event()
+        self.enqueued = time.monotonic()
+
+class Ticket:
+    """
+    An admitted request's slot; release it when done (releasing twice is harmless).
+    """
+
+    def __init__(self, controller):
+        self._controller = controller
+        self._released = False
+
+    def release(self):
+        if not self._released:
+            self._released = True
+            self._controller._release()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+class AdmissionController:
+    """
+    Admission control in front of the question path.
+
+    At most `max_concurrent` requests run at once. Others wait in a queue
+    bounded overall (`queue_size`) and per tenant (`tenant_queue`); when a
+    slot frees, tenants with waiting requests are served round-robin, so one
+    busy tenant cannot starve the rest. A request is shed with Overloaded
+    when the queue is full or it has waited `max_queue_ms` (or its deadline
+    ran out), keeping latency bounded for the requests that are admitted.
+    """
+
+    def __init__(self, max_concurrent=ADMISSION_MAX_CONCURRENT, queue_size=ADMISSION_QUEUE_SIZE,
+                 tenant_queue=ADMISSION_TENANT_QUEUE, max_queue_ms=ADMISSION_MAX_QUEUE_MS):
+        self.max_concurrent = max_concurrent
+        self.queue_size = queue_size
+        self.tenant_queue = tenant_queue
+        self.max_queue_seconds = max_queue_ms / 1000
+        self.running = 0
+        self._queues = OrderedDict()
+        self._queued = 0
+        self._lock = threading.Lock()
+        self.stats = {"admitted": 0, "queued": 0, "shed_queue_full": 0, "shed_wait": 0, "queue_seconds": 0.0}
+
+    def admit(self, tenant="", deadline=None):
+        """
+        Blocks until the request may run and returns its Ticket, or raises Overloaded.
+        """
+        with self._lock:
+            if self.running < self.max_concurrent and not self._queued:
+                self.running += 1
+                self.stats["admitted"] += 1
+                return Ticket(self)
+            queue = self._queues.get(tenant)
+            if self._queued >= self.queue_size or (queue and len(queue) >= self.tenant_queue):
+                self.stats["shed_queue_full"] += 1
+                raise Overloaded("the question queue is full")
+            waiter = _Waiter(tenant)
+            self._queues.setdefault(tenant, deque()).append(waiter)
+            self._queued += 1
+            self.stats["queued"] += 1
+
+        timeout = self.max_queue_seconds
+        if deadline is not None:
+            timeout = deadline.budget(timeout)
+        granted = waiter.granted.wait(timeout)
+        with self._lock:
+            self.stats["queue_seconds"] += time.monotonic() - waiter.enqueued
+            if not granted and not waiter.granted.is_set():
+                self._queues[tenant].remove(waiter)
+                if not self._queues[tenant]:
+                    del self._queues[tenant]
+                self._queued -= 1
+                self.stats["shed_wait"] += 1
+                raise Overloaded(f"queued for more than {timeout:.2f}s")
+            self.stats["admitted"] += 1
+        return Ticket(self)
+
+    def _release(self):
+        with self._lock:
+            self.running -= 1
+            if not self._queues:
+                return
+            # Round-robin: serve the first tenant in line, then move it to the back.
+            tenant, queue = next(iter(self._queues.items()))
+            waiter = queue.popleft()
+            if queue:
+                self._queues.move_to_end(tenant)
+            else:
+                del self._queues[tenant]
+            self._queued -= 1
+            self.running += 1
+            waiter.granted.set()
+
+    def report(self):
+        with self._lock:
+            waiting = {tenant: len(queue) for tenant, queue in self._queues.items()}
+            stats = dict(self.stats)
+        queued = stats.pop("queue_seconds")
+        return {
+            **stats,
+            "running": self.running,
+            "waiting": waiting,
+            "mean_queue_ms": 1000 * queued / stats["queued"] if stats["queued"] else 0.0,
+        }
+
+class StageLimiter:
+    """
+    Bounds how many requests run one stage (e.g. embedding, search) at once.
+    """
+
+    def __init__(self, name, limit):
+        self.name = name
+        self.limit = limit
+        self._slots = threading.BoundedSemaphore(limit)
+        self.stats = {"entered": 0, "shed": 0}
+
+    def enter(self, deadline=None):
+        """
+        Waits for a slot (until `deadline`) and returns a context manager holding it; raises Overloaded.
+        """
+        timeout = deadline.remaining() if deadline is not None else None
+        if not self._slots.acquire(timeout=timeout):
+            self.stats["shed"] += 1
+            raise Overloaded(f"the {self.name} stage is saturated")
+        self.stats["entered"] += 1
+        return self
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self._slots.release()
+
+_controller = None
+_stages = {}
+_lock = threading.Lock()
+
+def get_admission_controller():
+    """
+    Returns the process-wide admission controller.
+    """
+    global _controller
+    with _lock:
+        if _controller is None:
+            _controller = AdmissionController()
+        return _controller
+
+def stage(name, deadline=None):
+    """
+    Enters a stage of the question path: `with stage("search", deadline): ...`
+    """
+    with _lock:
+        if name not in _stages:
+            _stages[name] = StageLimiter(name, STAGE_LIMITS[name])
+        limiter = _stages[name]
+    return limiter.enter(deadline)
+
+async def _acquire_off_loop(acquire, release):
+    # Runs a blocking acquire on a waiter thread. If the awaiting task is
+    # cancelled meanwhile, whatever the thread still acquires is released.
+    future = _waiters.submit(acquire)
+    try:
+        return await asyncio.wrap_future(future)
+    except asyncio.CancelledError:
+        def release_late(done):
+            if not done.cancelled() and done.exception() is None:
+                release(done.result())
+        future.add_done_callback(release_late)
+        raise
+
+async def aadmit(tenant="", deadline=None):
+    """
+    Async version of `AdmissionController.admit` on the process-wide controller.
+    """
+    controller = get_admission_controller()
+    return await _acquire_off_loop(lambda: controller.admit(tenant, deadline), lambda ticket: ticket.release())
+
+async def astage(name, deadline=None):
+    """
+    Async version of `stage`: `with await astage("search", deadline): ...`
+    """
+    return await _acquire_off_loop(lambda: stage(name, deadline), lambda limiter: limiter.__exit__(None, None, None))
+
+def get_admission_report():
+    """
+    Returns the admission controller's and each stage's counters.
+    """
+    with _lock:
+        stages = {name: {"limit": limiter.limit, **limiter.stats} for name, limiter in _stages.items()}
+    return {"admission": get_admission_controller().report(), "stages": stages}
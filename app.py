@@ -1,16 +1,26 @@
 # app.py
 
 import os
+
 import streamlit as st
 from dotenv import load_dotenv
 
+# Load environment variables before the backend modules read their settings at import time
+load_dotenv()
+
 # Import your backend functions
 from document_processor import load_and_chunk_document, get_embeddings_model
-from vector_store import create_or_update_vector_store, load_vector_store
-from qa_system import get_answer_from_query
+from vector_store import (
+    DEFAULT_NAMESPACE, create_or_update_vector_store, delete_document, list_documents, load_vector_store,
+    namespace_for_user, write_backlog
+)
+from qa_system import get_service_report, stream_answer_from_query
+from chat_history import ChatHistoryBuffer
 
-# Load environment variables
-load_dotenv()
+# Request header carrying the signed-in user's identity, set by the
+# authenticating reverse proxy in front of the app (e.g. X-Forwarded-Email).
+# Without it every session shares the VECTOR_NAMESPACE workspace.
+WORKSPACE_USER_HEADER = os.getenv("WORKSPACE_USER_HEADER", "")
 
 # --- Page Configuration ---
 st.set_page_config(
@@ -22,6 +32,16 @@ st.set_page_config(
 st.title("📄 Doc Q&A System (RAG)")
 st.write("Upload a PDF document and ask questions about its content.")
 
+def resolve_namespace():
+    """Returns the workspace namespace of this session, never taken from user input."""
+    if not WORKSPACE_USER_HEADER:
+        return DEFAULT_NAMESPACE
+    identity = st.context.headers.get(WORKSPACE_USER_HEADER)
+    if not identity:
+        st.error("You are not signed in.")
+        st.stop()
+    return namespace_for_user(identity)
+
 @st.cache_resource
 def load_embedding_model():
     """Loads the embedding model and caches it."""
@@ -32,6 +52,12 @@ def load_embedding_model():
 # Initialize chat history in Streamlit's session state
 if "messages" not in st.session_state:
     st.session_state.messages = []
+# Bounded, compressed copy of the conversation used to rewrite follow-up questions
+if "history" not in st.session_state:
+    st.session_state.history = ChatHistoryBuffer()
+# Documents uploaded in this session, per workspace
+if "documents" not in st.session_state:
+    st.session_state.documents = {}
 
 # Display past chat messages
 for message in st.session_state.messages:
@@ -40,31 +66,64 @@ for message in st.session_state.messages:
 
 # --- Sidebar for File Upload ---
 with st.sidebar:
+    # Each signed-in user has a separate namespace in the vector store;
+    # questions never see documents uploaded to another workspace.
+    namespace = resolve_namespace()
+    workspace_documents = st.session_state.documents.setdefault(namespace, set())
+
     st.header("1. Upload Your Document")
     uploaded_file = st.file_uploader("Upload a PDF file", type="pdf")
 
     if uploaded_file is not None:
-        if "processed_file" not in st.session_state or st.session_state.processed_file != uploaded_file.name:
+        processed_key = (namespace, uploaded_file.name)
+        if st.session_state.get("processed_file") != processed_key:
             with st.spinner('Processing document... This may take a moment.'):
-                temp_dir = "temp_uploads"
-                os.makedirs(temp_dir, exist_ok=True)
-                file_path = os.path.join(temp_dir, uploaded_file.name)
-
-                with open(file_path, "wb") as f:
-                    f.write(uploaded_file.getbuffer())
-
                 embeddings_model = load_embedding_model()
-                chunked_docs = load_and_chunk_document(file_path)
+                # Parsed straight from the upload's in-memory buffer; nothing is written to disk.
+                chunked_docs = load_and_chunk_document(uploaded_file.getvalue(), name=uploaded_file.name)
 
                 if chunked_docs:
-                    create_or_update_vector_store(chunked_docs, embeddings_model)
-                    st.session_state.processed_file = uploaded_file.name
+                    create_or_update_vector_store(chunked_docs, embeddings_model, namespace=namespace)
+                    st.session_state.processed_file = processed_key
+                    workspace_documents.add(uploaded_file.name)
                     st.success(f"File '{uploaded_file.name}' processed successfully!")
                 else:
                     st.error("Failed to process the document.")
         else:
             st.info(f"File '{uploaded_file.name}' is already loaded and processed.")
 
+    st.header("2. Choose Documents")
+    known_documents = list_documents(load_embedding_model(), namespace)
+    selected_documents = st.multiselect(
+        "Search only in (leave empty to search the whole workspace)",
+        sorted(set(known_documents or []) | workspace_documents),
+        key="selected_documents",
+    )
+    # Only the local index can list (and so delete) documents.
+    if known_documents is not None and selected_documents and st.button("Remove selected documents"):
+        for name in selected_documents:
+            if delete_document(name, load_embedding_model(), namespace):
+                workspace_documents.discard(name)
+                if st.session_state.get("processed_file") == (namespace, name):
+                    del st.session_state.processed_file
+        del st.session_state.selected_documents
+        st.rerun()
+
+    # Pinecone writes go through a local outbox; show what has not reached it yet.
+    backlog = write_backlog()
+    if backlog and backlog["pending"]:
+        message = f"{backlog['pending']} chunk writes waiting for Pinecone."
+        if backlog["failing"]:
+            message += f" Retrying after: {backlog['last_error']}"
+        st.caption(message)
+    if backlog and backlog["dead"]:
+        st.caption(f"{backlog['dead']} chunk writes were rejected by Pinecone and set aside: {backlog['last_error']}")
+
+    # Counters of the question path, for operators: breaker states, load
+    # shedding, coalescing and cache hit rates since the server started.
+    with st.expander("Service health"):
+        st.json(get_service_report(), expanded=False)
+
 # --- Chat Input and Q&A Logic ---
 if prompt := st.chat_input("Ask a question about your document..."):
     st.session_state.messages.append({"role": "user", "content": prompt})
@@ -74,11 +133,16 @@ if prompt := st.chat_input("Ask a question about your document..."):
     with st.chat_message("assistant"):
         with st.spinner("Thinking..."):
             embeddings_model = load_embedding_model()
-            vector_store = load_vector_store(embeddings_model)
+            vector_store = load_vector_store(embeddings_model, namespace)
 
             if vector_store is None:
                 st.warning("Knowledge base is not ready. Please upload a document first or check your Pinecone connection.")
             else:
-                answer = get_answer_from_query(vector_store, prompt)
-                st.markdown(answer)
-                st.session_state.messages.append({"role": "assistant", "content": answer})
\ No newline at end of file
+                # Streamed as it is generated; identical questions from other sessions share the stream.
+                answer = st.write_stream(stream_answer_from_query(
+                    vector_store, prompt, history=st.session_state.history, sources=selected_documents,
+                    tenant=namespace,
+                ))
+                st.session_state.messages.append({"role": "assistant", "content": answer})
+                st.session_state.history.add("user", prompt)
+                st.session_state.history.add("assistant", answer)
\ No newline at end of file
@@ -0,0 +1,50 @@
+# bench_chunking.py
+
+"""
+Compares chunking throughput of OffsetTextSplitter against LangChain's
+RecursiveCharacterTextSplitter on the bundled PDFs and checks that both
+produce the same chunks.
+
+    python bench_chunking.py [uploads/*.pdf] --repeat 20
+"""
+
+import argparse
+import glob
+import time
+
+from langchain_community.document_loaders import PyMuPDFLoader
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+from offset_splitter import OffsetTextSplitter
+
+def _time_split(splitter, pages, repeat):
+    started = time.perf_counter()
+    for _ in range(repeat):
+        chunks = [chunk for page in pages for chunk in splitter.split_text(page)]
+    return (time.perf_counter() - started) / repeat, chunks
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the ingest text splitters.")
+    parser.add_argument("files", nargs="*", default=sorted(glob.glob("uploads/*.pdf")))
+    parser.add_argument("--chunk-size", type=int, default=1000)
+    parser.add_argument("--chunk-overlap", type=int, default=200)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    baseline = RecursiveCharacterTextSplitter(chunk_size=args.chunk_size, chunk_overlap=args.chunk_overlap)
+    candidate = OffsetTextSplitter(chunk_size=args.chunk_size, chunk_overlap=args.chunk_overlap)
+
+    print(f"{'file':40} {'pages':>6} {'chars':>10} {'chunks':>7} {'langchain MB/s':>15} {'offset MB/s':>12} {'speedup':>8} same")
+    for file_path in args.files:
+        pages = [doc.page_content for doc in PyMuPDFLoader(file_path).load()]
+        megabytes = sum(len(page) for page in pages) / 1e6
+        baseline_time, baseline_chunks = _time_split(baseline, pages, args.repeat)
+        candidate_time, candidate_chunks = _time_split(candidate, pages, args.repeat)
+        print(
+            f"{file_path[-40:]:40} {len(pages):>6} {int(megabytes * 1e6):>10} {len(candidate_chunks):>7} "
+            f"{megabytes / baseline_time:>15.1f} {megabytes / candidate_time:>12.1f} "
+            f"{baseline_time / candidate_time:>7.2f}x {baseline_chunks == candidate_chunks}"
+        )
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+# bench_threads.py
+
+"""
+Finds the best split of this machine's cores between embedding worker
+processes and torch threads per process.
+
+For every worker count that divides the available cores, it starts that many
+processes (each configured through cpu_config with an equal share of the
+cores), embeds the same queries concurrently and reports the aggregate
+throughput and per-query latency.
+
+    python bench_threads.py --queries 200 --batch-size 1 --pin
+"""
+
+import argparse
+import multiprocessing
+import statistics
+import time
+
+from cpu_config import available_cpus
+
+QUERIES = [
+    "What is a binary search tree?",
+    "Explain normalization in databases and why third normal form matters.",
+    "How does a hash table resolve collisions?",
+    "What is the difference between a primary key and a foreign key?",
+    "Describe the time complexity of quicksort in the average and worst case.",
+]
+
+def _worker(worker_index, workers, pin, model_name, queries, batch_size, barrier, results):
+    from langchain_community.embeddings import HuggingFaceEmbeddings
+
+    from cpu_config import apply_thread_config, resolve_thread_config
+
+    config = apply_thread_config(resolve_thread_config(
+        workers=workers, worker_index=worker_index, affinity="auto" if pin else "",
+    ))
+    model = HuggingFaceEmbeddings(model_name=model_name)
+    model.embed_documents(QUERIES[:batch_size])  # warm-up
+    texts = [QUERIES[i % len(QUERIES)] for i in range(queries)]
+    latencies = []
+    barrier.wait()
+    for start in range(0, len(texts), batch_size):
+        began = time.perf_counter()
+        model.embed_documents(texts[start:start + batch_size])
+        latencies.append(time.perf_counter() - began)
+    results.put((config["intra_op_threads"], latencies))
+
+def run_split(workers, args):
+    context = multiprocessing.get_context("spawn")
+    barrier = context.Barrier(workers + 1)
+    results = context.Queue()
+    per_worker = max(args.batch_size, args.queries // workers)
+    processes = [
+        context.Process(target=_worker, args=(i, workers, args.pin, args.model, per_worker, args.batch_size, barrier, results))
+        for i in range(workers)
+    ]
+    for process in processes:
+        process.start()
+    barrier.wait()
+    started = time.perf_counter()
+    outcomes = [results.get() for _ in processes]
+    elapsed = time.perf_counter() - started
+    for process in processes:
+        process.join()
+    latencies = sorted(latency for _, worker_latencies in outcomes for latency in worker_latencies)
+    return {
+        "workers": workers,
+        "threads": outcomes[0][0],
+        "queries_per_second": per_worker * workers / elapsed,
+        "p50_ms": 1000 * statistics.median(latencies),
+        "p95_ms": 1000 * latencies[int(0.95 * (len(latencies) - 1))],
+    }
+
+def main():
+    from document_processor import EMBEDDING_MODEL_NAME
+
+    parser = argparse.ArgumentParser(description="Benchmark worker/thread splits for CPU embedding.")
+    parser.add_argument("--model", default=EMBEDDING_MODEL_NAME)
+    parser.add_argument("--queries", type=int, default=200, help="total queries per configuration")
+    parser.add_argument("--batch-size", type=int, default=1)
+    parser.add_argument("--pin", action="store_true", help="pin each worker to its own slice of cores")
+    args = parser.parse_args()
+
+    cores = len(available_cpus())
+    splits = [workers for workers in range(1, cores + 1) if cores % workers == 0]
+    print(f"{cores} cores available; testing {len(splits)} worker/thread splits.")
+    print(f"{'workers':>8} {'threads':>8} {'queries/s':>10} {'p50 ms':>8} {'p95 ms':>8}")
+    rows = []
+    for workers in splits:
+        row = run_split(workers, args)
+        rows.append(row)
+        print(f"{row['workers']:>8} {row['threads']:>8} {row['queries_per_second']:>10.1f} "
+              f"{row['p50_ms']:>8.1f} {row['p95_ms']:>8.1f}")
+    best = max(rows, key=lambda row: row["queries_per_second"])
+    print(f"\nBest throughput: EMBED_WORKERS={best['workers']} with {best['threads']} intra-op threads each "
+          f"({best['queries_per_second']:.1f} queries/s).")
+
+if __name__ == "__main__":
+    main()
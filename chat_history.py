@@ -0,0 +1,139 @@
+# chat_history.py
+
+import os
+import re
+import threading
+from collections import OrderedDict
+
+from llm_scheduler import estimate_tokens
+
+# Token budget for the history passed to the query rewriter.
+HISTORY_TOKEN_BUDGET = int(os.getenv("HISTORY_TOKEN_BUDGET", "600"))
+# The most recent messages are kept verbatim; older ones are compressed.
+HISTORY_RECENT_MESSAGES = int(os.getenv("HISTORY_RECENT_MESSAGES", "4"))
+MAX_SUMMARY_ANSWER_CHARS = 160
+
+# Words that point back at earlier turns wherever they appear, and openers
+# that continue the previous question ("and for Groq?", "what about ...").
+_BACK_REFERENCE = re.compile(r"\b(above|previous|previously|earlier|again|former|latter)\b", re.IGNORECASE)
+_CONTINUATION = re.compile(r"^\s*(and|but|also|so|then|what about|how about|more)\b", re.IGNORECASE)
+_WORD = re.compile(r"[a-z0-9][a-z0-9'-]*")
+_PRONOUNS = {"it", "its", "they", "them", "their", "theirs", "he", "she", "him", "her", "his"}
+_DEMONSTRATIVES = {"this", "that", "these", "those"}
+# Function words and generic request words; none of them can name the topic a pronoun refers to.
+_GENERIC_WORDS = {
+    "a", "about", "am", "an", "and", "any", "are", "as", "at", "be", "been", "but", "by", "can", "could",
+    "describe", "detail", "details", "did", "do", "does", "else", "example", "examples", "explain", "for",
+    "from", "get", "give", "had", "has", "have", "here", "how", "i", "if", "in", "info", "information", "is",
+    "just", "like", "list", "mean", "means", "meaning", "me", "might", "more", "my", "no", "not", "of", "on",
+    "one", "or", "other", "our", "please", "right", "should", "show", "so", "some", "tell", "than", "the",
+    "then", "there", "to", "true", "us", "was", "we", "were", "what", "when", "where", "which", "who",
+    "whom", "whose", "why", "will", "with", "work", "works", "would", "you", "your",
+}
+
+def count_tokens(text):
+    """Approximate token count used for history budgeting."""
+    return estimate_tokens(text, completion_tokens=0)
+
+def needs_rewrite(query):
+    """
+    Returns True if the question probably depends on earlier turns: it
+    refers back ("as above", "what about ..."), uses a pronoun or a bare
+    "this"/"that" before naming any topic of its own ("how does it work?"),
+    or names no topic at all ("why?", "tell me more").
+    """
+    if _BACK_REFERENCE.search(query) or _CONTINUATION.match(query):
+        return True
+    words = _WORD.findall(query.lower())
+    for position, word in enumerate(words):
+        if word in _PRONOUNS:
+            return True
+        if word in _DEMONSTRATIVES:
+            following = words[position + 1] if position + 1 < len(words) else None
+            # "this document" names its topic; "what is this" does not.
+            if following is None or following in _GENERIC_WORDS or following in _PRONOUNS:
+                return True
+            return False
+        if word not in _GENERIC_WORDS:
+            return False
+    return True
+
+def _compress(role, content):
+    # Questions carry the topic, keep them; answers shrink to their first sentence.
+    text = " ".join(content.split())
+    if role == "assistant":
+        text = re.split(r"(?<=[.!?])\s", text, maxsplit=1)[0][:MAX_SUMMARY_ANSWER_CHARS]
+    return f"{role.capitalize()}: {text}"
+
+class ChatHistoryBuffer:
+    """
+    Rolling chat history capped at `max_tokens`.
+
+    The last `recent_messages` messages are kept verbatim. Older messages are
+    folded into a compressed summary (questions kept, answers cut to their
+    first sentence), and the oldest summary lines are dropped once the whole
+    buffer would exceed the token cap.
+    """
+
+    def __init__(self, max_tokens=HISTORY_TOKEN_BUDGET, recent_messages=HISTORY_RECENT_MESSAGES):
+        self.max_tokens = max_tokens
+        self.recent_messages = recent_messages
+        self.summary = []
+        self.recent = []
+
+    @classmethod
+    def from_messages(cls, messages, **kwargs):
+        """Builds a buffer from Streamlit-style [{"role": ..., "content": ...}] messages."""
+        buffer = cls(**kwargs)
+        for message in messages:
+            buffer.add(message["role"], message["content"])
+        return buffer
+
+    def __bool__(self):
+        return bool(self.summary or self.recent)
+
+    def add(self, role, content):
+        self.recent.append((role, content))
+        while len(self.recent) > self.recent_messages:
+            self.summary.append(_compress(*self.recent.pop(0)))
+        self._trim()
+
+    def _trim(self):
+        while self.summary and count_tokens(self.render()) > self.max_tokens:
+            self.summary.pop(0)
+        # A single huge recent message is truncated rather than dropped.
+        while count_tokens(self.render()) > self.max_tokens and self.recent:
+            role, content = self.recent[0]
+            excess_chars = (count_tokens(self.render()) - self.max_tokens) * 4
+            if excess_chars >= len(content):
+                self.recent.pop(0)
+            else:
+                self.recent[0] = (role, content[excess_chars:])
+
+    def render(self):
+        """Returns the history as plain text for a prompt."""
+        lines = list(self.summary)
+        lines.extend(f"{role.capitalize()}: {' '.join(content.split())}" for role, content in self.recent)
+        return "\n".join(lines)
+
+class LRUCache:
+    """A small bounded mapping that evicts the least recently used key."""
+
+    def __init__(self, maxsize=256):
+        self.maxsize = maxsize
+        self.data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            if key not in self.data:
+                return None
+            self.data.move_to_end(key)
+            return self.data[key]
+
+    def put(self, key, value):
+        with self._lock:
+            self.data[key] = value
+            self.data.move_to_end(key)
+            while len(self.data) > self.maxsize:
+                self.data.popitem(last=False)
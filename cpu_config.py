@@ -0,0 +1,108 @@
+# cpu_config.py
+
+import os
+
+# Number of processes on this host that run the embedding model; "auto" thread
+# counts split the available cores evenly between them.
+EMBED_WORKERS = int(os.getenv("EMBED_WORKERS", "1"))
+# This process's index among those workers (0-based), used for "auto" affinity.
+EMBED_WORKER_INDEX = int(os.getenv("EMBED_WORKER_INDEX", "0"))
+# "auto" or an explicit thread count.
+EMBED_INTRA_OP_THREADS = os.getenv("EMBED_INTRA_OP_THREADS", "auto")
+EMBED_INTER_OP_THREADS = os.getenv("EMBED_INTER_OP_THREADS", "auto")
+# "", "auto" (a disjoint slice of cores per worker) or a CPU list such as "0-3,8".
+EMBED_CPU_AFFINITY = os.getenv("EMBED_CPU_AFFINITY", "")
+
+_applied = None
+
+def parse_cpus(spec):
+    """
+    Parses a CPU list such as "0-3,6" into a sorted list of CPU ids.
+    """
+    cpus = set()
+    for part in filter(None, (p.strip() for p in spec.split(","))):
+        first, _, last = part.partition("-")
+        cpus.update(range(int(first), int(last or first) + 1))
+    return sorted(cpus)
+
+def available_cpus():
+    """
+    Returns the CPU ids this process may run on.
+    """
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+def resolve_thread_config(workers=EMBED_WORKERS, worker_index=EMBED_WORKER_INDEX, intra_op=EMBED_INTRA_OP_THREADS,
+                          inter_op=EMBED_INTER_OP_THREADS, affinity=EMBED_CPU_AFFINITY):
+    """
+    Turns the thread settings (possibly "auto") into concrete values.
+
+    In auto mode each of `workers` processes gets an equal share of the cores
+    as intra-op threads and a single inter-op thread, so processes on the same
+    host never oversubscribe the CPU. Tokenizer parallelism is only enabled
+    for a single worker, since its own thread pool would compete with torch's.
+
+    Returns:
+        dict: intra_op_threads, inter_op_threads, cpus (list or None) and tokenizers_parallelism.
+    """
+    cpus = available_cpus()
+    workers = max(1, workers)
+    share = max(1, len(cpus) // workers)
+
+    if affinity == "auto":
+        start = (worker_index % workers) * share % len(cpus)
+        pinned = cpus[start:start + share] or None
+    elif affinity:
+        pinned = parse_cpus(affinity)
+    else:
+        pinned = None
+
+    if intra_op == "auto":
+        intra_op_threads = len(pinned) if pinned else share
+    else:
+        intra_op_threads = int(intra_op)
+    inter_op_threads = 1 if inter_op == "auto" else int(inter_op)
+    return {
+        "intra_op_threads": intra_op_threads,
+        "inter_op_threads": inter_op_threads,
+        "cpus": pinned,
+        "tokenizers_parallelism": workers == 1 and intra_op_threads > 1,
+    }
+
+def apply_thread_config(config=None):
+    """
+    Applies a thread configuration to this process (once) and returns it.
+
+    Sets the OpenMP/MKL and tokenizers environment variables (effective for
+    libraries not yet initialised), torch's intra-/inter-op thread counts and
+    the CPU affinity. Later calls return the configuration already applied,
+    because torch cannot change its inter-op pool once it has been used.
+    """
+    global _applied
+    if _applied is not None:
+        return _applied
+    config = config or resolve_thread_config()
+
+    threads = str(config["intra_op_threads"])
+    os.environ["OMP_NUM_THREADS"] = threads
+    os.environ["MKL_NUM_THREADS"] = threads
+    os.environ["TOKENIZERS_PARALLELISM"] = "true" if config["tokenizers_parallelism"] else "false"
+    if config["cpus"] and hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, config["cpus"])
+
+    try:
+        import torch
+    except ImportError:
+        torch = None
+    if torch is not None:
+        torch.set_num_threads(config["intra_op_threads"])
+        try:
+            torch.set_num_interop_threads(config["inter_op_threads"])
+        except RuntimeError as e:
+            print(f"Could not set torch inter-op threads: {e}")
+
+    _applied = config
+    print(f"Embedding threads: {config['intra_op_threads']} intra-op, {config['inter_op_threads']} inter-op, "
+          f"CPUs {config['cpus'] or 'unpinned'}.")
+    return config
@@ -0,0 +1,278 @@
+# dedup.py
+
+import os
+import pickle
+import re
+import threading
+import zlib
+from contextlib import contextmanager
+
+import numpy as np
+
+from local_index import namespace_dir
+
+DEDUP_ENABLED = os.getenv("DEDUP_ENABLED", "true").lower() in ("1", "true", "yes")
+# One index per namespace, so tenants never deduplicate against each other.
+DEDUP_DIR = os.getenv("DEDUP_DIR", "local_data/dedup")
+# Estimated Jaccard similarity of word 5-gram sets above which two chunks are the same paragraph.
+DEDUP_THRESHOLD = float(os.getenv("DEDUP_THRESHOLD", "0.85"))
+
+NUM_PERM = 128
+BANDS = 32  # 32 bands x 4 rows: pairs above ~0.5 Jaccard become candidates
+SHINGLE_WORDS = 5
+_PRIME = (1 << 31) - 1
+_WORD = re.compile(r"\w+")
+
+_rng = np.random.RandomState(1)
+_PERM_A = _rng.randint(1, _PRIME, size=NUM_PERM, dtype=np.uint64)
+_PERM_B = _rng.randint(0, _PRIME, size=NUM_PERM, dtype=np.uint64)
+
+def minhash_signature(text):
+    """
+    Returns the MinHash signature (NUM_PERM uint32 values) of the text's word
+    5-gram set, or None if the text has no words.
+    """
+    words = _WORD.findall(text.lower())
+    if not words:
+        return None
+    size = min(SHINGLE_WORDS, len(words))
+    shingles = {" ".join(words[i:i + size]) for i in range(len(words) - size + 1)}
+    hashes = np.fromiter((zlib.crc32(s.encode("utf-8")) & _PRIME for s in shingles), dtype=np.uint64, count=len(shingles))
+    permuted = (np.outer(_PERM_A, hashes) + _PERM_B[:, None]) % _PRIME
+    return permuted.min(axis=1).astype(np.uint32)
+
+class NearDuplicateIndex:
+    """
+    Incremental MinHash/LSH index of every chunk ingested so far.
+
+    Each cluster of near-identical chunks keeps one representative (the only
+    chunk written to the vector store) and back-references to every member's
+    source, page and offset. New clusters and members are appended to a log
+    file, so adding a document never rewrites the whole index, but only once
+    the chunks they describe are stored: until then they stay pending.
+    """
+
+    def __init__(self, path, threshold=DEDUP_THRESHOLD):
+        self.path = path
+        self.threshold = threshold
+        self.signatures = {}
+        self.members = {}
+        self.member_clusters = {}
+        self.buckets = {}
+        self._lock = threading.Lock()
+        # Held while a batch is pending, so no other writer dedups against
+        # a chunk that may never be stored.
+        self._batch_lock = threading.RLock()
+        self._load()
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, "rb") as f:
+            while True:
+                try:
+                    record = pickle.load(f)
+                except EOFError:
+                    break
+                except pickle.UnpicklingError:
+                    # A torn final record from a crash mid-append; everything before it is intact.
+                    print(f"Ignoring a truncated record at the end of {self.path}.")
+                    break
+                self._apply(record)
+        print(f"Near-duplicate index loaded: {len(self.signatures)} clusters, {len(self.member_clusters)} chunks.")
+
+    def _apply(self, record):
+        for cluster_id, signature in record["clusters"]:
+            self.signatures[cluster_id] = signature
+            self.members.setdefault(cluster_id, [])
+            for band in self._band_keys(signature):
+                self.buckets.setdefault(band, []).append(cluster_id)
+        for cluster_id, member in record["members"]:
+            self.members[cluster_id].append(member)
+            self.member_clusters[member["chunk_id"]] = cluster_id
+        removed = set(record.get("removed_sources", ()))
+        if removed:
+            self._drop_members(lambda member: member["source"] in removed)
+        removed_chunks = set(record.get("removed_chunks", ()))
+        if removed_chunks:
+            self._drop_members(lambda member: member["chunk_id"] in removed_chunks)
+
+    def _drop_members(self, dropped):
+        for cluster_id in list(self.members):
+            kept = [member for member in self.members[cluster_id] if not dropped(member)]
+            if len(kept) == len(self.members[cluster_id]):
+                continue
+            for member in self.members[cluster_id]:
+                if dropped(member):
+                    self.member_clusters.pop(member["chunk_id"], None)
+            if kept:
+                self.members[cluster_id] = kept
+                continue
+            # No document has this paragraph any more; forget the cluster.
+            self._forget_cluster(cluster_id)
+
+    def _forget_cluster(self, cluster_id):
+        del self.members[cluster_id]
+        signature = self.signatures.pop(cluster_id, None)
+        if signature is not None:
+            for band in self._band_keys(signature):
+                self.buckets[band].remove(cluster_id)
+
+    def _undo(self, record):
+        # Reverts a pending record; nothing was added on top of it meanwhile.
+        for cluster_id, member in record["members"]:
+            self.members[cluster_id].remove(member)
+            self.member_clusters.pop(member["chunk_id"], None)
+        for cluster_id, _ in record["clusters"]:
+            self._forget_cluster(cluster_id)
+
+    def _append(self, record):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        with open(self.path, "ab") as f:
+            pickle.dump(record, f, protocol=pickle.HIGHEST_PROTOCOL)
+            f.flush()
+            os.fsync(f.fileno())
+
+    @staticmethod
+    def _band_keys(signature):
+        rows = NUM_PERM // BANDS
+        return [(band, signature[band * rows:(band + 1) * rows].tobytes()) for band in range(BANDS)]
+
+    def _find_cluster(self, signature):
+        best_cluster, best_score = None, self.threshold
+        for band in self._band_keys(signature):
+            for cluster_id in self.buckets.get(band, ()):
+                score = float(np.mean(self.signatures[cluster_id] == signature))
+                if score >= best_score:
+                    best_cluster, best_score = cluster_id, score
+        return best_cluster
+
+    @contextmanager
+    def add_chunks(self, chunks):
+        """
+        Registers chunks and yields only those that start a new cluster:
+        `with index.add_chunks(chunks) as unique: <store unique>`.
+
+        Near-duplicates of an existing cluster (from this or any earlier
+        document) are recorded as back-references and dropped. Every chunk gets
+        a `dup_cluster` metadata field naming its cluster. The new records are
+        appended to the log when the block completes and undone if it raises,
+        so a failed write leaves no cluster without its stored representative.
+
+        Args:
+            chunks (list): Chunk Documents carrying a `chunk_id` in their metadata.
+
+        Yields:
+            list: The chunks that should be embedded and stored.
+        """
+        with self._batch_lock:
+            unique, record = self._register(chunks)
+            dropped = len(chunks) - len(unique)
+            if dropped:
+                print(f"Near-duplicate filter dropped {dropped} of {len(chunks)} chunks.")
+            try:
+                yield unique
+            except BaseException:
+                with self._lock:
+                    self._undo(record)
+                raise
+            if record["clusters"] or record["members"]:
+                with self._lock:
+                    self._append(record)
+
+    def _register(self, chunks):
+        unique = []
+        record = {"clusters": [], "members": []}
+        with self._lock:
+            for chunk in chunks:
+                chunk_id = chunk.metadata["chunk_id"]
+                member = {
+                    "chunk_id": chunk_id,
+                    "source": chunk.metadata.get("source"),
+                    "page": chunk.metadata.get("page"),
+                    "start_index": chunk.metadata.get("start_index"),
+                }
+                if chunk_id in self.member_clusters:
+                    # Re-ingesting the same chunk; keep it only if it is the stored representative.
+                    cluster_id = self.member_clusters[chunk_id]
+                    chunk.metadata["dup_cluster"] = cluster_id
+                    if cluster_id == chunk_id:
+                        unique.append(chunk)
+                    continue
+
+                signature = minhash_signature(chunk.page_content)
+                if signature is None:
+                    # Nothing to compare (no words); always keep it.
+                    chunk.metadata["dup_cluster"] = chunk_id
+                    unique.append(chunk)
+                    continue
+                cluster_id = self._find_cluster(signature)
+                update = {"clusters": [], "members": []}
+                if cluster_id is None:
+                    cluster_id = chunk_id
+                    update["clusters"].append((cluster_id, signature))
+                    unique.append(chunk)
+                update["members"].append((cluster_id, member))
+                self._apply(update)
+                record["clusters"].extend(update["clusters"])
+                record["members"].extend(update["members"])
+                chunk.metadata["dup_cluster"] = cluster_id
+        return unique, record
+
+    def remove_sources(self, sources):
+        """
+        Drops every back-reference to the given documents (after they are
+        deleted from the vector store); clusters left empty are forgotten, so
+        a later copy of the same paragraph is stored again.
+        """
+        record = {"clusters": [], "members": [], "removed_sources": sorted(sources)}
+        with self._batch_lock, self._lock:
+            self._apply(record)
+            self._append(record)
+
+    def retain(self, stored):
+        """
+        Keeps only what the vector store still holds (e.g. after it was rolled
+        back): clusters whose representative is gone are forgotten, and members
+        whose document the representative no longer lists are dropped.
+
+        Args:
+            stored (dict): Representative chunk id -> its stored `sources`, for
+                every cluster's representative still in the vector store.
+        """
+        with self._batch_lock, self._lock:
+            removed = [
+                member["chunk_id"]
+                for cluster_id, members in self.members.items()
+                for member in members
+                if cluster_id not in stored or member["source"] not in stored[cluster_id]
+            ]
+            if removed:
+                record = {"clusters": [], "members": [], "removed_chunks": removed}
+                self._apply(record)
+                self._append(record)
+        if removed:
+            print(f"Near-duplicate index dropped {len(removed)} chunks the vector store no longer holds.")
+
+    def sources(self, cluster_id):
+        """
+        Returns the back-references (source, page, start_index) of every chunk in a cluster.
+        """
+        return list(self.members.get(cluster_id, []))
+
+    def stats(self):
+        chunks = len(self.member_clusters)
+        clusters = len(self.members)
+        return {"chunks": chunks, "clusters": clusters, "duplicates": chunks - clusters}
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+def get_dedup_index(namespace=""):
+    """
+    Returns the process-wide near-duplicate index of a namespace, loading it on first use.
+    """
+    with _indexes_lock:
+        if namespace not in _indexes:
+            _indexes[namespace] = NearDuplicateIndex(os.path.join(namespace_dir(namespace, DEDUP_DIR), "clusters.log"))
+        return _indexes[namespace]
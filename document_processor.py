@@ -1,41 +1,238 @@
 # document_processor.py
 
+import hashlib
+import json
+import math
 import os
-from langchain_community.document_loaders import PyMuPDFLoader
-from langchain.text_splitter import RecursiveCharacterTextSplitter # <-- This line was missing
+import re
+from collections import Counter
+from functools import lru_cache
+
 from langchain_community.embeddings import HuggingFaceEmbeddings
 
-def load_and_chunk_document(file_path):
+from cpu_config import apply_thread_config
+from embedding_batcher import EMBED_BATCHING, BatchingEmbeddings
+from embedding_server import EMBEDDING_SERVER_SOCKET, RemoteEmbeddings
+from offset_splitter import OffsetTextSplitter, TokenAwareSplitter
+from page_cache import load_pages
+
+EMBEDDING_MODEL_NAME = "all-MiniLM-L6-v2"
+
+# "chars" sizes chunks at 1000 characters; "tokens" sizes them to the
+# embedding model's max sequence length so nothing is truncated when embedded.
+CHUNKING_MODE = os.getenv("CHUNKING_MODE", "chars")
+TOKEN_CHUNK_OVERLAP = int(os.getenv("TOKEN_CHUNK_OVERLAP", "50"))
+
+# Remove repeated page headers/footers, page numbers and watermarks before chunking.
+STRIP_BOILERPLATE = os.getenv("STRIP_BOILERPLATE", "true").lower() in ("1", "true", "yes")
+# A line near the top/bottom edge on at least this share of pages is a header/footer.
+HEADER_FOOTER_MIN_RATIO = 0.3
+# A line anywhere on at least this share of pages is a watermark or banner,
+# if it is text of at least WATERMARK_MIN_CHARS without digits; recurring
+# labels ("Solution:"), totals and numeric table rows are content.
+WATERMARK_MIN_RATIO = 0.8
+WATERMARK_MIN_CHARS = 10
+# Documents shorter than this are never stripped: repetition says too little.
+MIN_REPEAT_PAGES = 5
+
+_ZERO_WIDTH = re.compile("[\u200b\u200c\u200d\ufeff]")
+
+def _hub_model_id(model_name):
+    # sentence-transformers resolves bare names to its own organisation.
+    return model_name if "/" in model_name else f"sentence-transformers/{model_name}"
+
+@lru_cache(maxsize=None)
+def get_tokenizer(model_name=EMBEDDING_MODEL_NAME):
+    """
+    Loads (once per process) the fast tokenizer matching the embedding model.
+    """
+    from transformers import AutoTokenizer
+    return AutoTokenizer.from_pretrained(_hub_model_id(model_name), use_fast=True)
+
+@lru_cache(maxsize=None)
+def get_max_seq_length(model_name=EMBEDDING_MODEL_NAME):
+    """
+    Returns the number of word pieces the embedding model reads before truncating
+    (256 for all-MiniLM-L6-v2), including its [CLS]/[SEP] tokens.
+    """
+    try:
+        from huggingface_hub import hf_hub_download
+        config_path = hf_hub_download(_hub_model_id(model_name), "sentence_bert_config.json")
+        with open(config_path) as f:
+            return int(json.load(f)["max_seq_length"])
+    except Exception as e:
+        print(f"Could not read max_seq_length for '{model_name}', using the tokenizer limit: {e}")
+        return min(get_tokenizer(model_name).model_max_length, 512)
+
+def _normalize_line(line):
+    # Page numbers and dates differ on every page, so digits are masked.
+    line = _ZERO_WIDTH.sub("", line)
+    return re.sub(r"\d+", "#", " ".join(line.lower().split()))
+
+def _is_watermark_text(key):
+    # `key` is a normalized line, with digits masked as "#".
+    letters = sum(c.isalpha() for c in key)
+    return "#" not in key and len(key) >= WATERMARK_MIN_CHARS and letters >= 0.8 * len(key.replace(" ", ""))
+
+def _edge_matches(normalized, edge, headers_footers):
+    # Indexes of header/footer lines among the edge lines the page starts with
+    # (pass the lines reversed for the bottom edge). Lines past that run are
+    # body text: a table value "90" stays even if page numbers mask the same.
+    edge, matches = Counter(edge), set()
+    for i, key in enumerate(normalized):
+        if not key:
+            continue
+        if edge[key] <= 0:
+            break
+        edge[key] -= 1
+        if key in headers_footers:
+            matches.add(i)
+    return matches
+
+def strip_repeated_lines(documents):
+    """
+    Removes lines repeated across pages: headers and footers (lines near the
+    page edge on many pages, e.g. titles and page numbers, removed only at
+    that edge) and watermarks
+    (lines of text on nearly every page, anywhere). Documents of fewer than
+    MIN_REPEAT_PAGES pages are left as they are.
+
+    Args:
+        documents (list): One Document per page, loaded with include_layout=True.
+
+    Returns:
+        tuple: (documents with boilerplate removed, report dict with bytes/lines removed).
+    """
+    page_count = len(documents)
+    if page_count < MIN_REPEAT_PAGES:
+        for document in documents:
+            document.metadata.pop("edge_lines", None)
+        size = sum(len(document.page_content.encode("utf-8")) for document in documents)
+        return documents, {"pages": page_count, "bytes_before": size, "bytes_removed": 0,
+                           "lines_removed": 0, "patterns": []}
+    edge_counts, line_counts = Counter(), Counter()
+    page_edges, page_lines = [], []
+    for document in documents:
+        # Edge lines are split by side, since a header may only be removed at the top.
+        top, bottom = Counter(), Counter()
+        for text, position in document.metadata.pop("edge_lines", []):
+            key = _normalize_line(text)
+            if key:
+                (top if position < 0.5 else bottom)[key] += 1
+        lines = document.page_content.splitlines()
+        normalized = [_normalize_line(line) for line in lines]
+        edge_counts.update(set(top) | set(bottom))
+        line_counts.update(set(normalized) - {""})
+        page_edges.append((top, bottom))
+        page_lines.append((lines, normalized))
+
+    min_edge_pages = max(MIN_REPEAT_PAGES, math.ceil(HEADER_FOOTER_MIN_RATIO * page_count))
+    min_watermark_pages = max(MIN_REPEAT_PAGES, math.ceil(WATERMARK_MIN_RATIO * page_count))
+    headers_footers = {line for line, count in edge_counts.items() if count >= min_edge_pages}
+    watermarks = {line for line, count in line_counts.items()
+                  if count >= min_watermark_pages and _is_watermark_text(line)}
+
+    report = {"pages": page_count, "bytes_before": 0, "bytes_removed": 0, "lines_removed": 0,
+              "patterns": sorted(headers_footers | watermarks)}
+    for document, (top, bottom), (lines, normalized) in zip(documents, page_edges, page_lines):
+        report["bytes_before"] += len(document.page_content.encode("utf-8"))
+        removed = _edge_matches(normalized, top, headers_footers)
+        removed |= {len(lines) - 1 - i for i in _edge_matches(normalized[::-1], bottom, headers_footers)}
+        removed |= {i for i, key in enumerate(normalized) if key in watermarks}
+        if not removed:
+            continue
+        for i in removed:
+            report["bytes_removed"] += len(lines[i].encode("utf-8")) + 1
+            report["lines_removed"] += 1
+        kept = [line for i, line in enumerate(lines) if i not in removed]
+        document.page_content = "\n".join(kept) + ("\n" if document.page_content.endswith("\n") else "")
+    return documents, report
+
+def make_chunk_id(metadata):
+    """
+    Returns a stable ID for a chunk from its document's content hash, page and
+    start offset, so re-ingesting the same file yields the same IDs.
+    """
+    key = f"{metadata.get('content_hash')}:{metadata.get('page')}:{metadata.get('start_index')}"
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()[:32]
+
+def get_text_splitter(chunking_mode=CHUNKING_MODE, model_name=EMBEDDING_MODEL_NAME):
+    """
+    Returns the splitter for the given chunking mode ("chars" or "tokens").
+    """
+    if chunking_mode == "chars":
+        return OffsetTextSplitter(chunk_size=1000, chunk_overlap=200)
+    if chunking_mode == "tokens":
+        tokenizer = get_tokenizer(model_name)
+        # Leave room for the special tokens the model adds around every input.
+        max_tokens = get_max_seq_length(model_name) - tokenizer.num_special_tokens_to_add()
+        return TokenAwareSplitter(tokenizer, chunk_size=max_tokens, chunk_overlap=TOKEN_CHUNK_OVERLAP)
+    raise ValueError(f"Unknown chunking mode '{chunking_mode}'. Use 'chars' or 'tokens'.")
+
+def load_and_chunk_document(source, chunking_mode=CHUNKING_MODE, name=None, persist=False):
     """
-    Loads a document from the given file path and splits it into chunks.
+    Loads a document and splits it into chunks. The document can be a file
+    path or the PDF content itself (bytes, memoryview or a binary stream),
+    which is parsed from memory without writing a temp file.
+    Page text comes from the page cache when the file was parsed before, and
+    repeated headers, footers and watermarks are stripped before chunking.
+    Each chunk records its (start_index, end_index) offsets in the page text,
+    and in "tokens" mode its `token_count`, plus a stable `chunk_id`.
 
     Args:
-        file_path (str): The path to the document file.
+        source: The path to the document file, or its content.
+        chunking_mode (str): "chars" or "tokens".
+        name (str): Display name (e.g. the upload's file name) for in-memory content.
+        persist (bool): Keep in-memory content in the content-addressed upload store.
 
     Returns:
         list: A list of document chunks, or None if an error occurs.
     """
+    display_name = name or (os.fspath(source) if isinstance(source, (str, os.PathLike)) else "uploaded document")
     try:
-        loader = PyMuPDFLoader(file_path)
-        documents = loader.load()
-        text_splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=200)
+        documents = load_pages(source, name=name, persist=persist, include_layout=STRIP_BOILERPLATE)
+        if STRIP_BOILERPLATE:
+            documents, report = strip_repeated_lines(documents)
+            if report["lines_removed"]:
+                share = 100 * report["bytes_removed"] / max(report["bytes_before"], 1)
+                print(f"Stripped {report['lines_removed']} repeated header/footer lines "
+                      f"({report['bytes_removed']} bytes, {share:.1f}%) from {os.path.basename(display_name)}.")
+        text_splitter = get_text_splitter(chunking_mode)
         chunked_docs = text_splitter.split_documents(documents)
-        print(f"Successfully loaded and chunked document: {os.path.basename(file_path)}")
+        for chunk in chunked_docs:
+            chunk.metadata["chunk_id"] = make_chunk_id(chunk.metadata)
+        print(f"Successfully loaded and chunked document: {os.path.basename(display_name)}")
         return chunked_docs
     except Exception as e:
-        print(f"Error processing document {file_path}: {e}")
+        print(f"Error processing document {display_name}: {e}")
         return None
 
-def get_embeddings_model(model_name="all-MiniLM-L6-v2"):
+def get_embeddings_model(model_name=EMBEDDING_MODEL_NAME):
     """
     Initializes and returns a sentence-transformer model for embeddings.
+    Unless EMBED_BATCHING is off, concurrent query embeddings are micro-batched.
+    If EMBEDDING_SERVER_SOCKET is set, a client for the shared embedding server
+    is returned instead, falling back to a local model if it is unreachable.
+    Local models run with the thread/affinity settings from cpu_config.
 
     Args:
         model_name (str): The name of the Hugging Face model to use.
 
     Returns:
-        HuggingFaceEmbeddings: The embedding model instance.
+        Embeddings: The embedding model instance.
     """
+    if EMBEDDING_SERVER_SOCKET:
+        try:
+            embeddings = RemoteEmbeddings(EMBEDDING_SERVER_SOCKET)
+            if embeddings.model_name != model_name:
+                raise ValueError(f"server runs '{embeddings.model_name}', not '{model_name}'")
+            print(f"Using the shared embedding server at {EMBEDDING_SERVER_SOCKET}.")
+            return embeddings
+        except Exception as e:
+            print(f"Embedding server unavailable, loading the model locally: {e}")
+    apply_thread_config()
     embeddings = HuggingFaceEmbeddings(model_name=model_name)
     print(f"Embedding model '{model_name}' loaded.")
+    if EMBED_BATCHING:
+        return BatchingEmbeddings(embeddings)
     return embeddings
\ No newline at end of file
@@ -0,0 +1,121 @@
+# embedding_batcher.py
+
+import asyncio
+import os
+import queue
+import threading
+import time
+from collections import Counter
+from concurrent.futures import Future
+
+from langchain_core.embeddings import Embeddings
+
+EMBED_BATCHING = os.getenv("EMBED_BATCHING", "true").lower() in ("1", "true", "yes")
+# How long the first query of a batch waits for others to join it.
+EMBED_BATCH_WINDOW_MS = float(os.getenv("EMBED_BATCH_WINDOW_MS", "3"))
+EMBED_MAX_BATCH = int(os.getenv("EMBED_MAX_BATCH", "32"))
+
+def _bucket(size):
+    # Power-of-two histogram buckets: 1, 2, 4, 8, ...
+    return 1 << (size - 1).bit_length()
+
+class BatchingEmbeddings(Embeddings):
+    """
+    Wraps an Embeddings model so concurrent `embed_query` calls share forward passes.
+
+    Queries are queued to a single worker thread, which collects everything
+    arriving within EMBED_BATCH_WINDOW_MS of the first query (or up to
+    EMBED_MAX_BATCH queries) and embeds them with one `embed_documents` call.
+    Each caller blocks on its own future. Document embedding at ingest is
+    already batched and is passed straight through.
+    """
+
+    def __init__(self, model, window_ms=EMBED_BATCH_WINDOW_MS, max_batch=EMBED_MAX_BATCH):
+        self.model = model
+        self.window = window_ms / 1000
+        self.max_batch = max_batch
+        self._queue = queue.Queue()
+        self._stats_lock = threading.Lock()
+        self._batch_sizes = Counter()
+        self._queue_depths = Counter()
+        self._max_queue_depth = 0
+        self._queries = 0
+        self._worker = threading.Thread(target=self._run, name="embedding-batcher", daemon=True)
+        self._worker.start()
+
+    def __getattr__(self, name):
+        # Expose the wrapped model's attributes (model_name, client, ...).
+        if name == "model":
+            raise AttributeError(name)
+        return getattr(self.model, name)
+
+    def _collect(self):
+        batch = [self._queue.get()]
+        deadline = time.perf_counter() + self.window
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.perf_counter()
+            try:
+                batch.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            depth = self._queue.qsize()
+            # Identical questions in the same window are embedded once.
+            texts = list(dict.fromkeys(text for text, _ in batch))
+            try:
+                vectors = dict(zip(texts, self.model.embed_documents(texts)))
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            finally:
+                with self._stats_lock:
+                    self._batch_sizes[_bucket(len(batch))] += 1
+                    self._queue_depths[_bucket(depth) if depth else 0] += 1
+                    self._queries += len(batch)
+            for text, future in batch:
+                future.set_result(vectors[text])
+
+    def submit(self, text):
+        """
+        Queues a query and returns a concurrent.futures.Future for its embedding.
+        """
+        future = Future()
+        self._queue.put((text, future))
+        depth = self._queue.qsize()
+        if depth > self._max_queue_depth:
+            self._max_queue_depth = depth
+        return future
+
+    def embed_query(self, text):
+        return self.submit(text).result()
+
+    async def aembed_query(self, text):
+        return await asyncio.wrap_future(self.submit(text))
+
+    def embed_documents(self, texts):
+        return self.model.embed_documents(texts)
+
+    async def aembed_documents(self, texts):
+        return await asyncio.to_thread(self.model.embed_documents, texts)
+
+    def stats(self):
+        """
+        Returns the current queue depth, the largest depth seen, and histograms
+        (power-of-two buckets) of batch sizes and of the backlog left after each batch.
+        """
+        with self._stats_lock:
+            batches = sum(self._batch_sizes.values())
+            return {
+                "queue_depth": self._queue.qsize(),
+                "max_queue_depth": self._max_queue_depth,
+                "queries": self._queries,
+                "batches": batches,
+                "mean_batch_size": self._queries / batches if batches else 0.0,
+                "batch_size_histogram": dict(sorted(self._batch_sizes.items())),
+                "queue_depth_histogram": dict(sorted(self._queue_depths.items())),
+            }
@@ -0,0 +1,219 @@
+# embedding_server.py
+
+"""
+Shared embedding service for several app or ingest processes on one machine.
+
+One process owns the embedding model and serves it over a Unix socket, so
+each worker no longer loads its own copy of the model and torch runtime.
+Queries from all clients are micro-batched together (see BatchingEmbeddings)
+and their embeddings cached in one shared QueryEmbeddingCache, so a query
+embedded for one worker is a cache hit for all the others.
+
+    python embedding_server.py --socket /tmp/rag-embeddings.sock --threads 4 --cpus 0-3
+
+Workers use it by setting EMBEDDING_SERVER_SOCKET to the same path;
+get_embeddings_model then returns a RemoteEmbeddings client.
+"""
+
+import argparse
+import json
+import os
+import socket
+import socketserver
+import struct
+import threading
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from cpu_config import apply_thread_config, resolve_thread_config
+from embedding_batcher import BatchingEmbeddings
+from query_cache import QUERY_EMBEDDING_CACHE_MB, QueryEmbeddingCache, normalize_query
+
+EMBEDDING_SERVER_SOCKET = os.getenv("EMBEDDING_SERVER_SOCKET", "")
+EMBEDDING_SERVER_TIMEOUT = float(os.getenv("EMBEDDING_SERVER_TIMEOUT", "30"))
+
+# Each message is a 4-byte big-endian length followed by the body. A request is
+# one JSON frame; a response is a JSON header frame followed by a frame of
+# float32 vectors (row-major, header["count"] x header["dim"]).
+_LENGTH = struct.Struct(">I")
+
+def _recv_exact(sock, size):
+    buffer = bytearray(size)
+    view = memoryview(buffer)
+    received = 0
+    while received < size:
+        count = sock.recv_into(view[received:])
+        if count == 0:
+            raise ConnectionError("embedding server connection closed")
+        received += count
+    return bytes(buffer)
+
+def _send_frame(sock, body):
+    sock.sendall(_LENGTH.pack(len(body)) + body)
+
+def _recv_frame(sock):
+    (size,) = _LENGTH.unpack(_recv_exact(sock, _LENGTH.size))
+    return _recv_exact(sock, size)
+
+def _remove_stale_socket(socket_path):
+    # A socket file left by a crashed server is removed; one a live server
+    # still accepts connections on is not.
+    if not os.path.exists(socket_path):
+        return
+    probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        probe.connect(socket_path)
+    except ConnectionRefusedError:
+        os.remove(socket_path)
+        return
+    finally:
+        probe.close()
+    raise RuntimeError(f"An embedding server is already listening on {socket_path}")
+
+class _Handler(socketserver.BaseRequestHandler):
+    # One connection per client thread; requests on it are served in order.
+    def handle(self):
+        while True:
+            try:
+                request = json.loads(_recv_frame(self.request))
+            except ConnectionError:
+                return
+            try:
+                header, vectors = self.server.dispatch(request)
+            except Exception as e:
+                header, vectors = {"error": f"{type(e).__name__}: {e}"}, np.zeros((0, 0), dtype=np.float32)
+            _send_frame(self.request, json.dumps(header).encode("utf-8"))
+            _send_frame(self.request, vectors.tobytes())
+
+class EmbeddingServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """
+    Serves one embeddings model to local clients over a Unix socket.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, socket_path, model, model_name, query_cache_mb=QUERY_EMBEDDING_CACHE_MB):
+        _remove_stale_socket(socket_path)
+        self.model = model if isinstance(model, BatchingEmbeddings) else BatchingEmbeddings(model)
+        self.model_name = model_name
+        self.query_cache = QueryEmbeddingCache(int(query_cache_mb * 1024 * 1024)) if query_cache_mb > 0 else None
+        super().__init__(socket_path, _Handler)
+        # Only the owning user's processes may connect.
+        os.chmod(socket_path, 0o600)
+
+    def dispatch(self, request):
+        op = request.get("op")
+        if op == "info":
+            stats = dict(self.model.stats())
+            if self.query_cache is not None:
+                stats["query_cache"] = self.query_cache.report()
+            return {"model_name": self.model_name, "count": 0, "dim": 0, "stats": stats}, np.zeros((0, 0), dtype=np.float32)
+        texts = request["texts"]
+        if op == "query":
+            vectors = self._embed_queries(texts)
+        elif op == "documents":
+            vectors = self.model.embed_documents(texts)
+        else:
+            raise ValueError(f"unknown op {op!r}")
+        array = np.asarray(vectors, dtype=np.float32).reshape(len(texts), -1)
+        return {"count": array.shape[0], "dim": array.shape[1]}, array
+
+    def _embed_queries(self, texts):
+        if self.query_cache is None:
+            futures = [self.model.submit(text) for text in texts]
+            return [future.result() for future in futures]
+        texts = [normalize_query(text) for text in texts]
+        vectors = [self.query_cache.get(self.model_name, text) for text in texts]
+        futures = {i: self.model.submit(text) for i, text in enumerate(texts) if vectors[i] is None}
+        for i, future in futures.items():
+            vectors[i] = self.query_cache.put(self.model_name, texts[i], future.result())
+        return vectors
+
+    def server_close(self):
+        super().server_close()
+        if os.path.exists(self.server_address):
+            os.remove(self.server_address)
+
+class RemoteEmbeddings(Embeddings):
+    """
+    Embeddings client for an EmbeddingServer; a drop-in for the local model.
+
+    Each calling thread keeps its own connection, and a broken connection is
+    re-opened once before giving up.
+    """
+
+    def __init__(self, socket_path=EMBEDDING_SERVER_SOCKET, timeout=EMBEDDING_SERVER_TIMEOUT):
+        self.socket_path = socket_path
+        self.timeout = timeout
+        self._local = threading.local()
+        self.model_name = self._call("info", [])[0]["model_name"]
+
+    def _connection(self):
+        sock = getattr(self._local, "sock", None)
+        if sock is None:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.settimeout(self.timeout)
+            sock.connect(self.socket_path)
+            self._local.sock = sock
+        return sock
+
+    def _reset(self):
+        sock = getattr(self._local, "sock", None)
+        if sock is not None:
+            sock.close()
+            self._local.sock = None
+
+    def _call(self, op, texts):
+        body = json.dumps({"op": op, "texts": texts}).encode("utf-8")
+        for attempt in range(2):
+            try:
+                sock = self._connection()
+                _send_frame(sock, body)
+                header = json.loads(_recv_frame(sock))
+                payload = _recv_frame(sock)
+                break
+            except (ConnectionError, OSError):
+                self._reset()
+                if attempt:
+                    raise
+        if "error" in header:
+            raise RuntimeError(f"Embedding server error: {header['error']}")
+        vectors = np.frombuffer(payload, dtype=np.float32).reshape(header["count"], header["dim"])
+        return header, vectors
+
+    def embed_query(self, text):
+        return self._call("query", [text])[1][0].tolist()
+
+    def embed_documents(self, texts):
+        if not texts:
+            return []
+        return self._call("documents", list(texts))[1].tolist()
+
+    def stats(self):
+        """Returns the server's batching statistics."""
+        return self._call("info", [])[0]["stats"]
+
+if __name__ == "__main__":
+    from langchain_community.embeddings import HuggingFaceEmbeddings
+
+    from document_processor import EMBEDDING_MODEL_NAME
+
+    parser = argparse.ArgumentParser(description="Serve the embedding model to local worker processes.")
+    parser.add_argument("--socket", default=EMBEDDING_SERVER_SOCKET or "/tmp/rag-embeddings.sock")
+    parser.add_argument("--model", default=EMBEDDING_MODEL_NAME)
+    parser.add_argument("--threads", default="auto", help="torch intra-op threads (default: all pinned/available cores)")
+    parser.add_argument("--cpus", default="", help="CPU ids to pin the server to, e.g. 0-3")
+    parser.add_argument("--query-cache-mb", type=float, default=QUERY_EMBEDDING_CACHE_MB,
+                        help="memory for the shared query-embedding cache (0 disables it)")
+    args = parser.parse_args()
+
+    apply_thread_config(resolve_thread_config(workers=1, intra_op=args.threads, affinity=args.cpus))
+    server = EmbeddingServer(args.socket, HuggingFaceEmbeddings(model_name=args.model), args.model, args.query_cache_mb)
+    print(f"Serving '{args.model}' embeddings on {args.socket}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
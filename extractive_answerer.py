@@ -0,0 +1,167 @@
+# extractive_answerer.py
+
+import asyncio
+import os
+import re
+import threading
+import time
+
+import numpy as np
+
+from query_cache import get_query_embedding_cache
+
+# Minimum cosine similarity between the query and a sentence to answer without the LLM.
+EXTRACTIVE_THRESHOLD = float(os.getenv("EXTRACTIVE_THRESHOLD", "0.75"))
+EXTRACTIVE_ENABLED = os.getenv("EXTRACTIVE_ENABLED", "true").lower() in ("1", "true", "yes")
+
+MIN_SENTENCE_CHARS = 20
+MAX_SENTENCE_CHARS = 400
+
+# Short factual lookups ("what is", "define", "full form of"...). Open-ended
+# questions ("explain", "compare", "why") always go to the LLM.
+_LOOKUP_PATTERN = re.compile(
+    r"^\s*(what\s+(is|are|does)|who\s+(is|was)|when\s+(is|was|did)|where\s+is|which\s+is|define)\b"
+    r"|\b(definition|meaning|full\s+form)\s+of\b|\bstands?\s+for\b|\bmeant\s+by\b",
+    re.IGNORECASE,
+)
+_OPEN_ENDED_PATTERN = re.compile(r"\b(explain|why|how|compare|difference|describe|discuss|elaborate)\b", re.IGNORECASE)
+_SENTENCE_END = re.compile(r"(?<=[.!?])\s+")
+
+_stats = {"questions": 0, "eligible": 0, "answered": 0, "seconds": 0.0}
+_stats_lock = threading.Lock()
+
+def is_lookup_question(query):
+    """
+    Returns True for short factual questions an extracted sentence can answer.
+    """
+    return bool(_LOOKUP_PATTERN.search(query)) and not _OPEN_ENDED_PATTERN.search(query)
+
+def split_sentences(text):
+    """
+    Splits text into sentences, returning (start, end) character spans.
+    """
+    spans = []
+    start = 0
+    for match in _SENTENCE_END.finditer(text):
+        spans.append((start, match.start()))
+        start = match.end()
+    if start < len(text):
+        spans.append((start, len(text)))
+    return spans
+
+def _candidate_sentences(docs):
+    candidates = []
+    for doc_index, doc in enumerate(docs):
+        text = doc.page_content
+        for start, end in split_sentences(text):
+            sentence = " ".join(text[start:end].split())
+            if MIN_SENTENCE_CHARS <= len(sentence) <= MAX_SENTENCE_CHARS:
+                candidates.append((doc_index, start, end, sentence))
+    return candidates
+
+def format_citation(metadata):
+    """
+    Formats a chunk's source file and 1-based page number for display.
+    """
+    source = os.path.basename(str(metadata.get("source", "document")))
+    page = metadata.get("page")
+    return f"{source}, page {int(page) + 1}" if page is not None else source
+
+def extractive_answer(query, docs, embeddings_model, threshold=None):
+    """
+    Scores every sentence of the retrieved chunks against the query embedding and
+    returns the best one when its similarity clears the threshold.
+
+    Args:
+        query (str): The user's question.
+        docs (list): Retrieved document chunks.
+        embeddings_model: The embeddings model used by the vector store.
+        threshold (float): Minimum cosine similarity; defaults to EXTRACTIVE_THRESHOLD.
+
+    Returns:
+        dict: The answer sentence, its score, citation and (start, end) span in
+        the chunk, or None if no sentence is confident enough.
+    """
+    threshold = EXTRACTIVE_THRESHOLD if threshold is None else threshold
+    candidates = _candidate_sentences(docs)
+    if not candidates:
+        return None
+
+    # Usually a cache hit: retrieval has just embedded the same query.
+    cache = get_query_embedding_cache()
+    query_vector = cache.embed_query(embeddings_model, query) if cache is not None else embeddings_model.embed_query(query)
+    query_vector = np.asarray(query_vector, dtype=np.float32)
+    sentence_vectors = np.asarray(embeddings_model.embed_documents([c[3] for c in candidates]), dtype=np.float32)
+    norms = np.linalg.norm(sentence_vectors, axis=1) * np.linalg.norm(query_vector)
+    scores = sentence_vectors @ query_vector / np.maximum(norms, 1e-12)
+
+    best = int(np.argmax(scores))
+    if scores[best] < threshold:
+        return None
+    doc_index, start, end, sentence = candidates[best]
+    return {
+        "answer": sentence,
+        "score": float(scores[best]),
+        "citation": format_citation(docs[doc_index].metadata),
+        "span": (start, end),
+        "document": docs[doc_index],
+    }
+
+def _eligible(query, embeddings_model):
+    with _stats_lock:
+        _stats["questions"] += 1
+    return EXTRACTIVE_ENABLED and embeddings_model is not None and is_lookup_question(query)
+
+def _finish(started, result):
+    with _stats_lock:
+        _stats["eligible"] += 1
+        _stats["seconds"] += time.perf_counter() - started
+        if result is not None:
+            _stats["answered"] += 1
+    if result is None:
+        return None
+    return f"{result['answer']}\n\n_Source: {result['citation']}_"
+
+def try_extractive_answer(query, docs, embeddings_model, threshold=None, run=None):
+    """
+    Fast path for get_answer_from_query: returns a cited answer string, or None to fall back to the LLM.
+    `run`, if given, is called with the function doing the embedding work and
+    returns its result (e.g. under a circuit breaker); if it raises, the LLM answers.
+    """
+    if not _eligible(query, embeddings_model):
+        return None
+    started = time.perf_counter()
+    work = lambda: extractive_answer(query, docs, embeddings_model, threshold)
+    try:
+        result = work() if run is None else run(work)
+    except Exception as e:
+        print(f"Extractive answerer failed, falling back to the LLM: {e}")
+        result = None
+    return _finish(started, result)
+
+async def atry_extractive_answer(query, docs, embeddings_model, threshold=None, run=None):
+    """
+    Async version of try_extractive_answer; `run` is awaited. Without it the
+    embedding work runs on a worker thread, never on the event loop.
+    """
+    if not _eligible(query, embeddings_model):
+        return None
+    started = time.perf_counter()
+    work = lambda: extractive_answer(query, docs, embeddings_model, threshold)
+    try:
+        result = await (asyncio.to_thread(work) if run is None else run(work))
+    except Exception as e:
+        print(f"Extractive answerer failed, falling back to the LLM: {e}")
+        result = None
+    return _finish(started, result)
+
+def get_extractive_report():
+    """
+    Returns how often the extractive fast path fired and what it cost.
+    """
+    with _stats_lock:
+        report = dict(_stats)
+    report["fire_rate"] = report["answered"] / report["questions"] if report["questions"] else 0.0
+    report["eligible_hit_rate"] = report["answered"] / report["eligible"] if report["eligible"] else 0.0
+    report["avg_ms"] = 1000 * report["seconds"] / report["eligible"] if report["eligible"] else 0.0
+    return report
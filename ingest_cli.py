@@ -0,0 +1,217 @@
+# ingest_cli.py
+
+"""
+Bulk ingestion of a directory tree of PDFs into the vector store.
+
+PDFs are parsed and chunked in a process pool, while the parent process
+embeds and writes chunks as results arrive. Progress is checkpointed to a
+manifest after every file, so an interrupted run resumes where it stopped,
+and files whose content hash was already ingested are skipped.
+
+    python ingest_cli.py uploads/ --workers 8
+
+A bad ingestion run into the local index can be undone with --rollback,
+which restores the checkpoint before it (or the given version). Pinecone
+writes it rejected for good are retried with --requeue-dead-letters once
+the cause is fixed.
+"""
+
+import argparse
+import json
+import os
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime, timezone
+
+from dotenv import load_dotenv
+
+# Before the project imports: their settings are read from the environment at import time.
+load_dotenv()
+
+from dedup import DEDUP_ENABLED, get_dedup_index
+from document_processor import CHUNKING_MODE, get_embeddings_model, load_and_chunk_document
+from page_cache import file_sha256
+from vector_store import (
+    DEFAULT_NAMESPACE, create_or_update_vector_store, get_outbox, rollback_vector_store, write_backlog
+)
+
+DEFAULT_MANIFEST = "local_data/ingest_manifest.json"
+
+_done_hashes = frozenset()
+_chunking_mode = CHUNKING_MODE
+
+def find_pdfs(root):
+    """
+    Returns every PDF under `root`, sorted for a stable processing order.
+    """
+    paths = []
+    for directory, _, files in os.walk(root):
+        paths.extend(os.path.join(directory, name) for name in files if name.lower().endswith(".pdf"))
+    return sorted(paths)
+
+def load_manifest(path):
+    try:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {"files": {}}
+
+def save_manifest(manifest, path):
+    """Writes the manifest atomically so a crash never leaves it half-written."""
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or ".", suffix=".tmp")
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=1)
+    os.replace(tmp_path, path)
+
+def _init_worker(done_hashes, chunking_mode):
+    global _done_hashes, _chunking_mode
+    _done_hashes = done_hashes
+    _chunking_mode = chunking_mode
+
+def _chunk_file(path):
+    """
+    Worker: hashes and chunks one PDF. Returns a result dict for the parent.
+    """
+    started = time.perf_counter()
+    content_hash = file_sha256(path)
+    result = {"path": path, "content_hash": content_hash, "chunks": None, "pages": 0, "error": None}
+    if content_hash in _done_hashes:
+        result["skipped"] = True
+        return result
+    chunks = load_and_chunk_document(path, chunking_mode=_chunking_mode)
+    if chunks is None:
+        result["error"] = "could not parse or chunk the document"
+    else:
+        result["chunks"] = chunks
+        result["pages"] = len({chunk.metadata.get("page") for chunk in chunks})
+    result["seconds"] = time.perf_counter() - started
+    return result
+
+def ingest_directory(root, workers=None, manifest_path=DEFAULT_MANIFEST, chunking_mode=CHUNKING_MODE, force=False,
+                     namespace=DEFAULT_NAMESPACE):
+    """
+    Ingests every PDF under `root` and returns a summary dict.
+
+    Args:
+        root (str): Directory to scan recursively.
+        workers (int): Parser processes; defaults to the CPU count.
+        manifest_path (str): Progress file used to resume and to skip unchanged files.
+        chunking_mode (str): "chars" or "tokens".
+        force (bool): Re-ingest files even if their content was ingested before.
+        namespace (str): Vector store namespace (tenant) to ingest into.
+    """
+    manifest = load_manifest(manifest_path)
+    files = manifest.setdefault("files", {})
+    done_hashes = frozenset() if force else frozenset(
+        entry["content_hash"] for entry in files.values()
+        if entry.get("status") == "done" and entry.get("namespace", "") == namespace
+    )
+    paths = find_pdfs(root)
+    summary = {"namespace": namespace, "files": len(paths), "ingested": 0, "skipped": 0, "failed": 0, "pages": 0, "chunks": 0, "failures": []}
+    print(f"Found {len(paths)} PDF files under {root}; {len(done_hashes)} documents already ingested.")
+
+    embeddings_model = None
+    ingested_hashes = set()
+    started = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(done_hashes, chunking_mode)) as pool:
+        futures = {pool.submit(_chunk_file, path): path for path in paths}
+        for future in as_completed(futures):
+            path = futures[future]
+            try:
+                result = future.result()
+            except Exception as e:
+                result = {"path": path, "content_hash": None, "chunks": None, "pages": 0, "error": str(e)}
+
+            if result.get("skipped") or result["content_hash"] in ingested_hashes:
+                summary["skipped"] += 1
+                continue
+
+            entry = {"content_hash": result["content_hash"], "namespace": namespace, "updated_at": datetime.now(timezone.utc).isoformat()}
+            if result["error"] is None and result["chunks"]:
+                if embeddings_model is None:
+                    embeddings_model = get_embeddings_model()
+                if create_or_update_vector_store(result["chunks"], embeddings_model, namespace=namespace):
+                    entry.update(status="done", pages=result["pages"], chunks=len(result["chunks"]))
+                    ingested_hashes.add(result["content_hash"])
+                    summary["ingested"] += 1
+                    summary["pages"] += result["pages"]
+                    summary["chunks"] += len(result["chunks"])
+                else:
+                    result["error"] = "vector store write failed"
+            elif result["error"] is None:
+                result["error"] = "no text extracted"
+
+            if result["error"] is not None:
+                entry.update(status="failed", error=result["error"])
+                summary["failed"] += 1
+                summary["failures"].append((path, result["error"]))
+            # The same file may be ingested into several namespaces.
+            files[f"{namespace}:{os.path.abspath(path)}" if namespace else os.path.abspath(path)] = entry
+            save_manifest(manifest, manifest_path)
+
+            processed = summary["ingested"] + summary["failed"] + summary["skipped"]
+            print(f"[{processed}/{len(paths)}] {os.path.basename(path)}: {entry['status']}")
+
+    summary["seconds"] = time.perf_counter() - started
+    return summary
+
+def print_summary(summary):
+    seconds = max(summary["seconds"], 1e-9)
+    print("\n--- Ingestion summary ---")
+    print(f"Files: {summary['files']} (ingested {summary['ingested']}, skipped {summary['skipped']}, failed {summary['failed']})")
+    print(f"Pages: {summary['pages']}, chunks: {summary['chunks']}, time: {summary['seconds']:.1f}s")
+    print(f"Throughput: {summary['ingested'] / seconds:.2f} files/s, {summary['pages'] / seconds:.1f} pages/s, "
+          f"{summary['chunks'] / seconds:.1f} chunks/s")
+    if DEDUP_ENABLED:
+        stats = get_dedup_index(summary["namespace"]).stats()
+        print(f"Near-duplicate index: {stats['chunks']} chunks in {stats['clusters']} clusters "
+              f"({stats['duplicates']} duplicates not embedded)")
+    backlog = write_backlog()
+    if backlog is not None:
+        print(f"Pinecone outbox: {backlog['flushed']} written, {backlog['pending']} pending "
+              f"({backlog['failing']} failing, {backlog['dead']} dead-lettered; oldest {backlog['oldest_seconds']:.0f}s)")
+        if backlog["dead"]:
+            print("  Once the cause is fixed, retry them with --requeue-dead-letters.")
+    for path, error in summary["failures"]:
+        print(f"  FAILED {path}: {error}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Ingest a directory tree of PDFs into the vector store.")
+    parser.add_argument("directory", nargs="?", default="uploads")
+    parser.add_argument("--workers", type=int, default=None, help="parser processes (default: CPU count)")
+    parser.add_argument("--manifest", default=DEFAULT_MANIFEST, help="progress file used for resuming")
+    parser.add_argument("--chunking-mode", choices=["chars", "tokens"], default=CHUNKING_MODE)
+    parser.add_argument("--force", action="store_true", help="re-ingest files that were already ingested")
+    parser.add_argument("--namespace", default=DEFAULT_NAMESPACE, help="vector store namespace (tenant)")
+    parser.add_argument("--rollback", nargs="?", type=int, const=-1, metavar="VERSION",
+                        help="restore the local index's previous checkpoint (or VERSION) instead of ingesting")
+    parser.add_argument("--requeue-dead-letters", action="store_true",
+                        help="retry the Pinecone writes set aside as dead letters instead of ingesting")
+    args = parser.parse_args()
+
+    if args.requeue_dead_letters:
+        if write_backlog() is None:
+            print("The local index has no outbox; there is nothing to requeue.")
+            raise SystemExit(0)
+        outbox = get_outbox()
+        print(f"Requeued {outbox.requeue_dead_letters()} dead-lettered writes.")
+        outbox.flush()
+        backlog = write_backlog()
+        print(f"Pinecone outbox: {backlog['pending']} pending, {backlog['dead']} dead-lettered.")
+        raise SystemExit(1 if backlog["pending"] or backlog["dead"] else 0)
+
+    if args.rollback is not None:
+        version = None if args.rollback < 0 else args.rollback
+        restored = rollback_vector_store(get_embeddings_model(), args.namespace, version)
+        if restored is not None:
+            print(f"Restored checkpoint {restored} of namespace '{args.namespace}'.")
+        raise SystemExit(0 if restored is not None else 1)
+
+    summary = ingest_directory(args.directory, args.workers, args.manifest, args.chunking_mode, args.force, args.namespace)
+    if write_backlog() is not None:
+        # Anything still pending stays in the outbox and is written by the next run or the app.
+        get_outbox().flush()
+    print_summary(summary)
+    raise SystemExit(1 if summary["failed"] else 0)
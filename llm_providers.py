@@ -0,0 +1,97 @@
+# llm_providers.py
+
+import os
+from functools import lru_cache
+from pathlib import Path
+
+# Which backend answers questions: "groq" (default), "local" or "openai".
+LLM_PROVIDER = os.getenv("LLM_PROVIDER", "groq")
+LLM_TEMPERATURE = float(os.getenv("LLM_TEMPERATURE", "0.3"))
+LLM_MAX_OUTPUT_TOKENS = int(os.getenv("LLM_MAX_OUTPUT_TOKENS", "512"))
+
+GROQ_MODEL_NAME = os.getenv("GROQ_MODEL_NAME", "llama3-8b-8192")
+
+# Local CPU backend (llama.cpp GGUF model)
+LOCAL_MODEL_PATH = os.getenv("LOCAL_MODEL_PATH", "local_data/models/Meta-Llama-3-8B-Instruct.Q4_K_M.gguf")
+LOCAL_CONTEXT_SIZE = int(os.getenv("LOCAL_CONTEXT_SIZE", "4096"))
+LOCAL_THREADS = int(os.getenv("LOCAL_THREADS", "0")) or None
+LOCAL_PROMPT_CACHE_DIR = os.getenv("LOCAL_PROMPT_CACHE_DIR", "local_data/prompt_cache")
+LOCAL_PROMPT_CACHE_BYTES = int(os.getenv("LOCAL_PROMPT_CACHE_BYTES", str(2 << 30)))
+
+# Any OpenAI-compatible endpoint, e.g. a vLLM server or openai_stub_server.py
+OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL", "http://127.0.0.1:8001/v1")
+OPENAI_MODEL_NAME = os.getenv("OPENAI_MODEL_NAME", "stub")
+
+_prompt_cache = None
+
+def _create_groq_llm(warm_prefix=None):
+    from langchain_groq import ChatGroq
+    return ChatGroq(model_name=GROQ_MODEL_NAME, temperature=LLM_TEMPERATURE, max_tokens=LLM_MAX_OUTPUT_TOKENS)
+
+def _create_openai_llm(warm_prefix=None):
+    from langchain_openai import ChatOpenAI
+    return ChatOpenAI(
+        base_url=OPENAI_BASE_URL,
+        api_key=os.getenv("OPENAI_API_KEY", "not-needed"),
+        model=OPENAI_MODEL_NAME,
+        temperature=LLM_TEMPERATURE,
+        max_tokens=LLM_MAX_OUTPUT_TOKENS,
+    )
+
+def _create_local_llm(warm_prefix=None):
+    global _prompt_cache
+    try:
+        from langchain_community.llms import LlamaCpp
+        from prompt_cache import LockedModel, PromptPrefixCache
+    except ImportError as e:
+        raise ImportError("LLM_PROVIDER=local requires the 'llama-cpp-python' package.") from e
+
+    llm = LlamaCpp(
+        model_path=LOCAL_MODEL_PATH,
+        n_ctx=LOCAL_CONTEXT_SIZE,
+        n_threads=LOCAL_THREADS,
+        temperature=LLM_TEMPERATURE,
+        max_tokens=LLM_MAX_OUTPUT_TOKENS,
+        verbose=False,
+    )
+    # KV states are only valid for the model that produced them, so each model gets its own cache.
+    cache_dir = os.path.join(LOCAL_PROMPT_CACHE_DIR, Path(LOCAL_MODEL_PATH).stem)
+    _prompt_cache = PromptPrefixCache(llm.client, cache_dir, capacity_bytes=LOCAL_PROMPT_CACHE_BYTES)
+    llm.client.set_cache(_prompt_cache)
+    llm.client = LockedModel(llm.client, _prompt_cache.model_lock)
+    if warm_prefix:
+        _prompt_cache.store_prefix(warm_prefix)
+    return llm
+
+def get_prompt_cache():
+    """
+    Returns the local model's PromptPrefixCache, or None for remote providers.
+    """
+    return _prompt_cache
+
+_PROVIDERS = {
+    "groq": _create_groq_llm,
+    "local": _create_local_llm,
+    "openai": _create_openai_llm,
+}
+
+@lru_cache(maxsize=None)
+def get_llm(provider=None, warm_prefix=None):
+    """
+    Returns the chat/completion model for the configured provider.
+
+    Models are cached per process, so a local model is loaded from disk only once.
+
+    Args:
+        provider (str): "groq", "local" or "openai"; defaults to LLM_PROVIDER.
+        warm_prefix (str): Prompt prefix to pre-evaluate on backends with a KV cache.
+
+    Returns:
+        BaseLanguageModel: The LangChain model instance.
+    """
+    provider = (provider or LLM_PROVIDER).lower()
+    if provider not in _PROVIDERS:
+        raise ValueError(f"Unknown LLM provider '{provider}'. Choose one of: {', '.join(_PROVIDERS)}.")
+    llm = _PROVIDERS[provider](warm_prefix=warm_prefix)
+    print(f"LLM provider '{provider}' initialized.")
+    return llm
@@ -0,0 +1,250 @@
+# llm_scheduler.py
+
+import asyncio
+import itertools
+import os
+import random
+import threading
+import time
+
+from resilience import DeadlineExceeded, DependencyBusy, QueueTimeout
+
+# Priorities for queued LLM calls; lower values are served first.
+INTERACTIVE = 0
+BATCH = 10
+
+# Defaults match the Groq free-tier quota for llama3-8b-8192. A local llama.cpp
+# model is not thread-safe, so it gets a single worker unless overridden.
+_DEFAULT_CONCURRENCY = "1" if os.getenv("LLM_PROVIDER", "groq").lower() == "local" else "4"
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", _DEFAULT_CONCURRENCY))
+LLM_REQUESTS_PER_MINUTE = float(os.getenv("LLM_REQUESTS_PER_MINUTE", "30"))
+LLM_TOKENS_PER_MINUTE = float(os.getenv("LLM_TOKENS_PER_MINUTE", "30000"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "5"))
+LLM_BACKOFF_BASE = float(os.getenv("LLM_BACKOFF_BASE", "0.5"))
+LLM_BACKOFF_CAP = float(os.getenv("LLM_BACKOFF_CAP", "20"))
+
+class RateLimitExceeded(DependencyBusy):
+    """Raised when a call is still rate limited after all retries (or the deadline allows no more)."""
+
+class StreamInterrupted(Exception):
+    """Raised when an LLM stream fails after tokens went out, so it is never retried."""
+
+def estimate_tokens(text, completion_tokens=256):
+    """
+    Roughly estimates the tokens a call will consume (about 4 characters per token).
+    """
+    return len(text) // 4 + completion_tokens
+
+def is_rate_limit_error(exc):
+    """
+    Returns True if the exception is a provider 429 / rate-limit error.
+    """
+    if isinstance(exc, StreamInterrupted):
+        return False
+    if getattr(exc, "status_code", None) == 429:
+        return True
+    return type(exc).__name__ == "RateLimitError" or "429" in str(exc)
+
+def is_retryable_error(exc):
+    """
+    Returns True for errors worth retrying: rate limits, timeouts, connection and 5xx errors.
+    A stream that already published tokens is never retried: they would be published twice.
+    """
+    if isinstance(exc, StreamInterrupted):
+        return False
+    if is_rate_limit_error(exc):
+        return True
+    status = getattr(exc, "status_code", None)
+    if isinstance(status, int) and status >= 500:
+        return True
+    return isinstance(exc, (asyncio.TimeoutError, ConnectionError)) or type(exc).__name__ in (
+        "APIConnectionError",
+        "APITimeoutError",
+        "InternalServerError",
+    )
+
+def _retry_after(exc):
+    """
+    Reads the provider's Retry-After hint in seconds, if the error carries one.
+    """
+    response = getattr(exc, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+def backoff_delay(attempt, retry_after=None):
+    """
+    Full-jitter exponential backoff, never shorter than the provider's Retry-After hint.
+    """
+    delay = random.uniform(0, min(LLM_BACKOFF_CAP, LLM_BACKOFF_BASE * (2 ** attempt)))
+    if retry_after is not None:
+        delay = max(delay, retry_after)
+    return delay
+
+class TokenBucket:
+    """
+    Async token bucket refilled continuously at `rate_per_minute`.
+    """
+
+    def __init__(self, rate_per_minute, capacity=None):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = capacity if capacity is not None else rate_per_minute
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self, amount=1):
+        # Requests larger than the bucket would never fit; let them drain it completely instead.
+        amount = min(amount, self.capacity)
+        while True:
+            self._refill()
+            if self.tokens >= amount:
+                self.tokens -= amount
+                return
+            await asyncio.sleep((amount - self.tokens) / self.rate)
+
+class LLMScheduler:
+    """
+    Runs LLM calls on a dedicated event loop with a global concurrency limit,
+    request/token rate limiting, jittered retries and priority ordering.
+
+    Calls can be submitted from any thread or event loop; a fixed pool of
+    workers drains a priority queue, so interactive requests overtake queued
+    batch jobs and at most `max_concurrency` calls are in flight at once.
+    """
+
+    def __init__(
+        self,
+        max_concurrency=LLM_MAX_CONCURRENCY,
+        requests_per_minute=LLM_REQUESTS_PER_MINUTE,
+        tokens_per_minute=LLM_TOKENS_PER_MINUTE,
+        max_retries=LLM_MAX_RETRIES,
+    ):
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.request_bucket = TokenBucket(requests_per_minute)
+        self.token_bucket = TokenBucket(tokens_per_minute)
+        self.stats = {"submitted": 0, "completed": 0, "failed": 0, "retries": 0, "rate_limited": 0, "expired": 0}
+        self._counter = itertools.count()
+        self._running = set()
+        self._loop = asyncio.new_event_loop()
+        self._queue = None
+        self._ready = threading.Event()
+        self._thread = threading.Thread(target=self._run_loop, name="llm-scheduler", daemon=True)
+        self._thread.start()
+        self._ready.wait()
+
+    def _run_loop(self):
+        asyncio.set_event_loop(self._loop)
+        self._queue = asyncio.PriorityQueue()
+        for _ in range(self.max_concurrency):
+            self._loop.create_task(self._worker())
+        self._ready.set()
+        self._loop.run_forever()
+
+    async def _worker(self):
+        while True:
+            _, _, call, tokens, deadline, future = await self._queue.get()
+            try:
+                if future.cancelled():
+                    continue
+                if deadline is not None and deadline.expired():
+                    # Its caller has already given up; don't spend quota on it.
+                    self.stats["expired"] += 1
+                    future.set_exception(QueueTimeout("the deadline passed while the call was queued"))
+                    continue
+                self._running.add(future)
+                attempt = self._call_with_retries(call, tokens, deadline)
+                result = await (attempt if deadline is None else asyncio.wait_for(attempt, deadline.remaining()))
+                if not future.cancelled():
+                    future.set_result(result)
+                self.stats["completed"] += 1
+            except Exception as e:
+                self.stats["failed"] += 1
+                if not future.cancelled():
+                    future.set_exception(e)
+            finally:
+                self._running.discard(future)
+                self._queue.task_done()
+
+    async def _call_with_retries(self, call, tokens, deadline=None):
+        attempt = 0
+        while True:
+            await self.request_bucket.acquire()
+            await self.token_bucket.acquire(tokens)
+            try:
+                return await call()
+            except Exception as e:
+                if isinstance(e, StreamInterrupted) or not is_retryable_error(e):
+                    raise
+                rate_limited = is_rate_limit_error(e)
+                if rate_limited:
+                    self.stats["rate_limited"] += 1
+                delay = backoff_delay(attempt, _retry_after(e))
+                if attempt >= self.max_retries or (deadline is not None and delay >= deadline.remaining()):
+                    if rate_limited:
+                        raise RateLimitExceeded(str(e)) from e
+                    raise
+                print(f"LLM call failed ({type(e).__name__}), retrying in {delay:.2f}s...")
+                self.stats["retries"] += 1
+                attempt += 1
+                await asyncio.sleep(delay)
+
+    async def _enqueue(self, call, priority, tokens, deadline):
+        future = self._loop.create_future()
+        self.stats["submitted"] += 1
+        await self._queue.put((priority, next(self._counter), call, tokens, deadline, future))
+        if deadline is None:
+            return await future
+        try:
+            # On timeout the future is cancelled, so a worker skips or abandons the call.
+            return await asyncio.wait_for(future, deadline.remaining())
+        except asyncio.TimeoutError:
+            if future not in self._running:
+                raise QueueTimeout("the deadline passed while the call was queued") from None
+            raise DeadlineExceeded("the LLM did not answer before the deadline") from None
+
+    async def submit(self, call, priority=INTERACTIVE, tokens=1, deadline=None):
+        """
+        Schedules `call` (a no-argument coroutine function) and awaits its result.
+
+        Args:
+            call (callable): Returns the coroutine performing the LLM request.
+            priority (int): INTERACTIVE or BATCH; lower runs first.
+            tokens (int): Estimated tokens the call consumes, for the token bucket.
+            deadline (Deadline): Raise DeadlineExceeded once it passes, whether
+                the call is still queued, waiting to retry or running.
+        """
+        cf = asyncio.run_coroutine_threadsafe(self._enqueue(call, priority, tokens, deadline), self._loop)
+        return await asyncio.wrap_future(cf)
+
+    def submit_sync(self, call, priority=INTERACTIVE, tokens=1, timeout=None, deadline=None):
+        """
+        Blocking variant of `submit` for callers that are not running an event loop.
+        """
+        cf = asyncio.run_coroutine_threadsafe(self._enqueue(call, priority, tokens, deadline), self._loop)
+        return cf.result(timeout)
+
+    def queue_depth(self):
+        """Returns the number of calls waiting for a worker."""
+        return self._queue.qsize()
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+def get_scheduler():
+    """
+    Returns the process-wide LLM scheduler, creating it on first use.
+    """
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = LLMScheduler()
+            print(f"LLM scheduler started with {_scheduler.max_concurrency} workers.")
+        return _scheduler
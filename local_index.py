@@ -0,0 +1,774 @@
+# local_index.py
+
+import atexit
+import heapq
+import json
+import os
+import re
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.vectorstores import VectorStore
+
+from wal import WriteAheadLog
+
+LOCAL_INDEX_DIR = os.getenv("LOCAL_INDEX_DIR", "local_data/vector_index")
+# Once a namespace has more segments than this, small ones are merged in the background.
+SEGMENT_MERGE_THRESHOLD = int(os.getenv("SEGMENT_MERGE_THRESHOLD", "8"))
+# How many past snapshots (manifests and their segments) are kept for rollback.
+SNAPSHOT_RETENTION = int(os.getenv("SNAPSHOT_RETENTION", "5"))
+# A segment with at least COMPACTION_MIN_DEAD deleted or superseded rows
+# making up this share of it is rewritten without them in the background.
+COMPACTION_DEAD_RATIO = float(os.getenv("COMPACTION_DEAD_RATIO", "0.2"))
+COMPACTION_MIN_DEAD = int(os.getenv("COMPACTION_MIN_DEAD", "64"))
+# Writes go to the write-ahead log first; they are checkpointed into segment
+# files once the log holds this many records or bytes, or this many seconds
+# have passed, bounding how much is replayed after a crash.
+WAL_CHECKPOINT_RECORDS = int(os.getenv("WAL_CHECKPOINT_RECORDS", "1000"))
+WAL_CHECKPOINT_BYTES = int(os.getenv("WAL_CHECKPOINT_BYTES", str(64 * 1024 * 1024)))
+WAL_CHECKPOINT_SECONDS = float(os.getenv("WAL_CHECKPOINT_SECONDS", "30"))
+
+# Filter keys answered from the per-segment source bitmaps. "sources" lists
+# every document a (deduplicated) chunk appears in.
+_SOURCE_KEYS = ("source", "sources")
+_MANIFEST = re.compile(r"manifest-(\d+)\.json$")
+
+def namespace_dir(namespace, root=LOCAL_INDEX_DIR):
+    """
+    Returns the directory holding a namespace's index ("" is the default namespace).
+    """
+    name = namespace or "_default"
+    if not re.fullmatch(r"[A-Za-z0-9_.-]+", name) or name.startswith("."):
+        name = uuid.uuid5(uuid.NAMESPACE_URL, name).hex
+    return os.path.join(root, name)
+
+def _normalize(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+def _filter_values(condition):
+    # {"$in": [...]}, {"$eq": x} or a bare value -> list of accepted values.
+    if isinstance(condition, dict):
+        if "$in" in condition:
+            return list(condition["$in"])
+        if "$eq" in condition:
+            return [condition["$eq"]]
+        raise ValueError(f"Unsupported filter operator: {condition}")
+    return [condition]
+
+def _sync_directory(path):
+    # Makes the files created and renamed in `path` durable.
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+def _write_json(path, data):
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        json.dump(data, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    _sync_directory(os.path.dirname(path))
+
+class Segment:
+    """
+    An immutable block of vectors with their ids, texts and metadata.
+
+    A bitmap of the rows holding each source document's chunks is built once,
+    so a search restricted to some documents selects their rows before
+    scoring. On disk a segment is a directory written once and never changed;
+    its vectors are memory-mapped when loaded. New segments live only in
+    memory (covered by the write-ahead log) until a checkpoint writes them.
+    """
+
+    def __init__(self, name, vectors, ids, texts, metadatas, persisted=False):
+        self.name = name
+        self.persisted = persisted
+        self.vectors = vectors
+        self.ids = ids
+        self.texts = texts
+        self.metadatas = metadatas
+        self.rows = {item_id: row for row, item_id in enumerate(ids)}
+        self.bitmaps = {}
+        for row, metadata in enumerate(metadatas):
+            sources = set(metadata.get("sources") or [])
+            if "source" in metadata:
+                sources.add(metadata["source"])
+            for source in sources:
+                if source not in self.bitmaps:
+                    self.bitmaps[source] = np.zeros(len(ids), dtype=bool)
+                self.bitmaps[source][row] = True
+
+    def __len__(self):
+        return len(self.ids)
+
+    @classmethod
+    def create(cls, vectors, ids, texts, metadatas):
+        return cls(f"seg-{uuid.uuid4().hex[:16]}", _normalize(vectors), list(ids), list(texts),
+                   [dict(m) for m in metadatas])
+
+    def write(self, directory):
+        # Written to a temporary directory and renamed, so a segment directory
+        # is either complete or absent. Everything is fsynced before the
+        # checkpoint that references it truncates the write-ahead log.
+        staging = tempfile.mkdtemp(dir=directory, prefix=".staging-")
+        with open(os.path.join(staging, "vectors.npy"), "wb") as f:
+            np.save(f, self.vectors)
+            f.flush()
+            os.fsync(f.fileno())
+        # Also syncs the staging directory, covering vectors.npy's entry.
+        _write_json(os.path.join(staging, "records.json"),
+                    {"ids": self.ids, "texts": self.texts, "metadatas": self.metadatas})
+        os.replace(staging, os.path.join(directory, self.name))
+        _sync_directory(directory)
+        self.persisted = True
+
+    @classmethod
+    def read(cls, directory, name):
+        path = os.path.join(directory, name)
+        vectors = np.load(os.path.join(path, "vectors.npy"), mmap_mode="r")
+        with open(os.path.join(path, "records.json"), encoding="utf-8") as f:
+            records = json.load(f)
+        return cls(name, vectors, records["ids"], records["texts"], records["metadatas"], persisted=True)
+
+    def candidate_mask(self, filter):
+        """
+        Returns a boolean row mask for a Pinecone-style filter, or None for no filter.
+        """
+        if not filter:
+            return None
+        mask = np.ones(len(self), dtype=bool)
+        for key, condition in filter.items():
+            if key == "$or":
+                selected = np.zeros(len(self), dtype=bool)
+                for alternative in condition:
+                    alternative_mask = self.candidate_mask(alternative)
+                    if alternative_mask is None:
+                        selected[:] = True
+                    else:
+                        selected |= alternative_mask
+                mask &= selected
+                continue
+            values = _filter_values(condition)
+            if key in _SOURCE_KEYS:
+                selected = np.zeros(len(self), dtype=bool)
+                for value in values:
+                    bitmap = self.bitmaps.get(value)
+                    if bitmap is not None:
+                        selected |= bitmap
+            else:
+                selected = np.fromiter((m.get(key) in values for m in self.metadatas), dtype=bool, count=len(self))
+            mask &= selected
+        return mask
+
+class Snapshot:
+    """
+    One immutable generation of an index: its segments (oldest first), plus
+    for each segment a tombstone mask of rows deleted or superseded by a
+    newer copy (or None).
+    `wal_seq` is the last write-ahead log record a checkpointed snapshot includes.
+    """
+
+    def __init__(self, version, segments=(), dead=(), wal_seq=0):
+        self.version = version
+        self.wal_seq = wal_seq
+        self.segments = tuple(segments)
+        self.dead = tuple(dead) if dead else tuple(None for _ in self.segments)
+        self.dead_counts = tuple(0 if mask is None else int(mask.sum()) for mask in self.dead)
+
+    def locate(self, item_id):
+        """
+        Returns (segment position, row) of the live copy of an id, or None.
+        """
+        for position in range(len(self.segments) - 1, -1, -1):
+            row = self.segments[position].rows.get(item_id)
+            if row is not None and (self.dead[position] is None or not self.dead[position][row]):
+                return position, row
+        return None
+
+    def live_count(self):
+        return sum(len(segment) for segment in self.segments) - sum(self.dead_counts)
+
+    def compactable(self, min_ratio=COMPACTION_DEAD_RATIO, min_dead=COMPACTION_MIN_DEAD):
+        """
+        Returns the positions of segments whose dead rows warrant a rewrite.
+        """
+        return [position for position, (segment, count) in enumerate(zip(self.segments, self.dead_counts))
+                if count and count >= min(min_dead, len(segment)) and count >= min_ratio * len(segment)]
+
+class LocalVectorIndex(VectorStore):
+    """
+    In-process exact (brute-force cosine) vector index for one namespace,
+    stored as versioned, immutable segments.
+
+    Every write adds a new segment and publishes a new snapshot by swapping a
+    single reference, so searches never lock: each runs on whichever snapshot
+    was current when it started, and a half-finished write is never visible.
+    Deletes only set tombstones. Small segments are merged in the background
+    once there are more than SEGMENT_MERGE_THRESHOLD, and segments whose
+    dead rows cross COMPACTION_DEAD_RATIO are rewritten without them, so
+    search cost follows the live data.
+
+    On disk, writes (upserts and deletes) are appended to a write-ahead log
+    and fsynced in groups before they are applied. Checkpoints write the new
+    segments and a manifest, swap the CURRENT pointer file and truncate the
+    log; on startup the last checkpoint is loaded and the log records after
+    it are replayed, so a crash loses no acknowledged write and recovery
+    never re-embeds anything. The last SNAPSHOT_RETENTION checkpoints are
+    kept for rollback().
+    Accepts Pinecone-style filters on `source` / `sources` ({"$in": [...]} or
+    equality, optionally combined with "$or"); other metadata fields fall back to a scan.
+    """
+
+    def __init__(self, embedding, path=None):
+        self.embedding = embedding
+        self.path = path
+        self._write_lock = threading.RLock()
+        self._merging = False
+        self._maintenance = {"merges": 0, "compactions": 0, "rows_reclaimed": 0}
+        self._snapshot = Snapshot(0)
+        self._applied_seq = 0
+        self._checkpointed_version = 0
+        self._last_checkpoint = time.monotonic()
+        self._wal = None
+        if path:
+            self._segments_dir = os.path.join(path, "segments")
+            os.makedirs(self._segments_dir, exist_ok=True)
+            current = self._read_current()
+            if current is not None:
+                self._snapshot = self._load_snapshot(current)
+                self._applied_seq = self._snapshot.wal_seq
+                self._checkpointed_version = current
+            self._recover()
+            atexit.register(self.close)
+
+    @property
+    def embeddings(self):
+        return self.embedding
+
+    @property
+    def size(self):
+        return self._snapshot.live_count()
+
+    @property
+    def version(self):
+        return self._snapshot.version
+
+    # --- Persistence ---
+
+    def _manifest_path(self, version):
+        return os.path.join(self.path, f"manifest-{version:08d}.json")
+
+    def _read_current(self):
+        try:
+            with open(os.path.join(self.path, "CURRENT"), encoding="utf-8") as f:
+                return int(f.read().strip())
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def _load_snapshot(self, version):
+        with open(self._manifest_path(version), encoding="utf-8") as f:
+            manifest = json.load(f)
+        segments, dead = [], []
+        for entry in manifest["segments"]:
+            segment = Segment.read(self._segments_dir, entry["name"])
+            mask = None
+            if entry["dead"]:
+                mask = np.zeros(len(segment), dtype=bool)
+                mask[entry["dead"]] = True
+            segments.append(segment)
+            dead.append(mask)
+        return Snapshot(version, segments, dead, manifest.get("wal_seq", 0))
+
+    def _manifest_versions(self):
+        return sorted(int(m.group(1)) for m in map(_MANIFEST.match, os.listdir(self.path)) if m)
+
+    def _persist(self, snapshot, wal_seq):
+        for segment in snapshot.segments:
+            if not segment.persisted:
+                segment.write(self._segments_dir)
+        manifest = {
+            "version": snapshot.version,
+            "wal_seq": wal_seq,
+            "segments": [
+                {"name": segment.name, "dead": [] if dead is None else np.flatnonzero(dead).tolist()}
+                for segment, dead in zip(snapshot.segments, snapshot.dead)
+            ],
+        }
+        _write_json(self._manifest_path(snapshot.version), manifest)
+        # The pointer swap: CURRENT names the old or the new version, never a mix.
+        _write_json(os.path.join(self.path, "CURRENT"), snapshot.version)
+
+    def _collect_garbage(self):
+        # Drops manifests beyond the retention window and segments none of the kept ones use.
+        versions = self._manifest_versions()
+        keep = set(versions[-SNAPSHOT_RETENTION:]) | {self._snapshot.version}
+        referenced = set()
+        for version in versions:
+            if version not in keep:
+                os.remove(self._manifest_path(version))
+                continue
+            with open(self._manifest_path(version), encoding="utf-8") as f:
+                referenced.update(entry["name"] for entry in json.load(f)["segments"])
+        for name in os.listdir(self._segments_dir):
+            if name not in referenced and not name.startswith(".staging-"):
+                shutil.rmtree(os.path.join(self._segments_dir, name), ignore_errors=True)
+
+    # --- Writes ---
+
+    def _commit(self, new_segments=(), dead_rows=None, replaced=(), new_dead=None):
+        """
+        Publishes a new in-memory snapshot: appends `new_segments` (with
+        optional dead masks by name), marks `dead_rows` ({segment position:
+        rows}) as superseded and drops the `replaced` segments.
+        """
+        with self._write_lock:
+            current = self._snapshot
+            segments, dead = [], []
+            for position, (segment, mask) in enumerate(zip(current.segments, current.dead)):
+                if segment in replaced:
+                    continue
+                rows = (dead_rows or {}).get(position)
+                if rows:
+                    mask = np.zeros(len(segment), dtype=bool) if mask is None else mask.copy()
+                    mask[rows] = True
+                segments.append(segment)
+                dead.append(mask)
+            for segment in new_segments:
+                segments.append(segment)
+                dead.append((new_dead or {}).get(segment.name))
+            snapshot = Snapshot(current.version + 1, segments, dead)
+            self._snapshot = snapshot
+        self._maybe_maintain()
+        return snapshot
+
+    def _log(self, record):
+        # Durable indexes apply a record only once the log has it on disk.
+        if self._wal is None:
+            self._apply(None, record)
+        else:
+            self._wal.submit(record).result()
+
+    def _apply(self, seq, record):
+        with self._write_lock:
+            if record["op"] == "upsert":
+                segment = Segment.create(record["vectors"], record["ids"], record["texts"], record["metadatas"])
+                self._commit([segment], self._locate_rows(segment.ids))
+            elif record["op"] == "delete":
+                dead_rows = self._locate_rows(record["ids"])
+                if dead_rows:
+                    self._commit(dead_rows=dead_rows)
+            elif record["op"] == "add_sources":
+                self._apply_sources(record["updates"])
+            elif record["op"] == "delete_sources":
+                self._apply_delete_sources(set(record["sources"]))
+            else:
+                raise ValueError(f"Unknown log record: {record['op']}")
+            if seq is not None:
+                self._applied_seq = seq
+
+    def _locate_rows(self, ids):
+        # {segment position: rows} holding the live copies of `ids`.
+        dead_rows = {}
+        for item_id in ids:
+            found = self._snapshot.locate(item_id)
+            if found is not None:
+                dead_rows.setdefault(found[0], []).append(found[1])
+        return dead_rows
+
+    def add_vectors(self, vectors, texts, metadatas, ids):
+        """
+        Upserts precomputed vectors with their texts and metadata as one new segment.
+        """
+        if not ids:
+            return []
+        # The last occurrence of a repeated id wins.
+        keep = sorted({item_id: position for position, item_id in enumerate(ids)}.values())
+        self._log({
+            "op": "upsert",
+            "vectors": np.asarray(vectors, dtype=np.float32)[keep],
+            "ids": [ids[i] for i in keep],
+            "texts": [texts[i] for i in keep],
+            "metadatas": [dict(metadatas[i]) for i in keep],
+        })
+        return list(ids)
+
+    def delete(self, ids=None, **kwargs):
+        """
+        Deletes the vectors with the given ids; unknown ids are ignored.
+        """
+        if ids:
+            self._log({"op": "delete", "ids": list(ids)})
+        return True
+
+    def delete_sources(self, sources):
+        """
+        Removes documents from the index. Chunks only they contain are
+        tombstoned; chunks other documents share (see `sources`) are kept for
+        those documents.
+        """
+        if sources:
+            self._log({"op": "delete_sources", "sources": sorted(sources)})
+
+    def _apply_delete_sources(self, removed):
+        with self._write_lock:
+            snapshot = self._snapshot
+            dead_rows, vectors, texts, metadatas, ids = {}, [], [], [], []
+            for position, (segment, dead) in enumerate(zip(snapshot.segments, snapshot.dead)):
+                hit = np.zeros(len(segment), dtype=bool)
+                for source in removed:
+                    if source in segment.bitmaps:
+                        hit |= segment.bitmaps[source]
+                if dead is not None:
+                    hit &= ~dead
+                for row in np.flatnonzero(hit):
+                    dead_rows.setdefault(position, []).append(int(row))
+                    metadata = dict(segment.metadatas[row])
+                    remaining = sorted(set(metadata.get("sources") or [metadata.get("source")]) - removed)
+                    if not remaining:
+                        continue
+                    # Still part of other documents: re-written without the removed ones.
+                    metadata["sources"] = remaining
+                    if metadata.get("source") in removed:
+                        metadata["source"] = remaining[0]
+                    vectors.append(segment.vectors[row])
+                    texts.append(segment.texts[row])
+                    metadatas.append(metadata)
+                    ids.append(segment.ids[row])
+            if dead_rows:
+                new_segments = [Segment.create(vectors, ids, texts, metadatas)] if ids else []
+                self._commit(new_segments, dead_rows)
+
+    def add_texts(self, texts, metadatas=None, *, ids=None, **kwargs):
+        texts = list(texts)
+        metadatas = [dict(m) for m in metadatas] if metadatas else [{} for _ in texts]
+        ids = list(ids) if ids else [uuid.uuid4().hex for _ in texts]
+        if not texts:
+            return []
+        return self.add_vectors(self.embedding.embed_documents(texts), texts, metadatas, ids)
+
+    def add_sources(self, updates):
+        """
+        Adds documents to stored chunks' `sources` (e.g. when a later document
+        contains a near-duplicate of them). Segments are immutable, so the
+        updated rows are re-written into a new segment.
+
+        Args:
+            updates (dict): chunk id -> iterable of source names.
+        """
+        if updates:
+            self._log({"op": "add_sources", "updates": {item_id: sorted(sources) for item_id, sources in updates.items()}})
+
+    def _apply_sources(self, updates):
+        with self._write_lock:
+            snapshot = self._snapshot
+            vectors, texts, metadatas, ids = [], [], [], []
+            for item_id, sources in updates.items():
+                found = snapshot.locate(item_id)
+                if found is None:
+                    continue
+                segment, row = snapshot.segments[found[0]], found[1]
+                metadata = dict(segment.metadatas[row])
+                merged = sorted(set(metadata.get("sources") or []) | set(sources))
+                if merged == metadata.get("sources"):
+                    continue
+                metadata["sources"] = merged
+                vectors.append(segment.vectors[row])
+                texts.append(segment.texts[row])
+                metadatas.append(metadata)
+                ids.append(item_id)
+            if ids:
+                segment = Segment.create(vectors, ids, texts, metadatas)
+                self._commit([segment], self._locate_rows(ids))
+
+    # --- Durability ---
+
+    def _recover(self):
+        started = time.perf_counter()
+        self._wal = WriteAheadLog(os.path.join(self.path, "wal"), idle_seconds=WAL_CHECKPOINT_SECONDS)
+        for seq, record in self._wal.replay(self._applied_seq):
+            try:
+                self._apply(seq, record)
+            except Exception as e:
+                print(f"Skipping log record {seq} of {self.path}: {e}")
+        if self._wal.stats["replayed"]:
+            print(f"Recovered {self.path}: replayed {self._wal.stats['replayed']} log records "
+                  f"in {time.perf_counter() - started:.2f}s.")
+        self._wal.start(self._apply, self._maybe_checkpoint)
+
+    def _maybe_checkpoint(self):
+        stats = self._wal.stats
+        if not stats["records_since_checkpoint"] and self._snapshot.version == self._checkpointed_version:
+            return
+        if (stats["records_since_checkpoint"] >= WAL_CHECKPOINT_RECORDS
+                or stats["bytes_since_checkpoint"] >= WAL_CHECKPOINT_BYTES
+                or time.monotonic() - self._last_checkpoint >= WAL_CHECKPOINT_SECONDS):
+            try:
+                self.checkpoint()
+            except Exception as e:
+                print(f"Checkpoint of {self.path} failed: {e}")
+
+    def checkpoint(self):
+        """
+        Writes the current snapshot's new segments and manifest, swaps the
+        CURRENT pointer to it and truncates the write-ahead log.
+        Returns the checkpointed version.
+        """
+        if not self.path:
+            return self._snapshot.version
+        with self._write_lock:
+            snapshot = self._snapshot
+            if snapshot.version != self._checkpointed_version:
+                self._persist(snapshot, self._applied_seq)
+                self._checkpointed_version = snapshot.version
+                self._collect_garbage()
+            self._wal.truncate(self._applied_seq)
+            self._last_checkpoint = time.monotonic()
+        return snapshot.version
+
+    def close(self):
+        """
+        Applies the writes already queued and checkpoints them.
+        """
+        if self._wal is not None:
+            self._wal.stop()
+            self.checkpoint()
+            self._wal.close()
+            self._wal = None
+
+    # --- Snapshots ---
+
+    def snapshots(self):
+        """
+        Returns the checkpointed versions available for rollback (oldest first).
+        """
+        return self._manifest_versions() if self.path else [self._snapshot.version]
+
+    def rollback(self, version=None):
+        """
+        Restores an earlier checkpoint (by default the newest one older than
+        the current state) and checkpoints it as a new version, so the writes
+        it undoes are not replayed from the log after a restart. Searches
+        already running finish on the snapshot they started with.
+        """
+        if not self.path:
+            raise ValueError("Rollback needs an index stored on disk.")
+        with self._write_lock:
+            versions = self._manifest_versions()
+            if version is None:
+                older = [v for v in versions if v < self._snapshot.version]
+                if not older:
+                    raise ValueError("No earlier snapshot to roll back to.")
+                version = older[-1]
+            restored = self._load_snapshot(version)
+            self._snapshot = Snapshot(max(versions + [self._snapshot.version]) + 1, restored.segments, restored.dead)
+            self.checkpoint()
+        print(f"Rolled back {self.path} to snapshot {version}.")
+        return version
+
+    # --- Merging ---
+
+    def _maybe_maintain(self):
+        with self._write_lock:
+            snapshot = self._snapshot
+            if self._merging or (len(snapshot.segments) <= SEGMENT_MERGE_THRESHOLD and not snapshot.compactable()):
+                return
+            self._merging = True
+        threading.Thread(target=self._maintain_in_background, name="segment-merge", daemon=True).start()
+
+    def _maintain_in_background(self):
+        try:
+            # Writes made meanwhile may have pushed the index over a threshold again.
+            while True:
+                if len(self._snapshot.segments) > SEGMENT_MERGE_THRESHOLD and self.merge_segments():
+                    continue
+                if self._snapshot.compactable() and self.compact():
+                    continue
+                break
+        except Exception as e:
+            print(f"Segment maintenance failed: {e}")
+        finally:
+            self._merging = False
+
+    def merge_segments(self, target=None):
+        """
+        Merges the smallest segments, without their dead rows, until at most
+        `target` remain (default: half the merge threshold).
+        """
+        target = max(1, target or SEGMENT_MERGE_THRESHOLD // 2)
+        snapshot = self._snapshot
+        if len(snapshot.segments) <= target:
+            return False
+        by_size = sorted(range(len(snapshot.segments)), key=lambda i: len(snapshot.segments[i]))
+        # Kept in age order, so the merged rows stay oldest first.
+        chosen = sorted(by_size[:len(snapshot.segments) - target + 1])
+        rewritten = self._rewrite(snapshot, chosen)
+        if rewritten is not None:
+            self._maintenance["merges"] += 1
+            print(f"Merged {len(chosen)} segments into one ({rewritten} vectors).")
+        return rewritten is not None
+
+    def compact(self, min_ratio=COMPACTION_DEAD_RATIO, min_dead=COMPACTION_MIN_DEAD):
+        """
+        Rewrites the segments whose share of dead (deleted or superseded)
+        rows is at least `min_ratio` into one segment without them.
+        Returns True if anything was compacted.
+        """
+        snapshot = self._snapshot
+        chosen = snapshot.compactable(min_ratio, min_dead)
+        if not chosen:
+            return False
+        reclaimed = sum(snapshot.dead_counts[position] for position in chosen)
+        rewritten = self._rewrite(snapshot, chosen)
+        if rewritten is None:
+            return False
+        self._maintenance["compactions"] += 1
+        self._maintenance["rows_reclaimed"] += reclaimed
+        print(f"Compacted {len(chosen)} segments: reclaimed {reclaimed} dead rows, {rewritten} live.")
+        return True
+
+    def _rewrite(self, snapshot, positions):
+        """
+        Replaces the segments at `positions` with one segment of their live
+        rows. It is built without holding the write lock; rows that writes
+        made meanwhile delete are carried over as dead when it is swapped in.
+        Returns the number of rows written, or None if the segments changed under us.
+        """
+        replaced = [snapshot.segments[position] for position in positions]
+        live_rows, vectors, ids, texts, metadatas = {}, [], [], [], []
+        for position in positions:
+            segment, dead = snapshot.segments[position], snapshot.dead[position]
+            rows = np.arange(len(segment)) if dead is None else np.flatnonzero(~dead)
+            live_rows[segment.name] = rows
+            vectors.append(np.asarray(segment.vectors)[rows])
+            ids.extend(segment.ids[row] for row in rows)
+            texts.extend(segment.texts[row] for row in rows)
+            metadatas.extend(segment.metadatas[row] for row in rows)
+        merged = [Segment.create(np.concatenate(vectors), ids, texts, metadatas)] if ids else []
+
+        with self._write_lock:
+            current = {segment.name: dead for segment, dead in zip(self._snapshot.segments, self._snapshot.dead)}
+            if any(segment.name not in current for segment in replaced):
+                # Rolled back or merged by someone else meanwhile; nothing to do.
+                return None
+            new_dead = {}
+            if merged:
+                dead_now = [current[segment.name][live_rows[segment.name]] if current[segment.name] is not None
+                            else np.zeros(len(live_rows[segment.name]), dtype=bool) for segment in replaced]
+                mask = np.concatenate(dead_now)
+                new_dead[merged[0].name] = mask if mask.any() else None
+            self._commit(merged, replaced=replaced, new_dead=new_dead)
+        return len(ids)
+
+    def stats(self):
+        """
+        Returns segment and tombstone counts, the dead-row ratio and
+        merge/compaction totals.
+        """
+        snapshot = self._snapshot
+        total = sum(len(segment) for segment in snapshot.segments)
+        dead = sum(snapshot.dead_counts)
+        return {
+            "segments": len(snapshot.segments),
+            "live": total - dead,
+            "dead": dead,
+            "dead_ratio": dead / total if total else 0.0,
+            **self._maintenance,
+        }
+
+    # --- Reads ---
+
+    def get_by_ids(self, ids):
+        """
+        Returns the live chunks with the given ids, skipping unknown ones.
+        """
+        snapshot = self._snapshot
+        documents = []
+        for item_id in ids:
+            found = snapshot.locate(item_id)
+            if found is not None:
+                segment, row = snapshot.segments[found[0]], found[1]
+                documents.append(Document(id=item_id, page_content=segment.texts[row],
+                                          metadata=dict(segment.metadatas[row])))
+        return documents
+
+    def list_sources(self):
+        """
+        Returns the names of every document with live chunks in this namespace.
+        """
+        snapshot = self._snapshot
+        sources = set()
+        for segment, dead in zip(snapshot.segments, snapshot.dead):
+            for source, bitmap in segment.bitmaps.items():
+                if source not in sources and (bitmap if dead is None else bitmap & ~dead).any():
+                    sources.add(source)
+        return sorted(sources)
+
+    def similarity_search_with_score_by_vector(self, embedding, k=4, filter=None, **kwargs):
+        """
+        Returns the k most similar (Document, cosine score) pairs, searching only
+        rows that pass `filter`.
+        """
+        query = _normalize(embedding)
+        snapshot = self._snapshot
+        candidates = []
+        for segment, dead in zip(snapshot.segments, snapshot.dead):
+            mask = segment.candidate_mask(filter)
+            if dead is not None:
+                mask = ~dead if mask is None else mask & ~dead
+            if mask is None:
+                rows = np.arange(len(segment))
+                scores = segment.vectors @ query
+            else:
+                rows = np.flatnonzero(mask)
+                scores = segment.vectors[rows] @ query
+            top = np.argpartition(-scores, k)[:k] if len(scores) > k else np.arange(len(scores))
+            candidates.extend((float(scores[i]), segment, int(rows[i])) for i in top)
+        return [
+            (Document(id=segment.ids[row], page_content=segment.texts[row], metadata=dict(segment.metadatas[row])), score)
+            for score, segment, row in heapq.nlargest(k, candidates, key=lambda item: item[0])
+        ]
+
+    def similarity_search_by_vector(self, embedding, k=4, filter=None, **kwargs):
+        return [doc for doc, _ in self.similarity_search_with_score_by_vector(embedding, k, filter)]
+
+    def similarity_search_with_score(self, query, k=4, filter=None, **kwargs):
+        return self.similarity_search_with_score_by_vector(self.embedding.embed_query(query), k, filter)
+
+    def similarity_search(self, query, k=4, filter=None, **kwargs):
+        return self.similarity_search_by_vector(self.embedding.embed_query(query), k, filter)
+
+    def _select_relevance_score_fn(self):
+        return lambda score: (score + 1) / 2
+
+    @classmethod
+    def from_texts(cls, texts, embedding, metadatas=None, *, ids=None, path=None, **kwargs):
+        index = cls(embedding, path=path)
+        index.add_texts(texts, metadatas, ids=ids)
+        return index
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+def get_local_index(embedding, namespace="", root=LOCAL_INDEX_DIR):
+    """
+    Returns the process-wide LocalVectorIndex for a namespace, loading it from disk on first use.
+    """
+    path = namespace_dir(namespace, root)
+    with _indexes_lock:
+        index = _indexes.get(path)
+        if index is None:
+            index = LocalVectorIndex(embedding, path=path)
+            _indexes[path] = index
+        else:
+            index.embedding = embedding
+        return index
@@ -0,0 +1,250 @@
+# offset_splitter.py
+
+import re
+from bisect import bisect_left, bisect_right
+
+from langchain_core.documents import Document
+
+DEFAULT_SEPARATORS = ["\n\n", "\n", " ", ""]
+
+class OffsetTextSplitter:
+    """
+    Drop-in replacement for RecursiveCharacterTextSplitter's default mode
+    (keep_separator=True, strip_whitespace=True) that works on offsets.
+
+    LangChain splits each level into new strings and re-joins them while
+    merging. Because separators are kept at the start of the following piece,
+    every merged chunk is a contiguous slice of the page text, so this splitter
+    only tracks (start, end) positions and slices the page once per emitted
+    chunk. Boundaries are identical to LangChain's for the same parameters.
+    """
+
+    def __init__(self, chunk_size=1000, chunk_overlap=200, separators=None, length_function=None):
+        if chunk_overlap > chunk_size:
+            raise ValueError(f"Got a larger chunk overlap ({chunk_overlap}) than chunk size ({chunk_size}).")
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+        self.separators = separators or DEFAULT_SEPARATORS
+        self._patterns = {separator: re.compile(re.escape(separator)) for separator in self.separators if separator}
+        # None means character length, computed from offsets without slicing.
+        self.length_function = length_function
+        # With character lengths and a final "" separator, any span no longer
+        # than chunk_size ends up as exactly one (stripped) chunk.
+        self._fits_whole = length_function is None and "" in self.separators and chunk_size > 1
+
+    def _pieces(self, text, start, end, separator):
+        if not separator:
+            return [(i, i + 1) for i in range(start, end)]
+        # Separators stay attached to the start of the following piece, so the
+        # piece boundaries are just the match positions.
+        cuts = [match.start() for match in self._patterns[separator].finditer(text, start, end)]
+        if not cuts or cuts[0] != start:
+            cuts.insert(0, start)
+        cuts.append(end)
+        return list(zip(cuts, cuts[1:]))
+
+    def _emit(self, text, start, end, spans):
+        while start < end and text[start].isspace():
+            start += 1
+        while end > start and text[end - 1].isspace():
+            end -= 1
+        if end > start:
+            spans.append((start, end))
+
+    def _merge(self, text, pieces, lengths, spans):
+        chunk_size, chunk_overlap = self.chunk_size, self.chunk_overlap
+        first = 0
+        total = 0
+        for i, ((start, end), length) in enumerate(zip(pieces, lengths)):
+            if total + length > chunk_size and i > first:
+                self._emit(text, pieces[first][0], pieces[i - 1][1], spans)
+                while total > chunk_overlap or (total + length > chunk_size and total > 0):
+                    total -= lengths[first]
+                    first += 1
+            total += length
+        if first < len(pieces):
+            self._emit(text, pieces[first][0], pieces[-1][1], spans)
+
+    def _measure(self, text):
+        """
+        Returns a function mapping a list of (start, end) pieces to their lengths.
+        """
+        if self.length_function is None:
+            return lambda pieces: [end - start for start, end in pieces]
+        return lambda pieces: [self.length_function(text[start:end]) for start, end in pieces]
+
+    def _split(self, text, start, end, separators, spans, measure):
+        if end <= start:
+            return
+        if self._fits_whole and end - start <= self.chunk_size:
+            # Everything fits in one chunk whatever the separators are.
+            self._emit(text, start, end, spans)
+            return
+        separator = separators[-1]
+        new_separators = []
+        for i, candidate in enumerate(separators):
+            if candidate == "":
+                separator = candidate
+                break
+            if text.find(candidate, start, end) != -1:
+                separator = candidate
+                new_separators = separators[i + 1:]
+                break
+
+        pieces = self._pieces(text, start, end, separator)
+        lengths = measure(pieces)
+        if max(lengths) < self.chunk_size:
+            self._merge(text, pieces, lengths, spans)
+            return
+
+        good_pieces, good_lengths = [], []
+        for (piece_start, piece_end), length in zip(pieces, lengths):
+            if length < self.chunk_size:
+                good_pieces.append((piece_start, piece_end))
+                good_lengths.append(length)
+                continue
+            if good_pieces:
+                self._merge(text, good_pieces, good_lengths, spans)
+                good_pieces, good_lengths = [], []
+            if not new_separators:
+                # LangChain keeps unsplittable pieces verbatim (unstripped).
+                spans.append((piece_start, piece_end))
+            else:
+                self._split(text, piece_start, piece_end, new_separators, spans, measure)
+        if good_pieces:
+            self._merge(text, good_pieces, good_lengths, spans)
+
+    def split_spans(self, text):
+        """
+        Returns the (start, end) offsets of each chunk in `text`.
+        """
+        spans = []
+        self._split(text, 0, len(text), self.separators, spans, self._measure(text))
+        return spans
+
+    def split_text_with_spans(self, text):
+        """
+        Splits `text` into chunks, returning (chunk_text, start, end) tuples.
+        """
+        return [(text[start:end], start, end) for start, end in self.split_spans(text)]
+
+    def split_text(self, text):
+        """
+        Splits `text` into chunks, like RecursiveCharacterTextSplitter.split_text.
+        """
+        return [text[start:end] for start, end in self.split_spans(text)]
+
+    def split_documents(self, documents):
+        """
+        Splits each document into chunks, recording their offsets in the source
+        text as `start_index` / `end_index` metadata.
+
+        Args:
+            documents (list): LangChain Documents, e.g. one per PDF page.
+
+        Returns:
+            list: The chunked Documents.
+        """
+        chunks = []
+        for document in documents:
+            text = document.page_content
+            for start, end in self.split_spans(text):
+                metadata = dict(document.metadata)
+                metadata["start_index"] = start
+                metadata["end_index"] = end
+                chunks.append(Document(page_content=text[start:end], metadata=metadata))
+        return chunks
+
+class TokenAwareSplitter(OffsetTextSplitter):
+    """
+    OffsetTextSplitter that sizes chunks in tokenizer tokens instead of characters.
+
+    Each page is tokenized once with offset mapping; the token count of any
+    piece is then found by bisecting the token offsets rather than
+    re-tokenizing the piece. Every chunk is finally re-counted with the real
+    tokenizer and hard-split at token boundaries if it is still over budget,
+    so no chunk is ever truncated by the embedding model.
+    """
+
+    def __init__(self, tokenizer, chunk_size=254, chunk_overlap=50, separators=None):
+        super().__init__(chunk_size=chunk_size, chunk_overlap=chunk_overlap, separators=separators)
+        self.tokenizer = tokenizer
+        self._fits_whole = False
+
+    def _token_offsets(self, text):
+        encoding = self.tokenizer(text, add_special_tokens=False, return_offsets_mapping=True)
+        return encoding["offset_mapping"]
+
+    def _measure(self, text):
+        offsets = self._token_offsets(text)
+        token_starts = [start for start, _ in offsets]
+        token_ends = [end for _, end in offsets]
+
+        def measure(pieces):
+            # Tokens lying entirely inside the piece.
+            return [
+                max(0, bisect_right(token_ends, end) - bisect_left(token_starts, start))
+                for start, end in pieces
+            ]
+        return measure
+
+    def count_tokens(self, texts):
+        """
+        Returns the exact token count (without special tokens) of each text.
+        """
+        if not texts:
+            return []
+        encodings = self.tokenizer(list(texts), add_special_tokens=False)["input_ids"]
+        return [len(ids) for ids in encodings]
+
+    def _enforce_limit(self, text, start, end):
+        # Cut an over-budget span into windows of at most chunk_size tokens,
+        # shrinking a window if re-tokenizing it on its own yields more tokens.
+        offsets = self._token_offsets(text[start:end])
+        result = []
+        position = 0
+        while position < len(offsets):
+            size = self.chunk_size
+            while True:
+                window = offsets[position:position + size]
+                window_start, window_end = start + window[0][0], start + window[-1][1]
+                count = self.count_tokens([text[window_start:window_end]])[0]
+                if count <= self.chunk_size or size == 1:
+                    break
+                size = max(1, size - (count - self.chunk_size))
+            result.append((window_start, window_end, count))
+            position += len(window)
+        return result
+
+    def split_spans_with_counts(self, text):
+        """
+        Returns (start, end, token_count) for each chunk, every count within chunk_size.
+        """
+        spans = super().split_spans(text)
+        counts = self.count_tokens([text[start:end] for start, end in spans])
+        result = []
+        for (start, end), count in zip(spans, counts):
+            if count <= self.chunk_size:
+                result.append((start, end, count))
+                continue
+            result.extend(self._enforce_limit(text, start, end))
+        return result
+
+    def split_spans(self, text):
+        return [(start, end) for start, end, _ in self.split_spans_with_counts(text)]
+
+    def split_documents(self, documents):
+        """
+        Splits each document into token-sized chunks, recording `start_index`,
+        `end_index` and `token_count` metadata.
+        """
+        chunks = []
+        for document in documents:
+            text = document.page_content
+            for start, end, count in self.split_spans_with_counts(text):
+                metadata = dict(document.metadata)
+                metadata["start_index"] = start
+                metadata["end_index"] = end
+                metadata["token_count"] = count
+                chunks.append(Document(page_content=text[start:end], metadata=metadata))
+        return chunks
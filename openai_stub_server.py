@@ -0,0 +1,130 @@
+# openai_stub_server.py
+
+"""
+A tiny OpenAI-compatible stand-in server for tests and offline benchmarks.
+
+It answers /v1/chat/completions and /v1/completions with the first sentence
+of the prompt's context block after an optional artificial delay, so the app
+can be exercised end to end with LLM_PROVIDER=openai and no real model.
+
+    python openai_stub_server.py --port 8001 --latency-ms 200
+"""
+
+import argparse
+import json
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+def stub_answer(prompt):
+    """
+    Returns the first sentence after "Context:" in the prompt, or a fixed reply.
+    Query-rewrite prompts get the follow-up question back unchanged.
+    """
+    if "Follow-up question:" in prompt:
+        return prompt.split("Follow-up question:", 1)[1].strip().splitlines()[0].strip()
+    context = prompt.split("Context:", 1)[-1].strip()
+    match = re.search(r"(.+?[.!?])(\s|$)", context, re.S)
+    if not context or not match:
+        return "The answer is not available in the context"
+    return " ".join(match.group(1).split())
+
+class StubHandler(BaseHTTPRequestHandler):
+    latency = 0.0
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status, payload):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path.rstrip("/") == "/v1/models":
+            self._send_json(200, {"object": "list", "data": [{"id": "stub", "object": "model"}]})
+        else:
+            self._send_json(404, {"error": {"message": "not found"}})
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        request = json.loads(self.rfile.read(length) or b"{}")
+        chat = self.path.rstrip("/") == "/v1/chat/completions"
+        if not chat and self.path.rstrip("/") != "/v1/completions":
+            self._send_json(404, {"error": {"message": "not found"}})
+            return
+
+        if chat:
+            prompt = "\n".join(str(m.get("content", "")) for m in request.get("messages", []))
+        else:
+            prompt = request.get("prompt", "")
+        time.sleep(self.latency)
+        answer = stub_answer(prompt)
+        completion_id = f"stub-{uuid.uuid4().hex}"
+
+        if request.get("stream"):
+            self._stream(completion_id, answer, chat)
+            return
+
+        choice = {"index": 0, "finish_reason": "stop"}
+        if chat:
+            choice["message"] = {"role": "assistant", "content": answer}
+        else:
+            choice["text"] = answer
+        self._send_json(200, {
+            "id": completion_id,
+            "object": "chat.completion" if chat else "text_completion",
+            "created": int(time.time()),
+            "model": request.get("model", "stub"),
+            "choices": [choice],
+            "usage": {"prompt_tokens": len(prompt) // 4, "completion_tokens": len(answer) // 4,
+                      "total_tokens": (len(prompt) + len(answer)) // 4},
+        })
+
+    def _stream(self, completion_id, answer, chat):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.end_headers()
+        for i, word in enumerate(answer.split(" ")):
+            piece = word if i == 0 else " " + word
+            delta = {"delta": {"content": piece}} if chat else {"text": piece}
+            chunk = {"id": completion_id, "object": "chat.completion.chunk" if chat else "text_completion",
+                     "choices": [{"index": 0, "finish_reason": None, **delta}]}
+            self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+        done = {"id": completion_id, "choices": [{"index": 0, "finish_reason": "stop",
+                                                  **({"delta": {}} if chat else {"text": ""})}]}
+        self.wfile.write(f"data: {json.dumps(done)}\n\ndata: [DONE]\n\n".encode("utf-8"))
+
+def start_stub_server(host="127.0.0.1", port=0, latency_ms=0):
+    """
+    Starts the stub server on a background thread.
+
+    Args:
+        host (str): Interface to bind.
+        port (int): Port to bind; 0 picks a free port.
+        latency_ms (int): Artificial delay added to every completion.
+
+    Returns:
+        ThreadingHTTPServer: The running server; its base URL is
+        f"http://{host}:{server.server_address[1]}/v1".
+    """
+    handler = type("ConfiguredStubHandler", (StubHandler,), {"latency": latency_ms / 1000.0})
+    server = ThreadingHTTPServer((host, port), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="OpenAI-compatible stub LLM server.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--latency-ms", type=int, default=0)
+    args = parser.parse_args()
+
+    handler = type("ConfiguredStubHandler", (StubHandler,), {"latency": args.latency_ms / 1000.0})
+    print(f"Stub LLM server listening on http://{args.host}:{args.port}/v1")
+    ThreadingHTTPServer((args.host, args.port), handler).serve_forever()
@@ -0,0 +1,280 @@
+# outbox.py
+
+import os
+import pickle
+import sqlite3
+import threading
+import time
+
+import numpy as np
+
+OUTBOX_PATH = os.getenv("OUTBOX_PATH", "local_data/outbox.sqlite3")
+OUTBOX_BATCH_SIZE = int(os.getenv("OUTBOX_BATCH_SIZE", "100"))
+# A failed batch is retried after 1s, 2s, 4s, ... up to this many seconds.
+OUTBOX_MAX_BACKOFF_SECONDS = float(os.getenv("OUTBOX_MAX_BACKOFF_SECONDS", "300"))
+# An entry that has failed this many times (about an hour of retries with the
+# default backoff) is moved to the dead_letters table.
+OUTBOX_MAX_ATTEMPTS = int(os.getenv("OUTBOX_MAX_ATTEMPTS", "20"))
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    namespace TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    chunk_id TEXT NOT NULL,
+    payload BLOB NOT NULL,
+    created REAL NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt REAL NOT NULL DEFAULT 0,
+    last_error TEXT
+);
+CREATE UNIQUE INDEX IF NOT EXISTS pending_upserts ON entries (namespace, chunk_id) WHERE kind = 'upsert';
+CREATE INDEX IF NOT EXISTS due ON entries (next_attempt, id);
+CREATE TABLE IF NOT EXISTS dead_letters (
+    id INTEGER PRIMARY KEY,
+    namespace TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    chunk_id TEXT NOT NULL,
+    payload BLOB NOT NULL,
+    created REAL NOT NULL,
+    attempts INTEGER NOT NULL,
+    last_error TEXT,
+    failed REAL NOT NULL
+);
+"""
+
+def _is_transient(error):
+    # Outages and throttling (connection errors, timeouts, 5xx, 429) affect the
+    # whole batch. Anything else, e.g. a 4xx for an oversized entry or a
+    # dimension mismatch, is blamed on an entry in it.
+    status = getattr(error, "status", None) or getattr(error, "status_code", None)
+    if isinstance(status, int):
+        return status >= 500 or status == 429
+    return not isinstance(error, (ValueError, TypeError, KeyError))
+
+class Outbox:
+    """
+    Durable queue of vector-store writes, kept in a local SQLite database.
+
+    Chunks are staged with their already computed vectors, so a remote
+    outage never costs a second embedding pass. A background flusher hands
+    due entries to `sink` in batches, deletes them once the sink returns and
+    backs off exponentially per entry when it raises. Writes are keyed by
+    chunk id, so an entry retried after a partial failure overwrites rather
+    than duplicates.
+
+    A batch rejected for its content (not an outage) is split in halves and
+    retried at once, so one bad entry cannot hold back the rest. Entries
+    still failing after OUTBOX_MAX_ATTEMPTS are moved to a dead-letter table;
+    `requeue_dead_letters` puts them back once the cause is fixed.
+
+    Args:
+        path: SQLite database file.
+        sink: Called as sink(namespace, upserts, source_updates), where
+            upserts is a list of {"id", "values", "metadata"} dicts and
+            source_updates maps chunk ids to sets of sources to add.
+    """
+
+    def __init__(self, path, sink, batch_size=OUTBOX_BATCH_SIZE):
+        self.path = path
+        self.sink = sink
+        self.batch_size = batch_size
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=FULL")
+        self._conn.executescript(_SCHEMA)
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._flusher = None
+        self.metrics = {"flushed": 0, "failed_batches": 0, "dead_lettered": 0, "last_error": None}
+
+    def stage(self, namespace, chunks, vectors):
+        """
+        Stores chunks with their vectors; they are written by the flusher.
+        """
+        now = time.time()
+        rows = []
+        for chunk, vector in zip(chunks, vectors):
+            metadata = dict(chunk.metadata, text=chunk.page_content)
+            payload = {"values": np.asarray(vector, dtype=np.float32).tobytes(), "metadata": metadata}
+            rows.append((namespace, "upsert", chunk.metadata["chunk_id"], pickle.dumps(payload), now))
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            # A newer copy of a chunk that is still waiting replaces it.
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO entries (namespace, kind, chunk_id, payload, created) VALUES (?, ?, ?, ?, ?)",
+                rows)
+            self._conn.execute("COMMIT")
+        self._wake.set()
+
+    def stage_sources(self, namespace, new_sources):
+        """
+        Stores source additions for chunks ({chunk id: sources}). A chunk whose
+        upsert is still waiting gets them merged into that upsert instead.
+        """
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            for chunk_id, sources in new_sources.items():
+                row = self._conn.execute(
+                    "SELECT id, payload FROM entries WHERE namespace = ? AND kind = 'upsert' AND chunk_id = ?",
+                    (namespace, chunk_id)).fetchone()
+                if row is not None:
+                    payload = pickle.loads(row[1])
+                    metadata = payload["metadata"]
+                    metadata["sources"] = sorted(set(metadata.get("sources") or []) | set(sources))
+                    # Replaced under a new id, so a flush already sending the old copy
+                    # does not delete this one when it finishes.
+                    self._conn.execute(
+                        "INSERT OR REPLACE INTO entries (namespace, kind, chunk_id, payload, created) "
+                        "VALUES (?, 'upsert', ?, ?, ?)", (namespace, chunk_id, pickle.dumps(payload), now))
+                else:
+                    self._conn.execute(
+                        "INSERT INTO entries (namespace, kind, chunk_id, payload, created) VALUES (?, 'sources', ?, ?, ?)",
+                        (namespace, chunk_id, pickle.dumps(sorted(sources)), now))
+            self._conn.execute("COMMIT")
+        self._wake.set()
+
+    def flush(self):
+        """
+        Writes every due entry, one batch at a time, until none are left or a
+        batch fails. Returns the number of entries written.
+        """
+        with self._flush_lock:
+            return self._flush()
+
+    def _flush(self):
+        written = 0
+        while True:
+            with self._lock:
+                rows = self._conn.execute(
+                    "SELECT id, namespace, kind, chunk_id, payload, attempts FROM entries "
+                    "WHERE next_attempt <= ? ORDER BY id LIMIT ?", (time.time(), self.batch_size)).fetchall()
+            if not rows:
+                return written
+            # One namespace per sink call; the rest of the batch comes next round.
+            namespace = rows[0][1]
+            rows = [row for row in rows if row[1] == namespace]
+            sent, outage = self._send(namespace, rows)
+            written += sent
+            if outage:
+                return written
+
+    def _send(self, namespace, rows):
+        # Writes rows with one sink call, bisecting a batch rejected for its
+        # content. Returns (rows written, whether the sink looks down).
+        upserts, source_updates = [], {}
+        for _, _, kind, chunk_id, payload, _ in rows:
+            payload = pickle.loads(payload)
+            if kind == "upsert":
+                upserts.append({
+                    "id": chunk_id,
+                    "values": np.frombuffer(payload["values"], dtype=np.float32).tolist(),
+                    "metadata": payload["metadata"],
+                })
+            else:
+                source_updates.setdefault(chunk_id, set()).update(payload)
+        try:
+            self.sink(namespace, upserts, source_updates)
+        except Exception as e:
+            transient = _is_transient(e)
+            if transient or len(rows) == 1:
+                self._failed(rows, e)
+                return 0, transient
+            middle = len(rows) // 2
+            first, first_outage = self._send(namespace, rows[:middle])
+            if first_outage:
+                self._failed(rows[middle:], e)
+                return first, True
+            second, second_outage = self._send(namespace, rows[middle:])
+            return first + second, second_outage
+        with self._lock:
+            self._conn.executemany("DELETE FROM entries WHERE id = ?", [(row[0],) for row in rows])
+        self.metrics["flushed"] += len(rows)
+        return len(rows), False
+
+    def _failed(self, rows, error):
+        self.metrics["failed_batches"] += 1
+        self.metrics["last_error"] = f"{type(error).__name__}: {error}"
+        now = time.time()
+        retry = [row for row in rows if row[5] + 1 < OUTBOX_MAX_ATTEMPTS]
+        dead = [row for row in rows if row[5] + 1 >= OUTBOX_MAX_ATTEMPTS]
+        if retry:
+            print(f"Vector store write of {len(retry)} entries failed, will retry: {error}")
+        if dead:
+            print(f"Giving up on {len(dead)} vector store writes after {OUTBOX_MAX_ATTEMPTS} attempts: {error}")
+            self.metrics["dead_lettered"] += len(dead)
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            self._conn.executemany(
+                "UPDATE entries SET attempts = ?, next_attempt = ?, last_error = ? WHERE id = ?",
+                [(attempts + 1, now + min(OUTBOX_MAX_BACKOFF_SECONDS, 2 ** attempts), str(error), entry_id)
+                 for entry_id, _, _, _, _, attempts in retry])
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO dead_letters "
+                "SELECT id, namespace, kind, chunk_id, payload, created, ?, ?, ? FROM entries WHERE id = ?",
+                [(attempts + 1, str(error), now, entry_id) for entry_id, _, _, _, _, attempts in dead])
+            self._conn.executemany("DELETE FROM entries WHERE id = ?", [(row[0],) for row in dead])
+            self._conn.execute("COMMIT")
+
+    def requeue_dead_letters(self):
+        """
+        Moves every dead-lettered entry back into the queue with a fresh retry
+        budget; a chunk with a newer pending upsert keeps the newer one.
+        Returns the number of entries moved.
+        """
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            moved = self._conn.execute(
+                "INSERT OR IGNORE INTO entries (namespace, kind, chunk_id, payload, created) "
+                "SELECT namespace, kind, chunk_id, payload, created FROM dead_letters ORDER BY id").rowcount
+            self._conn.execute("DELETE FROM dead_letters")
+            self._conn.execute("COMMIT")
+        self._wake.set()
+        return moved
+
+    def start(self):
+        """
+        Starts the background flusher (once).
+        """
+        with self._lock:
+            if self._flusher is None:
+                self._flusher = threading.Thread(target=self._run, name="outbox-flusher", daemon=True)
+                self._flusher.start()
+        self._wake.set()
+
+    def _run(self):
+        while True:
+            self._wake.wait(timeout=self._seconds_until_due())
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"Outbox flush failed: {e}")
+
+    def _seconds_until_due(self):
+        with self._lock:
+            row = self._conn.execute("SELECT MIN(next_attempt) FROM entries").fetchone()
+        if row[0] is None:
+            return None
+        return max(0.05, row[0] - time.time())
+
+    def backlog(self):
+        """
+        Returns how many entries are waiting, how many of them have failed at
+        least once, the age in seconds of the oldest one, and how many were
+        given up on (dead letters).
+        """
+        with self._lock:
+            pending, failing, oldest = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(attempts > 0), 0), MIN(created) FROM entries").fetchone()
+            dead = self._conn.execute("SELECT COUNT(*) FROM dead_letters").fetchone()[0]
+        return {
+            "pending": pending,
+            "failing": failing,
+            "dead": dead,
+            "oldest_seconds": time.time() - oldest if oldest is not None else 0.0,
+            **self.metrics,
+        }
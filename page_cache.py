@@ -0,0 +1,184 @@
+# page_cache.py
+
+import gzip
+import hashlib
+import io
+import json
+import os
+import tempfile
+
+import fitz
+from langchain_core.documents import Document
+
+PAGE_CACHE_DIR = os.getenv("PAGE_CACHE_DIR", "local_data/page_cache")
+# Content-addressed copies of uploaded PDFs, written only when asked to persist.
+UPLOAD_STORE_DIR = os.getenv("UPLOAD_STORE_DIR", "local_data/uploads")
+# Bump the suffix whenever extraction output changes so stale entries are ignored.
+EXTRACTOR_VERSION = f"pymupdf-{fitz.VersionBind}-3"
+# Lines whose block centre lies in the top or bottom EDGE_BAND of the page are
+# recorded with their position, for header/footer detection.
+EDGE_BAND = 0.15
+
+HASH_BLOCK_SIZE = 1 << 20
+
+def file_sha256(file_path):
+    """
+    Returns the SHA-256 hex digest of a file, read in 1 MiB blocks.
+    """
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(HASH_BLOCK_SIZE), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def read_source(source):
+    """
+    Returns (data, sha256 hex digest) for an in-memory PDF without extra copies
+    where possible.
+
+    PyMuPDF only opens `bytes` from memory, so bytes, memoryviews over bytes and
+    BytesIO objects (e.g. Streamlit uploads) are used in place. Other binary
+    streams are hashed block by block while they are read.
+
+    Args:
+        source: bytes, bytearray, memoryview or a binary file-like object.
+    """
+    if isinstance(source, memoryview):
+        if isinstance(source.obj, bytes) and source.contiguous and source.nbytes == len(source.obj):
+            source = source.obj
+        elif isinstance(source.obj, io.BytesIO):
+            source = source.obj.getvalue()
+        else:
+            source = source.tobytes()
+    elif isinstance(source, io.BytesIO):
+        # Shares the internal buffer instead of copying it.
+        source = source.getvalue()
+    elif isinstance(source, bytearray):
+        source = bytes(source)
+
+    if isinstance(source, bytes):
+        return source, hashlib.sha256(source).hexdigest()
+
+    digest = hashlib.sha256()
+    blocks = []
+    for block in iter(lambda: source.read(HASH_BLOCK_SIZE), b""):
+        digest.update(block)
+        blocks.append(block)
+    return b"".join(blocks), digest.hexdigest()
+
+def persist_upload(data, content_hash, store_dir=UPLOAD_STORE_DIR):
+    """
+    Stores PDF bytes under their content hash (once) and returns the stored path.
+    """
+    path = os.path.join(store_dir, f"{content_hash}.pdf")
+    if os.path.exists(path):
+        return path
+    os.makedirs(store_dir, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=store_dir, suffix=".tmp")
+    with os.fdopen(fd, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+    return path
+
+def _edge_lines(page):
+    # [text, relative vertical position] for every line near the top or bottom edge.
+    height = page.rect.height or 1.0
+    lines = []
+    for x0, y0, x1, y1, text, _, block_type in page.get_text("blocks"):
+        position = (y0 + y1) / 2 / height
+        if block_type != 0 or EDGE_BAND < position < 1 - EDGE_BAND:
+            continue
+        lines.extend([line, round(position, 3)] for line in text.splitlines() if line.strip())
+    return lines
+
+def _extract_pages(pdf):
+    # Same (stripped) text and metadata fields as PyMuPDFLoader, minus the path fields.
+    document_metadata = {k: v for k, v in (pdf.metadata or {}).items() if isinstance(v, (str, int, float))}
+    document_metadata["total_pages"] = len(pdf)
+    return [
+        {"page": page.number, "text": page.get_text().strip(), "edge_lines": _edge_lines(page), "metadata": dict(document_metadata)}
+        for page in pdf
+    ]
+
+def _cache_path(content_hash, cache_dir):
+    return os.path.join(cache_dir, f"{content_hash}.{EXTRACTOR_VERSION}.json.gz")
+
+def read_cached_pages(content_hash, cache_dir=PAGE_CACHE_DIR):
+    """
+    Returns the cached pages for a content hash as a list of
+    {"page", "text", "metadata"} dicts, or None on a miss.
+    """
+    try:
+        with gzip.open(_cache_path(content_hash, cache_dir), "rt", encoding="utf-8") as f:
+            entry = json.load(f)
+    except (FileNotFoundError, OSError, ValueError):
+        return None
+    if entry.get("extractor") != EXTRACTOR_VERSION:
+        return None
+    return entry["pages"]
+
+def write_cached_pages(content_hash, pages, cache_dir=PAGE_CACHE_DIR):
+    """
+    Stores extracted pages atomically, so readers never see a partial entry.
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    entry = {"extractor": EXTRACTOR_VERSION, "content_hash": content_hash, "pages": pages}
+    fd, tmp_path = tempfile.mkstemp(dir=cache_dir, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as raw, gzip.GzipFile(fileobj=raw, mode="wb", compresslevel=6) as f:
+            f.write(json.dumps(entry, ensure_ascii=False, separators=(",", ":")).encode("utf-8"))
+        os.replace(tmp_path, _cache_path(content_hash, cache_dir))
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+def load_pages(source, name=None, cache_dir=PAGE_CACHE_DIR, persist=False, include_layout=False):
+    """
+    Loads a PDF as one Document per page, reusing previously extracted text.
+
+    Page text is cached by (file content hash, page number, extractor version),
+    so re-chunking, re-embedding or rebuilding an index skips PDF parsing for
+    any file seen before, even if it was renamed or moved. In-memory uploads
+    are parsed straight from memory and never written to a temp file.
+
+    Args:
+        source: A file path, or the PDF content as bytes / memoryview / binary stream.
+        name (str): Display name recorded as the source of in-memory PDFs.
+        cache_dir (str): Where compressed page-text entries are stored.
+        persist (bool): Also keep in-memory PDFs in the content-addressed upload store.
+        include_layout (bool): Add the page's `edge_lines` (lines near the top/bottom
+            edge with their relative position) to the metadata.
+
+    Returns:
+        list: One Document per page, with the same metadata as PyMuPDFLoader.
+    """
+    if isinstance(source, (str, os.PathLike)):
+        file_path = os.fspath(source)
+        data, content_hash = None, file_sha256(file_path)
+        name = name or file_path
+    else:
+        data, content_hash = read_source(source)
+        name = name or f"{content_hash[:12]}.pdf"
+        file_path = persist_upload(data, content_hash) if persist else name
+
+    pages = read_cached_pages(content_hash, cache_dir)
+    if pages is None:
+        pdf = fitz.open(file_path) if data is None else fitz.open(stream=data, filetype="pdf")
+        with pdf:
+            pages = _extract_pages(pdf)
+        try:
+            write_cached_pages(content_hash, pages, cache_dir)
+        except OSError as e:
+            print(f"Could not write page cache for {name}: {e}")
+    else:
+        print(f"Page cache hit for {os.path.basename(name)} ({len(pages)} pages).")
+
+    documents = []
+    for page in pages:
+        metadata = dict(page["metadata"])
+        metadata.update({"source": name, "file_path": file_path, "page": page["page"], "content_hash": content_hash})
+        if include_layout:
+            metadata["edge_lines"] = page["edge_lines"]
+        documents.append(Document(page_content=page["text"], metadata=metadata))
+    return documents
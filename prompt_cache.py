@@ -0,0 +1,134 @@
+# prompt_cache.py
+
+import hashlib
+import threading
+from collections import OrderedDict
+
+from llama_cpp import Llama, LlamaDiskCache
+
+class PromptPrefixCache(LlamaDiskCache):
+    """
+    Persistent KV-state cache for the local llama.cpp model, restricted to prompt prefixes.
+
+    llama.cpp looks up the longest cached token prefix before every completion
+    and restores it, so only the uncached tail of the prompt is prefilled.
+    Unlike the stock disk cache, this one keeps entries on lookup and ignores the
+    per-completion writes (prompt + answer, never reused); it only stores states
+    requested through `store_prefix`: the fixed instruction block, and
+    instruction + context for context blocks that recur.
+
+    Storing a prefix evaluates it on the model, so it holds `model_lock`,
+    which completions must hold too (see LockedModel). Recurrence is only
+    tracked for the `max_tracked_contexts` most recently seen contexts.
+    """
+
+    def __init__(self, model, cache_dir, capacity_bytes=(2 << 30), min_context_repeats=2,
+                 max_tracked_contexts=4096):
+        super().__init__(cache_dir=cache_dir, capacity_bytes=capacity_bytes)
+        self.model = model
+        self.min_context_repeats = min_context_repeats
+        self.max_tracked_contexts = max_tracked_contexts
+        self.context_counts = OrderedDict()
+        self.metrics = {"lookups": 0, "hits": 0, "prompt_tokens": 0, "reused_tokens": 0, "stored_prefixes": 0}
+        self._storing = False
+        self.model_lock = threading.Lock()
+        self._counts_lock = threading.Lock()
+
+    def _tokenize(self, text):
+        return self.model.tokenize(text.encode("utf-8"), add_bos=True, special=True)
+
+    def __getitem__(self, key):
+        key = tuple(key)
+        _key = self._find_longest_prefix_key(key)
+        self.metrics["lookups"] += 1
+        self.metrics["prompt_tokens"] += len(key)
+        if _key is None:
+            raise KeyError("Key not found")
+        self.metrics["hits"] += 1
+        self.metrics["reused_tokens"] += Llama.longest_token_prefix(_key, key)
+        return self.cache[_key]
+
+    def __setitem__(self, key, value):
+        if self._storing:
+            super().__setitem__(key, value)
+
+    def store_prefix(self, text):
+        """
+        Evaluates `text` (reusing any cached shorter prefix) and persists its KV state.
+
+        Does nothing if exactly this prefix is already cached, so restarts reuse the
+        state written by a previous process instead of prefilling again.
+        """
+        tokens = self._tokenize(text)
+        with self.model_lock:
+            if tuple(tokens) in self.cache:
+                return
+            model = self.model
+            cached_key = self._find_longest_prefix_key(tuple(tokens))
+            if cached_key is not None:
+                cached_len = Llama.longest_token_prefix(cached_key, tokens)
+                if cached_len > Llama.longest_token_prefix(model._input_ids.tolist(), tokens):
+                    model.load_state(self.cache[cached_key])
+            n_past = Llama.longest_token_prefix(model._input_ids.tolist(), tokens)
+            model.n_tokens = n_past
+            if n_past < len(tokens):
+                model.eval(tokens[n_past:])
+            self._storing = True
+            try:
+                self[tokens] = model.save_state()
+            finally:
+                self._storing = False
+            self.metrics["stored_prefixes"] += 1
+            print(f"Prompt cache stored a {len(tokens)}-token prefix ({len(tokens) - n_past} newly prefilled).")
+
+    def prime(self, prompt, split_marker):
+        """
+        Caches the part of `prompt` before `split_marker` once it has been seen
+        `min_context_repeats` times, so repeated retrieved contexts skip prefill.
+        """
+        head, marker, _ = prompt.partition(split_marker)
+        if not marker:
+            return
+        digest = hashlib.sha1(head.encode("utf-8")).hexdigest()
+        with self._counts_lock:
+            count = self.context_counts.pop(digest, 0) + 1
+            self.context_counts[digest] = count
+            if len(self.context_counts) > self.max_tracked_contexts:
+                self.context_counts.popitem(last=False)
+        if count == self.min_context_repeats:
+            self.store_prefix(head)
+
+    def stats(self):
+        """
+        Returns hit-rate metrics: lookup hit rate and the share of prompt tokens served from cache.
+        """
+        stats = dict(self.metrics)
+        stats["hit_rate"] = stats["hits"] / stats["lookups"] if stats["lookups"] else 0.0
+        stats["token_reuse_rate"] = stats["reused_tokens"] / stats["prompt_tokens"] if stats["prompt_tokens"] else 0.0
+        stats["entries"] = len(self.cache)
+        stats["size_bytes"] = self.cache_size
+        return stats
+
+class LockedModel:
+    """
+    Wraps a llama.cpp model so each completion holds `lock` from start to end
+    (for a stream, until it is exhausted or closed). A llama.cpp context is not
+    thread-safe, and prefix stores evaluate on the same context.
+    """
+
+    def __init__(self, model, lock):
+        self._model = model
+        self._lock = lock
+
+    def __getattr__(self, name):
+        return getattr(self._model, name)
+
+    def __call__(self, *args, **kwargs):
+        if kwargs.get("stream"):
+            return self._stream(*args, **kwargs)
+        with self._lock:
+            return self._model(*args, **kwargs)
+
+    def _stream(self, *args, **kwargs):
+        with self._lock:
+            yield from self._model(*args, **kwargs)
@@ -1,8 +1,51 @@
 # qa_system.py
 
-from langchain_groq import ChatGroq
+import asyncio
+from functools import lru_cache
+
 from langchain.prompts import PromptTemplate
 from langchain_core.output_parsers import StrOutputParser
+from langchain_core.runnables import RunnableLambda
+
+from admission import Overloaded, aadmit, astage, get_admission_controller, get_admission_report, stage
+from chat_history import ChatHistoryBuffer, LRUCache, needs_rewrite
+from extractive_answerer import atry_extractive_answer, format_citation, get_extractive_report, try_extractive_answer
+from llm_providers import LLM_PROVIDER, get_llm, get_prompt_cache
+from llm_scheduler import INTERACTIVE, RateLimitExceeded, StreamInterrupted, estimate_tokens, get_scheduler
+from query_cache import get_query_embedding_cache
+from resilience import (
+    LLM_MIN_BUDGET_SECONDS, QA_DEADLINE_SECONDS, RETRIEVAL_TIMEOUT_SECONDS, REWRITE_TIMEOUT_SECONDS,
+    CircuitOpenError, Deadline, DeadlineExceeded, get_breaker, get_breaker_report
+)
+from single_flight import COALESCE_ENABLED, SingleFlight, normalize_question
+from vector_store import source_filter
+
+BUSY_MESSAGE = "The answer service is busy right now. Please try again in a moment."
+SEARCH_UNAVAILABLE_MESSAGE = "Document search is not responding right now. Please try again in a moment."
+DEGRADED_MESSAGE = "The answer service is not responding right now, so here are the most relevant passages:"
+DEGRADED_PASSAGES = 3
+DEGRADED_SNIPPET_CHARS = 300
+
+# The prompt is laid out as a byte-stable instruction prefix followed by the
+# per-request context and question, so backends with a KV/prefix cache
+# (the local llama.cpp model, and providers with automatic prefix caching)
+# never prefill the instructions twice. Keep anything variable out of the prefix.
+PROMPT_PREFIX = (
+    "Answer the question as detailed as possible from the provided context. If the answer is not in\n"
+    "the provided context, just say, \"The answer is not available in the context\". Do not provide a wrong answer.\n\n"
+)
+QUESTION_MARKER = "\n\nQuestion:\n"
+PROMPT_SUFFIX = "Context:\n{context}" + QUESTION_MARKER + "{question}\n\nAnswer:\n"
+
+REWRITE_PROMPT_TEMPLATE = (
+    "Rewrite the follow-up question as a standalone question that can be understood without the "
+    "conversation. Keep it short and return only the question.\n\n"
+    "Conversation:\n{history}\n\nFollow-up question: {question}\n\nStandalone question:"
+)
+
+_rewrite_cache = LRUCache(maxsize=512)
+# Identical questions asked while one is being answered share its answer (and token stream).
+_flights = SingleFlight()
 
 def format_documents(docs):
     """
@@ -10,47 +53,465 @@ def format_documents(docs):
     """
     return "\n\n".join(doc.page_content for doc in docs)
 
-def create_rag_chain():
+def degraded_answer(docs):
     """
-    Creates the RAG chain using LangChain Expression Language (LCEL).
+    Builds the reply used when the LLM cannot answer in time: the top
+    retrieved chunks, shortened, with their page references.
     """
-    prompt_template = """
-    Answer the question as detailed as possible from the provided context. If the answer is not in
-    the provided context, just say, "The answer is not available in the context". Do not provide a wrong answer.
-
-    Context:
-    {context}
+    if not docs:
+        return BUSY_MESSAGE
+    parts = [DEGRADED_MESSAGE]
+    for number, doc in enumerate(docs[:DEGRADED_PASSAGES], 1):
+        text = " ".join(doc.page_content.split())
+        if len(text) > DEGRADED_SNIPPET_CHARS:
+            text = text[:DEGRADED_SNIPPET_CHARS].rsplit(" ", 1)[0] + "..."
+        parts.append(f"{number}. {text}\n\n_Source: {format_citation(doc.metadata)}_")
+    return "\n\n".join(parts)
 
-    Question:
-    {question}
+def _prime_prompt_cache(prompt_value):
+    """
+    Lets the local model cache instruction + context states for contexts that recur.
+    """
+    prompt_cache = get_prompt_cache()
+    if prompt_cache is not None:
+        prompt_cache.prime(prompt_value.to_string(), QUESTION_MARKER)
+    return prompt_value
 
-    Answer:
+@lru_cache(maxsize=1)
+def create_rag_chain():
     """
-    prompt = PromptTemplate(template=prompt_template, input_variables=["context", "question"])
-    llm = ChatGroq(model_name="llama3-8b-8192", temperature=0.3)
-    
+    Creates the RAG chain using LangChain Expression Language (LCEL).
+    The chain is stateless, so it is built once and shared by all requests.
+    """
+    prompt = PromptTemplate(template=PROMPT_PREFIX + PROMPT_SUFFIX, input_variables=["context", "question"])
+    llm = get_llm(warm_prefix=PROMPT_PREFIX)
+
     rag_chain = (
         {"context": lambda x: format_documents(x["input_documents"]), "question": lambda x: x["question"]}
         | prompt
+        | RunnableLambda(_prime_prompt_cache)
         | llm
         | StrOutputParser()
     )
-    
-    print("RAG chain created using Groq.")
+
+    print(f"RAG chain created using provider '{LLM_PROVIDER}'.")
     return rag_chain
 
-def get_answer_from_query(vector_store, query):
+@lru_cache(maxsize=1)
+def create_rewrite_chain():
+    """
+    Creates the chain that turns a follow-up into a standalone question.
+    """
+    prompt = PromptTemplate(template=REWRITE_PROMPT_TEMPLATE, input_variables=["history", "question"])
+    return prompt | get_llm(warm_prefix=PROMPT_PREFIX) | StrOutputParser()
+
+def _rewrite_inputs(query, history):
+    """
+    Returns the rewrite chain inputs, or None when the query can be searched as is.
+    """
+    if not history or not needs_rewrite(query):
+        return None
+    if not isinstance(history, ChatHistoryBuffer):
+        history = ChatHistoryBuffer.from_messages(history)
+    return {"history": history.render(), "question": query}
+
+def _clean_rewrite(rewritten, query):
+    lines = [line for line in rewritten.strip().splitlines() if line.strip()]
+    rewritten = lines[0].strip().strip('"') if lines else ""
+    return rewritten or query
+
+def rewrite_query(query, history=None, priority=INTERACTIVE, deadline=None):
+    """
+    Rewrites a follow-up question into a standalone one using the chat history.
+    Results are cached per (history, question), and questions that do not refer
+    back to the conversation skip the LLM call entirely. If the LLM fails, is
+    unavailable or takes longer than REWRITE_TIMEOUT_SECONDS of the request's
+    deadline, the original question is used. Rewrites have their own circuit
+    breaker: missing that short budget says little about answering.
+
+    Args:
+        query (str): The user's question.
+        history (ChatHistoryBuffer or list): Earlier messages of the conversation.
+        priority (int): Scheduler priority of the rewrite call.
+        deadline (Deadline): The request's deadline.
+
+    Returns:
+        str: The question to retrieve and answer with.
+    """
+    inputs = _rewrite_inputs(query, history)
+    if inputs is None:
+        return query
+    cache_key = (inputs["history"], query)
+    cached = _rewrite_cache.get(cache_key)
+    if cached is not None:
+        return cached
+    try:
+        chain = create_rewrite_chain()
+        budget = deadline.capped(REWRITE_TIMEOUT_SECONDS) if deadline is not None else None
+        rewritten = get_breaker("rewrite").call(lambda: get_scheduler().submit_sync(
+            lambda: chain.ainvoke(inputs), priority=priority, tokens=estimate_tokens(inputs["history"] + query, 64),
+            deadline=budget,
+        ))
+    except Exception as e:
+        print(f"Query rewriting failed, using the original question: {e}")
+        return query
+    rewritten = _clean_rewrite(rewritten, query)
+    _rewrite_cache.put(cache_key, rewritten)
+    print(f"Rewrote follow-up '{query}' as '{rewritten}'.")
+    return rewritten
+
+async def arewrite_query(query, history=None, priority=INTERACTIVE, deadline=None):
+    """
+    Async version of rewrite_query.
+    """
+    inputs = _rewrite_inputs(query, history)
+    if inputs is None:
+        return query
+    cache_key = (inputs["history"], query)
+    cached = _rewrite_cache.get(cache_key)
+    if cached is not None:
+        return cached
+    try:
+        chain = create_rewrite_chain()
+        budget = deadline.capped(REWRITE_TIMEOUT_SECONDS) if deadline is not None else None
+        rewritten = await get_breaker("rewrite").acall(lambda: get_scheduler().submit(
+            lambda: chain.ainvoke(inputs), priority=priority, tokens=estimate_tokens(inputs["history"] + query, 64),
+            deadline=budget,
+        ))
+    except Exception as e:
+        print(f"Query rewriting failed, using the original question: {e}")
+        return query
+    rewritten = _clean_rewrite(rewritten, query)
+    _rewrite_cache.put(cache_key, rewritten)
+    return rewritten
+
+class SearchUnavailable(Exception):
+    """Raised when the query could not be embedded for the search."""
+
+def _retrieval_timeout(deadline):
+    return deadline.budget(RETRIEVAL_TIMEOUT_SECONDS) if deadline is not None else None
+
+def _retrieve(vector_store, search_query, sources=None, deadline=None):
+    # The query is embedded and searched as two stages, each with its own
+    # concurrency limit. Each runs through its dependency's circuit breaker,
+    # giving up after RETRIEVAL_TIMEOUT_SECONDS of the request's deadline.
+    # `sources` restricts the search to those documents before scoring.
+    search_filter = source_filter(sources)
+    embeddings = getattr(vector_store, "embeddings", None)
+    if embeddings is None:
+        search = lambda: vector_store.similarity_search(search_query, k=5, filter=search_filter)
+    else:
+        with stage("embedding", deadline):
+            try:
+                vector = get_breaker("embedding").call(
+                    lambda: _embed_query(embeddings, search_query), timeout=_retrieval_timeout(deadline))
+            except (CircuitOpenError, DeadlineExceeded):
+                raise
+            except Exception as e:
+                raise SearchUnavailable(f"could not embed the query: {e}") from e
+        search = lambda: vector_store.similarity_search_by_vector(vector, k=5, filter=search_filter)
+    with stage("search", deadline):
+        return get_breaker("vector_store").call(search, timeout=_retrieval_timeout(deadline))
+
+def _embed_query(embeddings, search_query):
+    # Retries and re-asks repeat the same query text, so embeddings are cached.
+    cache = get_query_embedding_cache()
+    if cache is None:
+        return embeddings.embed_query(search_query)
+    return cache.embed_query(embeddings, search_query)
+
+async def _aretrieve(vector_store, search_query, sources=None, deadline=None):
+    search_filter = source_filter(sources)
+    embeddings = getattr(vector_store, "embeddings", None)
+    if embeddings is None:
+        search = lambda: vector_store.asimilarity_search(search_query, k=5, filter=search_filter)
+    else:
+        with await astage("embedding", deadline):
+            try:
+                vector = await get_breaker("embedding").acall(
+                    lambda: _aembed_query(embeddings, search_query), timeout=_retrieval_timeout(deadline))
+            except (CircuitOpenError, DeadlineExceeded):
+                raise
+            except Exception as e:
+                raise SearchUnavailable(f"could not embed the query: {e}") from e
+        search = lambda: vector_store.asimilarity_search_by_vector(vector, k=5, filter=search_filter)
+    with await astage("search", deadline):
+        return await get_breaker("vector_store").acall(search, timeout=_retrieval_timeout(deadline))
+
+async def _aembed_query(embeddings, search_query):
+    cache = get_query_embedding_cache()
+    if cache is None:
+        return await embeddings.aembed_query(search_query)
+    return await cache.aembed_query(embeddings, search_query)
+
+def _chain_inputs(similar_docs, query):
+    inputs = {"input_documents": similar_docs, "question": query}
+    tokens = estimate_tokens(format_documents(similar_docs) + query)
+    return inputs, tokens
+
+def _llm_call(rag_chain, inputs, publish):
+    # Returns the coroutine function the scheduler runs; with `publish`, the
+    # answer is streamed and every chunk is handed to it as it arrives.
+    if publish is None:
+        return lambda: rag_chain.ainvoke(inputs)
+
+    async def stream():
+        parts = []
+        try:
+            async for chunk in rag_chain.astream(inputs):
+                parts.append(chunk)
+                publish(chunk)
+        except Exception as e:
+            if parts:
+                raise StreamInterrupted(f"LLM stream broke off: {e}") from e
+            raise
+        return "".join(parts)
+    return stream
+
+def _generate(similar_docs, search_query, priority, deadline, publish=None):
+    rag_chain = create_rag_chain()
+    inputs, tokens = _chain_inputs(similar_docs, search_query)
+    return get_breaker("llm").call(lambda: get_scheduler().submit_sync(
+        _llm_call(rag_chain, inputs, publish), priority=priority, tokens=tokens, deadline=deadline
+    ))
+
+async def _agenerate(similar_docs, search_query, priority, deadline, publish=None):
+    rag_chain = create_rag_chain()
+    inputs, tokens = _chain_inputs(similar_docs, search_query)
+    return await get_breaker("llm").acall(lambda: get_scheduler().submit(
+        _llm_call(rag_chain, inputs, publish), priority=priority, tokens=tokens, deadline=deadline
+    ))
+
+def _flight_key(vector_store, search_query, sources, priority):
+    # load_vector_store returns one store object per namespace, for every
+    # backend. Only callers of the same priority share an answer, so an
+    # interactive question never waits behind a batch one.
+    return id(vector_store), priority, normalize_question(search_query), tuple(sorted(sources or ()))
+
+def _run_embedding(work, deadline):
+    # The extractive answer embeds the retrieved sentences: model work like
+    # the query embedding, so it shares that stage, breaker and time budget.
+    with stage("embedding", deadline):
+        return get_breaker("embedding").call(work, timeout=_retrieval_timeout(deadline))
+
+async def _arun_embedding(work, deadline):
+    with await astage("embedding", deadline):
+        return await get_breaker("embedding").acall(lambda: asyncio.to_thread(work), timeout=_retrieval_timeout(deadline))
+
+def _answer(vector_store, search_query, sources, priority, deadline, publish=None):
+    # Retrieval and generation for a standalone question; always returns the reply text.
+    try:
+        try:
+            similar_docs = _retrieve(vector_store, search_query, sources, deadline)
+        except (CircuitOpenError, DeadlineExceeded, SearchUnavailable) as e:
+            print(f"Document search unavailable: {e}")
+            return SEARCH_UNAVAILABLE_MESSAGE
+        fast_answer = try_extractive_answer(search_query, similar_docs, getattr(vector_store, "embeddings", None),
+                                            run=lambda work: _run_embedding(work, deadline))
+        if fast_answer is not None:
+            return fast_answer
+        if deadline.remaining() < LLM_MIN_BUDGET_SECONDS:
+            return degraded_answer(similar_docs)
+        try:
+            return _generate(similar_docs, search_query, priority, deadline, publish)
+        except (CircuitOpenError, DeadlineExceeded, StreamInterrupted) as e:
+            print(f"LLM unavailable, answering with the retrieved passages: {e}")
+            return degraded_answer(similar_docs)
+    except RateLimitExceeded as e:
+        print(f"LLM rate limit exhausted: {e}")
+        return BUSY_MESSAGE
+    except Overloaded as e:
+        print(f"Question shed: {e}")
+        return BUSY_MESSAGE
+    except Exception as e:
+        print(f"Error during question answering: {e}")
+        return "An error occurred while processing your question."
+
+async def _aanswer(vector_store, search_query, sources, priority, deadline, publish=None):
+    try:
+        try:
+            similar_docs = await _aretrieve(vector_store, search_query, sources, deadline)
+        except (CircuitOpenError, DeadlineExceeded, SearchUnavailable) as e:
+            print(f"Document search unavailable: {e}")
+            return SEARCH_UNAVAILABLE_MESSAGE
+        fast_answer = await atry_extractive_answer(search_query, similar_docs, getattr(vector_store, "embeddings", None),
+                                                   run=lambda work: _arun_embedding(work, deadline))
+        if fast_answer is not None:
+            return fast_answer
+        if deadline.remaining() < LLM_MIN_BUDGET_SECONDS:
+            return degraded_answer(similar_docs)
+        try:
+            return await _agenerate(similar_docs, search_query, priority, deadline, publish)
+        except (CircuitOpenError, DeadlineExceeded, StreamInterrupted) as e:
+            print(f"LLM unavailable, answering with the retrieved passages: {e}")
+            return degraded_answer(similar_docs)
+    except RateLimitExceeded as e:
+        print(f"LLM rate limit exhausted: {e}")
+        return BUSY_MESSAGE
+    except Overloaded as e:
+        print(f"Question shed: {e}")
+        return BUSY_MESSAGE
+    except Exception as e:
+        print(f"Error during question answering: {e}")
+        return "An error occurred while processing your question."
+
+def get_answer_from_query(vector_store, query, priority=INTERACTIVE, history=None, sources=None, deadline=None,
+                          tenant=""):
     """
     Takes a user query, retrieves relevant documents, and generates an answer.
+    Follow-up questions are first rewritten into standalone ones using `history`.
+    If `sources` names documents, only their chunks are searched.
+    Lookup-style questions are answered from a retrieved sentence when one
+    matches confidently; everything else goes to the LLM. The LLM call goes
+    through the shared scheduler, which bounds concurrency, applies the
+    provider rate limits and retries 429s with backoff.
+
+    Every stage runs within `deadline` (QA_DEADLINE_SECONDS by default) and
+    behind a per-dependency circuit breaker. If the search cannot run, the
+    user is asked to retry; if the LLM cannot answer in time, the top
+    retrieved passages are returned with their page references instead.
+
+    A question (after rewriting) identical to one already being answered
+    against the same documents, at the same priority and with a similar
+    deadline, waits for that answer instead of searching and generating again.
+
+    Questions first pass the admission controller, which queues them fairly
+    per `tenant` (the workspace) and answers BUSY_MESSAGE straight away when
+    the service is saturated, rather than letting every question slow down.
     """
     if vector_store is None:
         return "The document vector store is not initialized."
 
+    deadline = deadline or Deadline(QA_DEADLINE_SECONDS)
     try:
-        similar_docs = vector_store.similarity_search(query, k=5)
-        rag_chain = create_rag_chain()
-        response = rag_chain.invoke({"input_documents": similar_docs, "question": query})
-        return response
+        ticket = get_admission_controller().admit(tenant, deadline)
+    except Overloaded as e:
+        print(f"Question shed: {e}")
+        return BUSY_MESSAGE
+    try:
+        search_query = rewrite_query(query, history, priority=priority, deadline=deadline)
+        if not COALESCE_ENABLED:
+            return _answer(vector_store, search_query, sources, priority, deadline)
+        key = _flight_key(vector_store, search_query, sources, priority)
+        flight, leader = _flights.join(key, deadline.expires)
+        if leader:
+            return _flights.run(flight, key, lambda publish: _answer(
+                vector_store, search_query, sources, priority, deadline, publish))
+        # Waiting on another request's answer costs nothing; free the slot.
+        ticket.release()
+        try:
+            return flight.wait(deadline.remaining())
+        except TimeoutError:
+            return BUSY_MESSAGE
     except Exception as e:
         print(f"Error during question answering: {e}")
-        return "An error occurred while processing your question."
\ No newline at end of file
+        return "An error occurred while processing your question."
+    finally:
+        ticket.release()
+
+def stream_answer_from_query(vector_store, query, priority=INTERACTIVE, history=None, sources=None, deadline=None,
+                             tenant=""):
+    """
+    Streaming version of get_answer_from_query: yields the answer in chunks
+    as the LLM produces them. Identical questions asked meanwhile attach to
+    the same stream, replaying the chunks they missed. Admission works as
+    in get_answer_from_query; the slot is held until the answer is complete.
+    """
+    if vector_store is None:
+        yield "The document vector store is not initialized."
+        return
+
+    deadline = deadline or Deadline(QA_DEADLINE_SECONDS)
+    try:
+        ticket = get_admission_controller().admit(tenant, deadline)
+    except Overloaded as e:
+        print(f"Question shed: {e}")
+        yield BUSY_MESSAGE
+        return
+    try:
+        search_query = rewrite_query(query, history, priority=priority, deadline=deadline)
+        key = _flight_key(vector_store, search_query, sources, priority)
+        flights = _flights if COALESCE_ENABLED else SingleFlight()
+        flight, leader = flights.join(key, deadline.expires)
+    except BaseException:
+        ticket.release()
+        raise
+    if leader:
+        # Computed in the background, so followers keep receiving chunks even
+        # if the leader's own reader goes away. The slot is held until it is done.
+        def compute(publish):
+            with ticket:
+                return _answer(vector_store, search_query, sources, priority, deadline, publish)
+        flights.start(flight, key, compute)
+    else:
+        ticket.release()
+    try:
+        yield from flight.stream(timeout=max(deadline.remaining(), 1.0))
+    except TimeoutError:
+        yield BUSY_MESSAGE
+    except Exception as e:
+        print(f"Error during question answering: {e}")
+        yield "An error occurred while processing your question."
+
+async def aget_answer_from_query(vector_store, query, priority=INTERACTIVE, history=None, sources=None, deadline=None,
+                                 tenant=""):
+    """
+    Async version of get_answer_from_query for event-loop based servers and batch jobs.
+    """
+    if vector_store is None:
+        return "The document vector store is not initialized."
+
+    deadline = deadline or Deadline(QA_DEADLINE_SECONDS)
+    try:
+        ticket = await aadmit(tenant, deadline)
+    except Overloaded as e:
+        print(f"Question shed: {e}")
+        return BUSY_MESSAGE
+    try:
+        search_query = await arewrite_query(query, history, priority=priority, deadline=deadline)
+        if not COALESCE_ENABLED:
+            return await _aanswer(vector_store, search_query, sources, priority, deadline)
+        key = _flight_key(vector_store, search_query, sources, priority)
+        flight, leader = _flights.join(key, deadline.expires)
+        if leader:
+            return await _flights.arun(flight, key, lambda publish: _aanswer(
+                vector_store, search_query, sources, priority, deadline, publish))
+        ticket.release()
+        try:
+            return await asyncio.wait_for(asyncio.wrap_future(flight.future), deadline.remaining())
+        except asyncio.TimeoutError:
+            return BUSY_MESSAGE
+    except Exception as e:
+        print(f"Error during question answering: {e}")
+        return "An error occurred while processing your question."
+    finally:
+        ticket.release()
+
+def get_coalescing_report():
+    """
+    Returns how many questions started a computation and how many were coalesced into one.
+    """
+    return _flights.report()
+
+def get_query_cache_report():
+    """
+    Returns the query-embedding cache's hit rate, size and evictions (None if it is disabled).
+    """
+    cache = get_query_embedding_cache()
+    return cache.report() if cache is not None else None
+
+def get_service_report():
+    """
+    Returns the question path's counters in one dict: circuit breakers,
+    admission and stage limits, coalescing, the query-embedding and prompt
+    caches (None when disabled or not local) and the extractive fast path.
+    """
+    prompt_cache = get_prompt_cache()
+    return {
+        "breakers": get_breaker_report(),
+        **get_admission_report(),
+        "coalescing": get_coalescing_report(),
+        "query_cache": get_query_cache_report(),
+        "prompt_cache": prompt_cache.stats() if prompt_cache is not None else None,
+        "extractive": get_extractive_report(),
+    }
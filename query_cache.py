@@ -0,0 +1,126 @@
+# query_cache.py
+
+import os
+import re
+import sys
+import threading
+import unicodedata
+from collections import OrderedDict
+
+import numpy as np
+
+# Memory budget of the query-embedding cache; 0 disables it.
+QUERY_EMBEDDING_CACHE_MB = float(os.getenv("QUERY_EMBEDDING_CACHE_MB", "16"))
+
+_SPACES = re.compile(r"\s+")
+
+# Measured bytes per entry besides the vector data and the text: the ndarray
+# object, the key tuple and the OrderedDict's slot and link.
+_ENTRY_OVERHEAD = 240
+
+def normalize_query(text):
+    """
+    Normalizes query text for embedding: Unicode compatibility forms and
+    whitespace runs are folded, case is kept (cased models embed it).
+    """
+    return _SPACES.sub(" ", unicodedata.normalize("NFKC", text)).strip()
+
+def model_key(embeddings):
+    """
+    Identifies the model behind an embeddings object, so vectors of different models never mix.
+    """
+    return getattr(embeddings, "model_name", None) or type(embeddings).__name__
+
+class QueryEmbeddingCache:
+    """
+    LRU cache of query embeddings keyed by (model, normalized text).
+
+    Vectors are stored as float16, halving their memory (the rounding is far
+    below what changes a cosine ranking), and entries are evicted least
+    recently used first once `max_bytes`, counted with per-entry overhead,
+    is exceeded. The normalized text is what gets embedded, and a miss
+    returns the vector as stored, so a first ask and a retry see exactly
+    the same values.
+    """
+
+    def __init__(self, max_bytes=int(QUERY_EMBEDDING_CACHE_MB * 1024 * 1024)):
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.data = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0}
+
+    def get(self, model, text):
+        with self._lock:
+            vector = self.data.get((model, text))
+            if vector is None:
+                self.stats["misses"] += 1
+                return None
+            self.data.move_to_end((model, text))
+            self.stats["hits"] += 1
+        return vector.astype(np.float32).tolist()
+
+    @staticmethod
+    def _entry_size(text, vector):
+        return vector.nbytes + sys.getsizeof(text) + _ENTRY_OVERHEAD
+
+    def put(self, model, text, vector):
+        """
+        Caches a vector and returns it as stored (rounded to float16), as a list.
+        """
+        vector = np.asarray(vector, dtype=np.float16)
+        size = self._entry_size(text, vector)
+        if size <= self.max_bytes:
+            with self._lock:
+                previous = self.data.pop((model, text), None)
+                if previous is not None:
+                    self.bytes -= self._entry_size(text, previous)
+                self.data[(model, text)] = vector
+                self.bytes += size
+                while self.bytes > self.max_bytes:
+                    (_, old_text), old = self.data.popitem(last=False)
+                    self.bytes -= self._entry_size(old_text, old)
+                    self.stats["evictions"] += 1
+        return vector.astype(np.float32).tolist()
+
+    def embed_query(self, embeddings, text):
+        """
+        Returns the embedding of `text`, computing it with `embeddings` only on a miss.
+        """
+        model, text = model_key(embeddings), normalize_query(text)
+        vector = self.get(model, text)
+        if vector is None:
+            vector = self.put(model, text, embeddings.embed_query(text))
+        return vector
+
+    async def aembed_query(self, embeddings, text):
+        """
+        Async version of `embed_query`.
+        """
+        model, text = model_key(embeddings), normalize_query(text)
+        vector = self.get(model, text)
+        if vector is None:
+            vector = self.put(model, text, await embeddings.aembed_query(text))
+        return vector
+
+    def report(self):
+        with self._lock:
+            stats = dict(self.stats, entries=len(self.data), bytes=self.bytes)
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = stats["hits"] / lookups if lookups else 0.0
+        return stats
+
+_cache = None
+_cache_lock = threading.Lock()
+
+def get_query_embedding_cache():
+    """
+    Returns the process-wide query-embedding cache, or None if it is disabled.
+    """
+    global _cache
+    if QUERY_EMBEDDING_CACHE_MB <= 0:
+        return None
+    with _cache_lock:
+        if _cache is None:
+            _cache = QueryEmbeddingCache()
+        return _cache
@@ -0,0 +1,215 @@
+# resilience.py
+
+import asyncio
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+
+# End-to-end budget of one question, shared by rewriting, retrieval and generation.
+QA_DEADLINE_SECONDS = float(os.getenv("QA_DEADLINE_SECONDS", "20"))
+# Caps on the slices of that budget the early stages may use, so a slow
+# search or rewrite still leaves time to answer.
+REWRITE_TIMEOUT_SECONDS = float(os.getenv("REWRITE_TIMEOUT_SECONDS", "3"))
+RETRIEVAL_TIMEOUT_SECONDS = float(os.getenv("RETRIEVAL_TIMEOUT_SECONDS", "5"))
+# Below this much remaining time the LLM is not called at all.
+LLM_MIN_BUDGET_SECONDS = float(os.getenv("LLM_MIN_BUDGET_SECONDS", "1"))
+
+# A breaker opens after this many consecutive failures and lets one probe
+# call through once it has been open for BREAKER_RESET_SECONDS.
+BREAKER_FAILURE_THRESHOLD = int(os.getenv("BREAKER_FAILURE_THRESHOLD", "5"))
+BREAKER_RESET_SECONDS = float(os.getenv("BREAKER_RESET_SECONDS", "30"))
+
+# Blocking client calls (e.g. Pinecone) run here so a hung call only holds a
+# pool thread, not the request that gave up on it.
+_executor = ThreadPoolExecutor(max_workers=int(os.getenv("DEPENDENCY_THREADS", "16")), thread_name_prefix="dependency")
+
+class DeadlineExceeded(TimeoutError):
+    """Raised when a request's time budget runs out before a call finishes."""
+
+class DependencyBusy(Exception):
+    """
+    Raised when a healthy dependency refuses work for now (e.g. an exhausted
+    quota). Circuit breakers do not count it as a failure.
+    """
+
+class QueueTimeout(DeadlineExceeded, DependencyBusy):
+    """
+    Raised when the deadline passes while a call still waits for its turn.
+    The dependency was never asked, so breakers do not count it as a failure.
+    """
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling a dependency whose circuit breaker is open."""
+
+class Deadline:
+    """
+    A point in time by which a request must be answered, passed down to every stage.
+    """
+
+    def __init__(self, seconds):
+        self.expires = time.monotonic() + seconds
+
+    def remaining(self):
+        return max(0.0, self.expires - time.monotonic())
+
+    def expired(self):
+        return self.remaining() <= 0
+
+    def capped(self, cap):
+        """
+        Returns a deadline at most `cap` seconds away and never later than this one.
+        """
+        return Deadline(self.budget(cap))
+
+    def budget(self, cap=None):
+        """
+        Returns the seconds a stage may use: the time left, at most `cap`.
+        """
+        remaining = self.remaining()
+        return remaining if cap is None else min(remaining, cap)
+
+class CircuitBreaker:
+    """
+    Per-dependency circuit breaker.
+
+    Closed: calls go through and consecutive failures (errors and timeouts,
+    but not DependencyBusy) are counted. After `failure_threshold` of them it opens and calls fail
+    immediately with CircuitOpenError. After `reset_seconds` it is half-open:
+    one probe call goes through, closing the breaker if it succeeds and
+    re-opening it if it fails.
+    """
+
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+    def __init__(self, name, failure_threshold=BREAKER_FAILURE_THRESHOLD, reset_seconds=BREAKER_RESET_SECONDS):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.stats = {"calls": 0, "failures": 0, "rejected": 0, "opened": 0}
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """
+        Returns if a call may go through now; raises CircuitOpenError otherwise.
+        """
+        with self._lock:
+            if self.state == self.OPEN and time.monotonic() - self.opened_at >= self.reset_seconds:
+                self.state = self.HALF_OPEN
+                self._probing = False
+            if self.state == self.CLOSED:
+                self.stats["calls"] += 1
+                return
+            if self.state == self.HALF_OPEN and not self._probing:
+                self._probing = True
+                self.stats["calls"] += 1
+                return
+            self.stats["rejected"] += 1
+        raise CircuitOpenError(f"{self.name} is unavailable (circuit open)")
+
+    def record_success(self):
+        with self._lock:
+            if self.state != self.CLOSED:
+                print(f"Circuit breaker '{self.name}' closed.")
+            self.state = self.CLOSED
+            self.failures = 0
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self.stats["failures"] += 1
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                if self.state != self.OPEN:
+                    self.stats["opened"] += 1
+                    print(f"Circuit breaker '{self.name}' opened after {self.failures} failures.")
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+                self._probing = False
+
+    def _release_probe(self):
+        with self._lock:
+            self._probing = False
+
+    def call(self, fn, timeout=None):
+        """
+        Runs `fn()` through the breaker. With a timeout it runs on the
+        dependency pool and DeadlineExceeded is raised when it takes longer.
+        """
+        if timeout is not None and timeout <= 0:
+            raise DeadlineExceeded(f"no time left to call {self.name}")
+        self.allow()
+        try:
+            if timeout is None:
+                result = fn()
+            else:
+                try:
+                    result = _executor.submit(fn).result(timeout)
+                except FutureTimeoutError:
+                    raise DeadlineExceeded(f"{self.name} did not answer within {timeout:.2f}s") from None
+        except DependencyBusy:
+            # Neither a failure nor a success; a half-open breaker probes again.
+            self._release_probe()
+            raise
+        except Exception:
+            self.record_failure()
+            raise
+        except BaseException:
+            # Cancelled, not failed; let the next call probe instead.
+            self._release_probe()
+            raise
+        self.record_success()
+        return result
+
+    async def acall(self, call, timeout=None):
+        """
+        Async version of `call`; `call` returns the coroutine to await.
+        """
+        if timeout is not None and timeout <= 0:
+            raise DeadlineExceeded(f"no time left to call {self.name}")
+        self.allow()
+        try:
+            if timeout is None:
+                result = await call()
+            else:
+                try:
+                    result = await asyncio.wait_for(call(), timeout)
+                except asyncio.TimeoutError:
+                    raise DeadlineExceeded(f"{self.name} did not answer within {timeout:.2f}s") from None
+        except DependencyBusy:
+            # Neither a failure nor a success; a half-open breaker probes again.
+            self._release_probe()
+            raise
+        except Exception:
+            self.record_failure()
+            raise
+        except BaseException:
+            # Cancelled, not failed; let the next call probe instead.
+            self._release_probe()
+            raise
+        self.record_success()
+        return result
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+def get_breaker(name):
+    """
+    Returns the process-wide circuit breaker for a dependency ("llm", "vector_store", ...).
+    """
+    with _breakers_lock:
+        if name not in _breakers:
+            _breakers[name] = CircuitBreaker(name)
+        return _breakers[name]
+
+def get_breaker_report():
+    """
+    Returns each breaker's state and counters.
+    """
+    with _breakers_lock:
+        breakers = list(_breakers.values())
+    return {breaker.name: {"state": breaker.state, **breaker.stats} for breaker in breakers}
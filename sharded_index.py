@@ -0,0 +1,298 @@
+# sharded_index.py
+
+import heapq
+import itertools
+import multiprocessing
+import os
+import threading
+import time
+import uuid
+import zlib
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+
+from langchain_core.vectorstores import VectorStore
+
+from local_index import LOCAL_INDEX_DIR, LocalVectorIndex, namespace_dir
+
+LOCAL_INDEX_SHARDS = int(os.getenv("LOCAL_INDEX_SHARDS", "1"))
+# "process" runs each shard in its own worker process; "thread" keeps all
+# shards in this process (for tests and small machines).
+SHARD_TRANSPORT = os.getenv("SHARD_TRANSPORT", "process")
+# A shard that has not answered within this time is left out of the results.
+SHARD_TIMEOUT_MS = float(os.getenv("SHARD_TIMEOUT_MS", "250"))
+# Writes and other calls every shard must answer fail after this long
+# (a hung worker), instead of blocking the caller forever.
+SHARD_CALL_TIMEOUT_SECONDS = float(os.getenv("SHARD_CALL_TIMEOUT_SECONDS", "120"))
+
+class ShardServer:
+    """
+    The operations one shard answers, run wherever the shard lives.
+    """
+
+    def __init__(self, path):
+        self.index = LocalVectorIndex(None, path=path)
+
+    def search(self, vector, k, filter):
+        return self.index.similarity_search_with_score_by_vector(vector, k, filter)
+
+    def add_vectors(self, vectors, texts, metadatas, ids):
+        self.index.add_vectors(vectors, texts, metadatas, ids)
+        return len(ids)
+
+    def add_sources(self, updates):
+        self.index.add_sources(updates)
+
+    def delete(self, ids):
+        self.index.delete(ids)
+
+    def delete_sources(self, sources):
+        self.index.delete_sources(sources)
+
+    def list_sources(self):
+        return self.index.list_sources()
+
+    def stats(self):
+        return self.index.stats()
+
+    def size(self):
+        return self.index.size
+
+    def close(self):
+        self.index.close()
+
+class ThreadShard:
+    """
+    Transport for a shard held in this process; calls run on a small thread pool.
+    """
+
+    def __init__(self, path):
+        self.server = ShardServer(path)
+        self._executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="shard")
+
+    def call(self, op, *args):
+        return self._executor.submit(getattr(self.server, op), *args)
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+        self.server.close()
+
+def _shard_process(path, conn):
+    server = ShardServer(path)
+    while True:
+        try:
+            request_id, op, args = conn.recv()
+        except EOFError:
+            # Worker processes exit without running atexit hooks.
+            server.close()
+            return
+        try:
+            conn.send((request_id, True, getattr(server, op)(*args)))
+        except Exception as e:
+            conn.send((request_id, False, f"{type(e).__name__}: {e}"))
+
+class ProcessShard:
+    """
+    Transport for a shard owned by a worker process, reached over a pipe.
+
+    Requests are tagged with an id and answered in order by the worker; a
+    reader thread resolves the matching futures, so a caller that gave up on
+    a slow shard never blocks the next request. Once the worker is gone,
+    pending and later calls fail with ConnectionError.
+    """
+
+    def __init__(self, path):
+        context = multiprocessing.get_context("spawn")
+        self._conn, child_conn = context.Pipe()
+        self._process = context.Process(target=_shard_process, args=(path, child_conn), daemon=True)
+        self._process.start()
+        child_conn.close()
+        self._pending = {}
+        self._ids = itertools.count()
+        self._send_lock = threading.Lock()
+        self._closed = False
+        self._reader = threading.Thread(target=self._read, daemon=True)
+        self._reader.start()
+
+    def _read(self):
+        while True:
+            try:
+                request_id, ok, result = self._conn.recv()
+            except (EOFError, OSError):
+                break
+            future = self._pending.pop(request_id, None)
+            if future is None:
+                continue
+            if ok:
+                future.set_result(result)
+            else:
+                future.set_exception(RuntimeError(result))
+        # Under the send lock, so no call registers a future nobody will resolve.
+        with self._send_lock:
+            self._closed = True
+            pending = list(self._pending.values())
+            self._pending.clear()
+        for future in pending:
+            future.set_exception(ConnectionError("shard process exited"))
+
+    def call(self, op, *args):
+        future = Future()
+        with self._send_lock:
+            if self._closed:
+                future.set_exception(ConnectionError("shard process exited"))
+                return future
+            request_id = next(self._ids)
+            self._pending[request_id] = future
+            try:
+                self._conn.send((request_id, op, args))
+            except (OSError, ValueError) as e:
+                self._pending.pop(request_id, None)
+                future.set_exception(ConnectionError(f"shard process unreachable: {e}"))
+        return future
+
+    def close(self):
+        self._conn.close()
+        self._process.join(timeout=10)
+        if self._process.is_alive():
+            self._process.terminate()
+
+def _results(futures, timeout=SHARD_CALL_TIMEOUT_SECONDS):
+    # Results of calls every shard must answer, raising if one fails or hangs.
+    deadline = time.monotonic() + timeout
+    return [future.result(max(0.0, deadline - time.monotonic())) for future in futures]
+
+class ShardedVectorIndex(VectorStore):
+    """
+    Local vector index partitioned into shards by document content hash.
+
+    Writes are embedded here and routed to the shard owning the document.
+    Searches are scattered to every shard in parallel; each shard returns its
+    own top k and the results are merged with a heap. Shards that miss the
+    per-shard timeout are skipped, so a slow or dead shard degrades recall
+    instead of failing the query. `last_search` records how many answered.
+    """
+
+    def __init__(self, embedding, path, shards=LOCAL_INDEX_SHARDS, transport=SHARD_TRANSPORT,
+                 timeout_ms=SHARD_TIMEOUT_MS):
+        self.embedding = embedding
+        self.timeout = timeout_ms / 1000
+        shard_class = ProcessShard if transport == "process" else ThreadShard
+        self.shards = [shard_class(os.path.join(path, f"shards-{shards}", f"{i:03d}")) for i in range(shards)]
+        # Wait until every shard has loaded its data before serving queries.
+        sizes = _results([shard.call("size") for shard in self.shards])
+        print(f"Sharded index ready: {len(self.shards)} shards, {sum(sizes)} vectors.")
+        self.last_search = {"shards": len(self.shards), "responded": len(self.shards)}
+
+    @property
+    def embeddings(self):
+        return self.embedding
+
+    def shard_for(self, metadata):
+        """
+        Returns the shard index for a chunk; all chunks of a document share a shard.
+        """
+        key = metadata.get("content_hash")
+        if key:
+            return int(key[:8], 16) % len(self.shards)
+        return zlib.crc32(str(metadata.get("source")).encode("utf-8")) % len(self.shards)
+
+    def add_texts(self, texts, metadatas=None, *, ids=None, **kwargs):
+        texts = list(texts)
+        metadatas = [dict(m) for m in metadatas] if metadatas else [{} for _ in texts]
+        ids = list(ids) if ids else [uuid.uuid4().hex for _ in texts]
+        vectors = self.embedding.embed_documents(texts)
+        batches = {}
+        for item in zip(vectors, texts, metadatas, ids):
+            batches.setdefault(self.shard_for(item[2]), []).append(item)
+        _results([
+            self.shards[shard].call("add_vectors", *map(list, zip(*items)))
+            for shard, items in batches.items()
+        ])
+        return ids
+
+    def add_sources(self, updates):
+        # Chunk ids do not say which shard holds them; shards ignore unknown ids.
+        _results([shard.call("add_sources", updates) for shard in self.shards])
+
+    def delete(self, ids=None, **kwargs):
+        if ids:
+            _results([shard.call("delete", list(ids)) for shard in self.shards])
+        return True
+
+    def delete_sources(self, sources):
+        # A shared chunk may live in any shard, so every shard is asked.
+        _results([shard.call("delete_sources", sorted(sources)) for shard in self.shards])
+
+    def stats(self):
+        """
+        Returns the shards' segment and tombstone counts summed, with the overall dead-row ratio.
+        """
+        totals = {}
+        for shard_stats in _results([shard.call("stats") for shard in self.shards]):
+            for key, value in shard_stats.items():
+                totals[key] = totals.get(key, 0) + value
+        rows = totals["live"] + totals["dead"]
+        totals["dead_ratio"] = totals["dead"] / rows if rows else 0.0
+        return totals
+
+    def list_sources(self):
+        sources = set()
+        for shard_sources in _results([shard.call("list_sources") for shard in self.shards]):
+            sources.update(shard_sources)
+        return sorted(sources)
+
+    def similarity_search_with_score_by_vector(self, embedding, k=4, filter=None, **kwargs):
+        started = time.perf_counter()
+        futures = [shard.call("search", embedding, k, filter) for shard in self.shards]
+        done, _ = wait(futures, timeout=self.timeout)
+        results, responded = [], 0
+        for future in done:
+            if future.exception() is None:
+                responded += 1
+                results.extend(future.result())
+        self.last_search = {
+            "shards": len(self.shards),
+            "responded": responded,
+            "ms": 1000 * (time.perf_counter() - started),
+        }
+        if responded < len(self.shards):
+            print(f"Partial search results: {responded} of {len(self.shards)} shards answered.")
+        return heapq.nlargest(k, results, key=lambda pair: pair[1])
+
+    def similarity_search_by_vector(self, embedding, k=4, filter=None, **kwargs):
+        return [doc for doc, _ in self.similarity_search_with_score_by_vector(embedding, k, filter)]
+
+    def similarity_search_with_score(self, query, k=4, filter=None, **kwargs):
+        return self.similarity_search_with_score_by_vector(self.embedding.embed_query(query), k, filter)
+
+    def similarity_search(self, query, k=4, filter=None, **kwargs):
+        return self.similarity_search_by_vector(self.embedding.embed_query(query), k, filter)
+
+    def _select_relevance_score_fn(self):
+        return lambda score: (score + 1) / 2
+
+    @classmethod
+    def from_texts(cls, texts, embedding, metadatas=None, *, ids=None, path=None, **kwargs):
+        index = cls(embedding, path=path, **kwargs)
+        index.add_texts(texts, metadatas, ids=ids)
+        return index
+
+    def close(self):
+        for shard in self.shards:
+            shard.close()
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+def get_sharded_index(embedding, namespace="", root=LOCAL_INDEX_DIR, shards=LOCAL_INDEX_SHARDS):
+    """
+    Returns the process-wide ShardedVectorIndex for a namespace, starting its shards on first use.
+    """
+    path = namespace_dir(namespace, root)
+    with _indexes_lock:
+        index = _indexes.get(path)
+        if index is None:
+            index = ShardedVectorIndex(embedding, path, shards=shards)
+            _indexes[path] = index
+        else:
+            index.embedding = embedding
+        return index
@@ -0,0 +1,169 @@
+# single_flight.py
+
+import os
+import re
+import threading
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+
+COALESCE_ENABLED = os.getenv("COALESCE_ENABLED", "true").lower() in ("1", "true", "yes")
+# A caller whose deadline is this much later than the running flight's computes
+# on its own rather than share an answer cut short by the earlier deadline.
+COALESCE_DEADLINE_SLACK_SECONDS = float(os.getenv("COALESCE_DEADLINE_SLACK_SECONDS", "5"))
+
+_SPACES = re.compile(r"\s+")
+
+def normalize_question(question):
+    """
+    Normalizes a question for coalescing: case, whitespace and trailing punctuation are ignored.
+    """
+    return _SPACES.sub(" ", question).strip().lower().rstrip("?!. ")
+
+class Flight:
+    """
+    One in-flight computation: the chunks it has streamed so far, then its
+    result (or error) in `future`. Any number of callers can follow it;
+    late arrivals replay the chunks already published before the live ones.
+    """
+
+    def __init__(self, expires=None):
+        self.expires = expires
+        self.chunks = []
+        self.future = Future()
+        self._changed = threading.Condition()
+
+    def publish(self, chunk):
+        with self._changed:
+            self.chunks.append(chunk)
+            self._changed.notify_all()
+
+    def finish(self, result=None, error=None):
+        with self._changed:
+            if error is not None:
+                self.future.set_exception(error)
+            else:
+                self.future.set_result(result)
+            self._changed.notify_all()
+
+    def wait(self, timeout=None):
+        """
+        Returns the result, raising its error, or TimeoutError after `timeout` seconds.
+        """
+        try:
+            return self.future.result(timeout)
+        except FutureTimeoutError:
+            raise TimeoutError("the coalesced request did not finish in time") from None
+
+    def stream(self, timeout=None):
+        """
+        Yields the published (text) chunks, waiting for new ones until the
+        flight finishes.
+        """
+        position = 0
+        while True:
+            with self._changed:
+                if position == len(self.chunks) and not self.future.done():
+                    if not self._changed.wait(timeout):
+                        raise TimeoutError("the coalesced request stopped streaming")
+                chunks = self.chunks[position:]
+                done = self.future.done()
+            for chunk in chunks:
+                yield chunk
+            position += len(chunks)
+            if done and position == len(self.chunks):
+                break
+        # An answer that did not come from the stream (e.g. the extractive or
+        # degraded reply, possibly after a broken stream) is yielded at the end.
+        result = self.wait()
+        streamed = "".join(self.chunks)
+        if result and result != streamed:
+            yield ("\n\n" if streamed else "") + result
+
+class SingleFlight:
+    """
+    Deduplicates concurrent identical requests: the first caller with a key
+    becomes the leader and computes, later callers with the same key attach
+    to its Flight until it finishes. Nothing is cached afterwards.
+    """
+
+    def __init__(self):
+        self._flights = {}
+        self._lock = threading.Lock()
+        self.stats = {"flights": 0, "coalesced": 0, "bypassed": 0}
+
+    def join(self, key, expires=None):
+        """
+        Returns (flight, leader): leader is True if the caller must compute it.
+
+        `expires` is the caller's deadline (a time.monotonic() value). A caller
+        with more than COALESCE_DEADLINE_SLACK_SECONDS longer than the running
+        flight gets a flight of its own, which others do not join.
+        """
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is not None:
+                if (expires is not None and flight.expires is not None
+                        and expires - flight.expires > COALESCE_DEADLINE_SLACK_SECONDS):
+                    self.stats["bypassed"] += 1
+                    return Flight(expires), True
+                self.stats["coalesced"] += 1
+                return flight, False
+            flight = Flight(expires)
+            self._flights[key] = flight
+            self.stats["flights"] += 1
+            return flight, True
+
+    def run(self, flight, key, compute):
+        """
+        Leader side: runs compute(publish) and finishes the flight with its outcome.
+        """
+        try:
+            result = compute(flight.publish)
+        except BaseException as e:
+            # Includes cancellation, so followers never wait on an abandoned flight.
+            self._forget(key, flight)
+            flight.finish(error=e)
+            raise
+        self._forget(key, flight)
+        flight.finish(result)
+        return result
+
+    async def arun(self, flight, key, compute):
+        """
+        Async version of `run`; `compute(publish)` returns a coroutine.
+        """
+        try:
+            result = await compute(flight.publish)
+        except BaseException as e:
+            # Includes cancellation, so followers never wait on an abandoned flight.
+            self._forget(key, flight)
+            flight.finish(error=e)
+            raise
+        self._forget(key, flight)
+        flight.finish(result)
+        return result
+
+    def start(self, flight, key, compute):
+        """
+        Like `run`, on a background thread, so the leader can consume the flight like any follower.
+        """
+        def target():
+            try:
+                self.run(flight, key, compute)
+            except Exception:
+                pass  # Delivered to every caller through the flight.
+        threading.Thread(target=target, name="single-flight", daemon=True).start()
+
+    def _forget(self, key, flight):
+        with self._lock:
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+
+    def report(self):
+        with self._lock:
+            in_flight = len(self._flights)
+        requests = self.stats["flights"] + self.stats["coalesced"]
+        return {
+            **self.stats,
+            "in_flight": in_flight,
+            "coalesced_rate": self.stats["coalesced"] / requests if requests else 0.0,
+        }
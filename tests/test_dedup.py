@@ -0,0 +1,48 @@
+# test_dedup.py
+
+import pytest
+from langchain_core.documents import Document
+
+from dedup import NearDuplicateIndex
+
+PARAGRAPH = "The quarterly report shows revenue growth across every region and product line this year."
+
+def _chunk(chunk_id, source, text=PARAGRAPH):
+    return Document(page_content=text, metadata={"chunk_id": chunk_id, "source": source, "page": 0, "start_index": 0})
+
+def test_near_duplicates_are_dropped_and_recorded(tmp_path):
+    path = str(tmp_path / "clusters.log")
+    index = NearDuplicateIndex(path)
+    with index.add_chunks([_chunk("a1", "a.pdf"), _chunk("b1", "b.pdf")]) as unique:
+        assert [chunk.metadata["chunk_id"] for chunk in unique] == ["a1"]
+
+    reloaded = NearDuplicateIndex(path)
+    assert sorted(member["source"] for member in reloaded.sources("a1")) == ["a.pdf", "b.pdf"]
+
+def test_failed_write_leaves_no_record(tmp_path):
+    path = str(tmp_path / "clusters.log")
+    index = NearDuplicateIndex(path)
+    with pytest.raises(RuntimeError):
+        with index.add_chunks([_chunk("a1", "a.pdf")]):
+            raise RuntimeError("vector store write failed")
+    assert index.stats() == {"chunks": 0, "clusters": 0, "duplicates": 0}
+    assert NearDuplicateIndex(path).stats()["clusters"] == 0
+
+    # The next copy of the paragraph is stored instead of being dropped as a duplicate.
+    with index.add_chunks([_chunk("b1", "b.pdf")]) as unique:
+        assert [chunk.metadata["chunk_id"] for chunk in unique] == ["b1"]
+
+def test_retain_forgets_what_the_store_no_longer_holds(tmp_path):
+    path = str(tmp_path / "clusters.log")
+    index = NearDuplicateIndex(path)
+    other = "An entirely different paragraph about the annual staff meeting schedule and its agenda."
+    with index.add_chunks([_chunk("a1", "a.pdf"), _chunk("a2", "a.pdf", other)]):
+        pass
+    with index.add_chunks([_chunk("b1", "b.pdf")]):
+        pass
+
+    # Rolled back to before b.pdf and a2: a1 is stored, listing only a.pdf.
+    index.retain({"a1": {"a.pdf"}})
+    for reloaded in (index, NearDuplicateIndex(path)):
+        assert [member["source"] for member in reloaded.sources("a1")] == ["a.pdf"]
+        assert reloaded.stats() == {"chunks": 1, "clusters": 1, "duplicates": 0}
@@ -0,0 +1,33 @@
+# test_document_processor.py
+
+from langchain_core.documents import Document
+
+from document_processor import strip_repeated_lines
+
+def _page(number, body, footer=None):
+    footer = footer or str(number)
+    text = f"Annual Report\n{body}\n{footer}"
+    edge_lines = [["Annual Report", 0.03], [footer, 0.97]]
+    return Document(page_content=text, metadata={"page": number, "edge_lines": edge_lines})
+
+def test_numeric_table_rows_are_kept_while_page_numbers_go():
+    # Scores in the body mask to "#" just like the page numbers do.
+    pages = [_page(n, f"Results for group {n}\n90\n75\n88") for n in range(1, 7)]
+    documents, report = strip_repeated_lines(pages)
+    for n, document in enumerate(documents, start=1):
+        assert document.page_content == f"Results for group {n}\n90\n75\n88"
+        assert "edge_lines" not in document.metadata
+    assert report["lines_removed"] == 12
+
+def test_footer_text_in_the_body_is_kept():
+    # A dated footer is never a watermark, so only the edge rule applies to it.
+    pages = [_page(n, "Totals\nPage 2024\nend", footer="Page 2024") for n in range(1, 7)]
+    documents, report = strip_repeated_lines(pages)
+    assert documents[0].page_content == "Totals\nPage 2024\nend"
+    assert report["lines_removed"] == 12
+
+def test_short_documents_are_left_alone():
+    pages = [_page(n, "body") for n in range(1, 4)]
+    documents, report = strip_repeated_lines(pages)
+    assert documents[0].page_content == "Annual Report\nbody\n1"
+    assert report["lines_removed"] == 0
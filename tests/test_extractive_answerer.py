@@ -0,0 +1,46 @@
+# test_extractive_answerer.py
+
+import asyncio
+import threading
+
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+
+from extractive_answerer import atry_extractive_answer, try_extractive_answer
+from resilience import CircuitOpenError
+
+DOCS = [Document(page_content="A transformer is a neural network built on attention. It was introduced in 2017.",
+                 metadata={"source": "paper.pdf", "page": 0})]
+
+class WordEmbeddings(Embeddings):
+    def __init__(self):
+        self.threads = []
+
+    def _embed(self, text):
+        words = set(text.lower().replace(".", "").replace("?", "").split())
+        return [float(word in words) for word in ("transformer", "attention", "network", "2017", "what", "is", "a")]
+
+    def embed_documents(self, texts):
+        self.threads.append(threading.current_thread())
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text):
+        return self._embed(text)
+
+def test_async_fast_path_embeds_off_the_event_loop():
+    embeddings = WordEmbeddings()
+
+    async def ask():
+        return threading.current_thread(), await atry_extractive_answer(
+            "What is a transformer?", DOCS, embeddings, threshold=0.1)
+
+    loop_thread, answer = asyncio.run(ask())
+    assert answer.startswith("A transformer is a neural network")
+    assert embeddings.threads and loop_thread not in embeddings.threads
+
+def test_errors_from_the_runner_fall_back_to_the_llm():
+    def open_circuit(work):
+        raise CircuitOpenError("embedding is unavailable (circuit open)")
+
+    assert try_extractive_answer("What is a transformer?", DOCS, WordEmbeddings(), threshold=0.1,
+                                 run=open_circuit) is None
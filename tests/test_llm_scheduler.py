@@ -0,0 +1,90 @@
+# test_llm_scheduler.py
+
+import asyncio
+import threading
+
+import pytest
+
+from llm_scheduler import LLMScheduler, StreamInterrupted, is_rate_limit_error, is_retryable_error
+from resilience import CircuitBreaker, Deadline, DeadlineExceeded, QueueTimeout
+
+class RateLimitError(Exception):
+    status_code = 429
+
+def test_interrupted_stream_is_not_retryable_even_if_it_mentions_429():
+    error = StreamInterrupted("LLM stream broke off: Error code: 429")
+    assert not is_rate_limit_error(error)
+    assert not is_retryable_error(error)
+    assert is_retryable_error(RateLimitError("429"))
+
+def test_stream_that_published_tokens_is_not_run_again():
+    scheduler = LLMScheduler(max_concurrency=1, requests_per_minute=6000, tokens_per_minute=10**6, max_retries=3)
+    published, runs = [], []
+
+    async def stream():
+        runs.append(1)
+        parts = []
+        try:
+            for chunk in ["Hello ", "world "]:
+                parts.append(chunk)
+                published.append(chunk)
+            raise RateLimitError("Error code: 429")
+        except Exception as e:
+            raise StreamInterrupted(f"LLM stream broke off: {e}") from e
+
+    with pytest.raises(StreamInterrupted):
+        scheduler.submit_sync(stream, timeout=10)
+    assert runs == [1]
+    assert published == ["Hello ", "world "]
+    assert scheduler.stats["retries"] == 0
+
+def test_rate_limited_call_is_retried():
+    scheduler = LLMScheduler(max_concurrency=1, requests_per_minute=6000, tokens_per_minute=10**6, max_retries=3)
+    attempts = []
+
+    async def call():
+        attempts.append(1)
+        if len(attempts) == 1:
+            raise RateLimitError("Error code: 429")
+        await asyncio.sleep(0)
+        return "ok"
+
+    assert scheduler.submit_sync(call, timeout=30) == "ok"
+    assert len(attempts) == 2
+
+def test_call_expiring_in_the_queue_is_not_a_breaker_failure():
+    scheduler = LLMScheduler(max_concurrency=1, requests_per_minute=6000, tokens_per_minute=10**6)
+    breaker = CircuitBreaker("llm", failure_threshold=1)
+    started, release = threading.Event(), threading.Event()
+
+    async def slow():
+        started.set()
+        await asyncio.to_thread(release.wait, 10)
+        return "slow"
+
+    async def quick():
+        return "quick"
+
+    running = threading.Thread(target=scheduler.submit_sync, args=(slow,))
+    running.start()
+    assert started.wait(5)
+    try:
+        with pytest.raises(QueueTimeout):
+            breaker.call(lambda: scheduler.submit_sync(quick, deadline=Deadline(0.2)))
+    finally:
+        release.set()
+        running.join()
+    assert breaker.state == breaker.CLOSED
+    assert breaker.stats["failures"] == 0
+
+def test_call_running_past_its_deadline_is_a_breaker_failure():
+    scheduler = LLMScheduler(max_concurrency=1, requests_per_minute=6000, tokens_per_minute=10**6)
+    breaker = CircuitBreaker("llm", failure_threshold=1)
+
+    async def hang():
+        await asyncio.sleep(10)
+
+    with pytest.raises(DeadlineExceeded) as info:
+        breaker.call(lambda: scheduler.submit_sync(hang, deadline=Deadline(0.2)))
+    assert not isinstance(info.value, QueueTimeout)
+    assert breaker.state == breaker.OPEN
@@ -0,0 +1,80 @@
+# test_local_index.py
+
+import atexit
+import threading
+
+import numpy as np
+
+from local_index import LocalVectorIndex
+
+def _open(path):
+    index = LocalVectorIndex(None, path=str(path))
+    # Tests close or abandon the index themselves; a crash never checkpoints.
+    atexit.unregister(index.close)
+    return index
+
+def _add(index, *ids):
+    vectors = [np.eye(4)[i % 4] + 0.01 * i for i in range(len(ids))]
+    index.add_vectors(vectors, [f"text {i}" for i in ids], [{"source": "a.pdf"} for _ in ids], list(ids))
+
+def _ids(index):
+    return sorted(doc.id for doc in index.similarity_search_by_vector(np.ones(4), k=100))
+
+def test_writes_not_yet_checkpointed_are_replayed_after_a_crash(tmp_path):
+    index = _open(tmp_path)
+    _add(index, "a", "b")
+    index.checkpoint()
+    _add(index, "c")
+    index._wal.stop()
+
+    recovered = _open(tmp_path)
+    assert _ids(recovered) == ["a", "b", "c"]
+    assert recovered._wal.stats["replayed"] == 1
+    recovered.close()
+
+def test_checkpoint_truncates_the_log_and_recovers_from_segments(tmp_path):
+    index = _open(tmp_path)
+    _add(index, "a", "b")
+    index.delete(["a"])
+    version = index.checkpoint()
+    index.close()
+
+    recovered = _open(tmp_path)
+    assert recovered.version == version
+    assert _ids(recovered) == ["b"]
+    assert recovered._wal.stats["replayed"] == 0
+    recovered.close()
+
+def test_rollback_restores_an_earlier_checkpoint_and_survives_a_restart(tmp_path):
+    index = _open(tmp_path)
+    _add(index, "a")
+    first = index.checkpoint()
+    _add(index, "b")
+    index.checkpoint()
+
+    assert index.rollback() == first
+    assert _ids(index) == ["a"]
+    index.close()
+    reopened = _open(tmp_path)
+    assert _ids(reopened) == ["a"]
+    reopened.close()
+
+def test_searches_see_each_upsert_whole():
+    # Re-upserting the same ids swaps new rows for old ones; a search must
+    # see either version, never both or neither.
+    index = LocalVectorIndex(None)
+    ids = [f"chunk-{i}" for i in range(10)]
+    _add(index, *ids)
+    stop, seen = threading.Event(), set()
+
+    def search():
+        while not stop.is_set():
+            seen.add(len(index.similarity_search_by_vector(np.ones(4), k=100)))
+
+    reader = threading.Thread(target=search)
+    reader.start()
+    for _ in range(200):
+        _add(index, *ids)
+    stop.set()
+    reader.join()
+    assert seen == {10}
@@ -0,0 +1,35 @@
+# test_offset_splitter.py
+
+import random
+
+import pytest
+from langchain_core.documents import Document
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+from offset_splitter import OffsetTextSplitter
+
+WORDS = ["alpha", "beta", "gamma", "delta", "epsilon", "zeta", "eta", "theta", "x" * 30, "y" * 120]
+
+def _page(rng, paragraphs=12):
+    # Paragraphs of lines of words, with the odd very long "word" and stray spaces.
+    return "\n\n".join(
+        "\n".join(" ".join(rng.choice(WORDS) for _ in range(rng.randint(1, 25))) + rng.choice(["", " ", "  "])
+                  for _ in range(rng.randint(1, 6)))
+        for _ in range(paragraphs)
+    )
+
+@pytest.mark.parametrize("chunk_size, chunk_overlap", [(1000, 200), (100, 20), (50, 0), (64, 63)])
+def test_same_chunks_as_recursive_character_splitter(chunk_size, chunk_overlap):
+    rng = random.Random(chunk_size * 1000 + chunk_overlap)
+    reference = RecursiveCharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+    splitter = OffsetTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+    for _ in range(30):
+        text = _page(rng)
+        assert splitter.split_text(text) == reference.split_text(text)
+
+def test_offsets_point_at_each_chunk():
+    text = _page(random.Random(7))
+    chunks = OffsetTextSplitter(chunk_size=200, chunk_overlap=50).split_documents([Document(page_content=text)])
+    assert chunks
+    for chunk in chunks:
+        assert text[chunk.metadata["start_index"]:chunk.metadata["end_index"]] == chunk.page_content
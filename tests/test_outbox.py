@@ -0,0 +1,66 @@
+# test_outbox.py
+
+from langchain_core.documents import Document
+
+import outbox
+from outbox import Outbox
+
+class Rejected(Exception):
+    status_code = 400
+
+class Unavailable(Exception):
+    status_code = 503
+
+def _chunks(*ids):
+    return [Document(page_content=f"text {i}", metadata={"chunk_id": i, "source": "a.pdf"}) for i in ids]
+
+def _outbox(tmp_path, sink):
+    box = Outbox(str(tmp_path / "outbox.sqlite3"), sink, batch_size=10)
+    box.stage("", _chunks("a", "b", "c", "d", "bad"), [[0.1, 0.2]] * 5)
+    return box
+
+def test_bad_entry_is_bisected_out_of_its_batch(tmp_path):
+    written = []
+
+    def sink(namespace, upserts, source_updates):
+        ids = [upsert["id"] for upsert in upserts]
+        if "bad" in ids:
+            raise Rejected("vector dimension mismatch")
+        written.extend(ids)
+
+    box = _outbox(tmp_path, sink)
+    assert box.flush() == 4
+    assert sorted(written) == ["a", "b", "c", "d"]
+    backlog = box.backlog()
+    assert backlog["pending"] == 1 and backlog["failing"] == 1 and backlog["dead"] == 0
+
+def test_outage_fails_the_whole_batch_without_bisecting(tmp_path):
+    calls = []
+
+    def sink(namespace, upserts, source_updates):
+        calls.append(len(upserts))
+        raise Unavailable("service unavailable")
+
+    box = _outbox(tmp_path, sink)
+    assert box.flush() == 0
+    assert calls == [5]
+    assert box.backlog()["failing"] == 5
+
+def test_entry_failing_too_often_is_dead_lettered_and_can_be_requeued(tmp_path, monkeypatch):
+    monkeypatch.setattr(outbox, "OUTBOX_MAX_ATTEMPTS", 1)
+    reject = {"bad"}
+
+    def sink(namespace, upserts, source_updates):
+        if reject & {upsert["id"] for upsert in upserts}:
+            raise Rejected("metadata too large")
+
+    box = _outbox(tmp_path, sink)
+    assert box.flush() == 4
+    backlog = box.backlog()
+    assert backlog["pending"] == 0 and backlog["dead"] == 1
+
+    reject.clear()
+    assert box.requeue_dead_letters() == 1
+    assert box.flush() == 1
+    backlog = box.backlog()
+    assert backlog["pending"] == 0 and backlog["dead"] == 0
@@ -0,0 +1,27 @@
+# test_sharded_index.py
+
+import time
+from concurrent.futures import TimeoutError as FutureTimeoutError
+
+import pytest
+
+from sharded_index import ProcessShard, ThreadShard, _results
+
+def test_calls_fail_once_the_shard_process_is_gone(tmp_path):
+    shard = ProcessShard(str(tmp_path / "000"))
+    assert shard.call("size").result(60) == 0
+    shard._process.kill()
+    shard._process.join(10)
+    shard._reader.join(10)
+
+    with pytest.raises(ConnectionError):
+        shard.call("size").result(5)
+    assert shard._pending == {}
+    shard.close()
+
+def test_hung_shard_times_out(tmp_path, monkeypatch):
+    shard = ThreadShard(str(tmp_path / "000"))
+    monkeypatch.setattr(shard.server, "size", lambda: time.sleep(1))
+    with pytest.raises(FutureTimeoutError):
+        _results([shard.call("size")], timeout=0.1)
+    shard.close()
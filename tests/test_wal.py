@@ -0,0 +1,59 @@
+# test_wal.py
+
+import os
+
+import pytest
+
+import wal
+from wal import WriteAheadLog
+
+def _log_records(directory, records):
+    log = WriteAheadLog(directory)
+    list(log.replay(0))
+    applied = []
+    log.start(lambda seq, record: applied.append((seq, record)))
+    for record in records:
+        log.submit(record).result(timeout=5)
+    log.close()
+    return applied
+
+def test_replay_stops_at_a_torn_final_record_and_cuts_it_off(tmp_path):
+    directory = str(tmp_path)
+    _log_records(directory, [{"n": 1}, {"n": 2}])
+    (path,) = [os.path.join(directory, name) for name in os.listdir(directory)]
+    size = os.path.getsize(path)
+    with open(path, "ab") as f:
+        # A crash in the middle of the third frame: full header, half a payload.
+        f.write(wal._HEADER.pack(100, 3, 0) + b"x" * 40)
+
+    log = WriteAheadLog(directory)
+    assert list(log.replay(0)) == [(1, {"n": 1}), (2, {"n": 2})]
+    assert log.last_seq == 2
+    assert os.path.getsize(path) == size
+
+def test_replay_skips_records_covered_by_a_checkpoint(tmp_path):
+    directory = str(tmp_path)
+    _log_records(directory, [{"n": 1}, {"n": 2}, {"n": 3}])
+    assert [seq for seq, _ in WriteAheadLog(directory).replay(2)] == [3]
+
+def test_failed_append_is_rolled_back(tmp_path, monkeypatch):
+    directory = str(tmp_path)
+    log = WriteAheadLog(directory)
+    list(log.replay(0))
+    log.start(lambda seq, record: None)
+    assert log.submit({"n": 1}).result(timeout=5) == 1
+
+    real_fsync, calls = os.fsync, []
+    def failing_fsync(fd):
+        calls.append(fd)
+        if len(calls) == 1:
+            raise OSError("disk full")
+        real_fsync(fd)
+    monkeypatch.setattr(wal.os, "fsync", failing_fsync)
+    with pytest.raises(OSError):
+        log.submit({"n": "lost"}).result(timeout=5)
+    monkeypatch.setattr(wal.os, "fsync", real_fsync)
+    assert log.submit({"n": 2}).result(timeout=5) == 2
+    log.close()
+
+    assert list(WriteAheadLog(directory).replay(0)) == [(1, {"n": 1}), (2, {"n": 2})]
@@ -1,37 +1,240 @@
 # vector_store.py
 
+import hashlib
+import os
+import threading
+from contextlib import contextmanager
+
 from langchain_pinecone import PineconeVectorStore
 
+from dedup import DEDUP_ENABLED, get_dedup_index
+from local_index import get_local_index
+from outbox import OUTBOX_PATH, Outbox
+from sharded_index import LOCAL_INDEX_SHARDS, get_sharded_index
+
 # The name of the index you created in your Pinecone account
-PINECONE_INDEX_NAME = "rag-qa-index" 
+PINECONE_INDEX_NAME = "rag-qa-index"
+
+# "pinecone" or "local" (a numpy index under local_data/vector_index, split into
+# LOCAL_INDEX_SHARDS shards searched in parallel when that is above 1).
+VECTOR_STORE_BACKEND = os.getenv("VECTOR_STORE_BACKEND", "pinecone").lower()
+# Namespace (tenant) used when none is given; "" is Pinecone's default namespace.
+DEFAULT_NAMESPACE = os.getenv("VECTOR_NAMESPACE", "")
+
+def namespace_for_user(identity):
+    """
+    Returns the namespace of an authenticated user's workspace. The identity
+    (e.g. an email address) is hashed, so it is not stored in the vector store.
+    """
+    digest = hashlib.sha256(identity.strip().lower().encode("utf-8")).hexdigest()[:16]
+    return f"user-{digest}"
+
+def _local_index(embeddings_model, namespace):
+    if LOCAL_INDEX_SHARDS > 1:
+        return get_sharded_index(embeddings_model, namespace)
+    return get_local_index(embeddings_model, namespace)
+
+def source_filter(sources):
+    """
+    Returns the metadata filter restricting a search to the given documents,
+    or None to search the whole namespace.
+
+    Chunks written before deduplication only carry `source`, so they are
+    matched on that field too.
+    """
+    if not sources:
+        return None
+    sources = sorted(sources)
+    return {"$or": [{"sources": {"$in": sources}}, {"source": {"$in": sources}}]}
+
+@contextmanager
+def _deduplicated(chunked_docs, namespace):
+    # Yields the chunks to write, each with `sources` listing every document
+    # it occurs in, and {stored chunk id: new sources} for clusters that were
+    # written earlier and gained a document. The new clusters are recorded
+    # only if the block (the write) succeeds.
+    if not DEDUP_ENABLED:
+        for chunk in chunked_docs:
+            chunk.metadata["sources"] = [chunk.metadata.get("source")]
+        yield chunked_docs, {}
+        return
+    index = get_dedup_index(namespace)
+    with index.add_chunks(chunked_docs) as unique:
+        for chunk in unique:
+            cluster = chunk.metadata["dup_cluster"]
+            sources = {member["source"] for member in index.sources(cluster)}
+            chunk.metadata["sources"] = sorted(sources | {chunk.metadata.get("source")})
+        written = {chunk.metadata["chunk_id"] for chunk in unique}
+        new_sources = {}
+        for chunk in chunked_docs:
+            cluster = chunk.metadata["dup_cluster"]
+            if cluster not in written:
+                new_sources.setdefault(cluster, set()).add(chunk.metadata.get("source"))
+        yield unique, new_sources
+
+def _write_to_pinecone(namespace, upserts, new_sources):
+    # Outbox sink: raises on any failure so the batch is retried.
+    from pinecone import Pinecone
+
+    index = Pinecone().Index(PINECONE_INDEX_NAME)
+    if upserts:
+        index.upsert(vectors=upserts, namespace=namespace)
+    chunk_ids = list(new_sources)
+    for start in range(0, len(chunk_ids), 100):
+        fetched = index.fetch(ids=chunk_ids[start:start + 100], namespace=namespace).vectors
+        for chunk_id, vector in fetched.items():
+            existing = set((vector.metadata or {}).get("sources") or [])
+            if not new_sources[chunk_id] <= existing:
+                sources = sorted(existing | new_sources[chunk_id])
+                index.update(id=chunk_id, set_metadata={"sources": sources}, namespace=namespace)
+
+_outbox = None
+_outbox_lock = threading.Lock()
+
+def get_outbox():
+    """
+    Returns the process-wide outbox of pending Pinecone writes, starting its flusher on first use.
+    """
+    global _outbox
+    with _outbox_lock:
+        if _outbox is None:
+            _outbox = Outbox(OUTBOX_PATH, _write_to_pinecone)
+            _outbox.start()
+        return _outbox
+
+def create_or_update_vector_store(chunked_docs, embeddings_model, namespace=None):
+    """
+    Adds new document chunks to the vector store, in the given namespace
+    (tenant). Near-duplicates of chunks already in the namespace are dropped
+    first; the stored copy's `sources` metadata lists every document it
+    occurs in, so per-document searches still find it. Chunks are written
+    under their stable `chunk_id`, so re-adding a document overwrites its
+    vectors instead of duplicating them.
+    For Pinecone, the chunks are embedded here and staged with their vectors
+    in a durable local outbox, which a background flusher writes in batches
+    and retries; an outage delays the write instead of losing it.
+    Returns True once the chunks are stored or staged, and False if that
+    failed (the near-duplicate index then forgets them too).
+    """
+    namespace = DEFAULT_NAMESPACE if namespace is None else namespace
+    try:
+        with _deduplicated(chunked_docs, namespace) as (chunked_docs, new_sources):
+            ids = [doc.metadata["chunk_id"] for doc in chunked_docs]
+
+            if VECTOR_STORE_BACKEND == "local":
+                index = _local_index(embeddings_model, namespace)
+                if chunked_docs:
+                    print("Adding documents to the local index...")
+                    index.add_documents(chunked_docs, ids=ids)
+                if new_sources:
+                    index.add_sources(new_sources)
+                print("Local vector index updated.")
+                return True
+
+            outbox = get_outbox()
+            if chunked_docs:
+                vectors = embeddings_model.embed_documents([doc.page_content for doc in chunked_docs])
+                outbox.stage(namespace, chunked_docs, vectors)
+            if new_sources:
+                outbox.stage_sources(namespace, new_sources)
+            print(f"Staged {len(ids)} chunks for Pinecone; {outbox.backlog()['pending']} writes pending.")
+            return True
+    except Exception as e:
+        print(f"Error updating vector store: {e}")
+        return False
+
+def write_backlog():
+    """
+    Returns the backlog of writes waiting for Pinecone (see Outbox.backlog),
+    or None for the local index, which is written directly.
+    """
+    if VECTOR_STORE_BACKEND == "local":
+        return None
+    return get_outbox().backlog()
+
+_pinecone_stores = {}
+_pinecone_stores_lock = threading.Lock()
 
-def create_or_update_vector_store(chunked_docs, embeddings_model):
+def load_vector_store(embeddings_model, namespace=None):
     """
-    Adds new document chunks to the Pinecone vector store.
+    Loads an existing vector store (one namespace of it) to be used for queries.
+    Like local indexes, Pinecone stores are created once per namespace and
+    reused, so one store object always stands for one namespace.
     """
+    namespace = DEFAULT_NAMESPACE if namespace is None else namespace
     try:
-        print("Adding documents to Pinecone index...")
-        PineconeVectorStore.from_documents(
-            documents=chunked_docs, 
-            embedding=embeddings_model, 
-            index_name=PINECONE_INDEX_NAME
-        )
-        print("Vector store updated in Pinecone.")
+        if VECTOR_STORE_BACKEND == "local":
+            return _local_index(embeddings_model, namespace)
+
+        with _pinecone_stores_lock:
+            key = (id(embeddings_model), namespace)
+            if key not in _pinecone_stores:
+                print("Loading existing Pinecone vector store...")
+                _pinecone_stores[key] = PineconeVectorStore.from_existing_index(
+                    index_name=PINECONE_INDEX_NAME,
+                    embedding=embeddings_model,
+                    namespace=namespace or None
+                )
+                print("Pinecone vector store loaded successfully.")
+            return _pinecone_stores[key]
     except Exception as e:
-        print(f"Error updating Pinecone vector store: {e}")
+        print(f"Error loading vector store: {e}")
+        return None
+
+def delete_document(source, embeddings_model, namespace=None):
+    """
+    Removes a document from a namespace of the local index. Its chunks are
+    tombstoned and reclaimed by background compaction; chunks it shares with
+    other documents stay for them.
+    Returns True on success and False if the backend cannot delete by
+    document (Pinecone) or the delete failed.
+    """
+    namespace = DEFAULT_NAMESPACE if namespace is None else namespace
+    if VECTOR_STORE_BACKEND != "local":
+        print("Deleting documents is only supported by the local index.")
+        return False
+    try:
+        _local_index(embeddings_model, namespace).delete_sources([source])
+        if DEDUP_ENABLED:
+            get_dedup_index(namespace).remove_sources([source])
+        print(f"Deleted '{source}' from the local index.")
+        return True
+    except Exception as e:
+        print(f"Error deleting document: {e}")
+        return False
+
+def list_documents(embeddings_model, namespace=None):
+    """
+    Returns the documents stored in a namespace, or None if the backend
+    cannot list them (Pinecone).
+    """
+    if VECTOR_STORE_BACKEND != "local":
+        return None
+    return _local_index(embeddings_model, DEFAULT_NAMESPACE if namespace is None else namespace).list_sources()
 
-def load_vector_store(embeddings_model):
+def rollback_vector_store(embeddings_model, namespace=None, version=None):
     """
-    Loads an existing Pinecone vector store to be used for queries.
+    Restores a namespace of the local index to an earlier checkpoint (by
+    default the one before its current state; see LocalVectorIndex.rollback)
+    and drops the near-duplicate records of chunks the rollback removed.
+    Returns the restored version, or None if the backend cannot roll back
+    (Pinecone, sharded local indexes) or the rollback failed.
     """
+    namespace = DEFAULT_NAMESPACE if namespace is None else namespace
+    index = _local_index(embeddings_model, namespace) if VECTOR_STORE_BACKEND == "local" else None
+    if not hasattr(index, "rollback"):
+        print("Rollback is only supported by the unsharded local index.")
+        return None
     try:
-        print("Loading existing Pinecone vector store...")
-        vector_store = PineconeVectorStore.from_existing_index(
-            index_name=PINECONE_INDEX_NAME,
-            embedding=embeddings_model
-        )
-        print("Pinecone vector store loaded successfully.")
-        return vector_store
+        restored = index.rollback(version)
+        if DEDUP_ENABLED:
+            dedup_index = get_dedup_index(namespace)
+            stored = {
+                doc.id: set(doc.metadata.get("sources") or [doc.metadata.get("source")])
+                for doc in index.get_by_ids(list(dedup_index.members))
+            }
+            dedup_index.retain(stored)
+        return restored
     except Exception as e:
-        print(f"Error loading Pinecone vector store: {e}")
-        return None
\ No newline at end of file
+        print(f"Error rolling back the vector store: {e}")
+        return None
@@ -0,0 +1,228 @@
+# wal.py
+
+import os
+import pickle
+import queue
+import re
+import struct
+import threading
+import zlib
+from concurrent.futures import Future
+
+# Records waiting when the writer wakes up are written together and made
+# durable with a single fsync (group commit).
+WAL_GROUP_MAX = int(os.getenv("WAL_GROUP_MAX", "64"))
+
+# Each frame: payload length, sequence number, CRC32 of the payload, then the pickled record.
+_HEADER = struct.Struct(">IQI")
+_WAL_FILE = re.compile(r"wal-(\d+)\.log$")
+
+class WALFailed(OSError):
+    """Raised for appends after a failed write could not be rolled back."""
+
+class WriteAheadLog:
+    """
+    Append-only log of index mutations, made durable before they are applied.
+
+    Records get increasing sequence numbers. A single writer thread takes every
+    record queued since its last wake-up, appends them, fsyncs once and then
+    hands them to the `apply` callback in order, resolving each submitter's
+    future. After a checkpoint has stored everything up to some sequence
+    number, `truncate` starts a fresh file and deletes the old ones.
+
+    A group whose write fails is cut off the file again, so later groups
+    never land behind a torn frame (which replay would stop at). If even
+    that fails, the log refuses all further appends.
+    """
+
+    def __init__(self, directory, idle_seconds=None):
+        self.directory = directory
+        self.idle_seconds = idle_seconds
+        os.makedirs(directory, exist_ok=True)
+        self.last_seq = 0
+        self.stats = {"records": 0, "groups": 0, "replayed": 0,
+                      "records_since_checkpoint": 0, "bytes_since_checkpoint": 0}
+        self._queue = queue.Queue()
+        self._file_lock = threading.Lock()
+        self._file = None
+        self._thread = None
+        self._failed = None
+
+    def _files(self):
+        return sorted(
+            (int(m.group(1)), os.path.join(self.directory, m.group(0)))
+            for m in map(_WAL_FILE.match, os.listdir(self.directory)) if m
+        )
+
+    def replay(self, after_seq):
+        """
+        Yields (seq, record) for every intact record newer than `after_seq`,
+        truncating a torn record left at the end of the log by a crash.
+        """
+        self.last_seq = after_seq
+        for _, path in self._files():
+            with open(path, "r+b") as f:
+                good_offset = 0
+                while True:
+                    header = f.read(_HEADER.size)
+                    if len(header) < _HEADER.size:
+                        break
+                    length, seq, crc = _HEADER.unpack(header)
+                    payload = f.read(length)
+                    if len(payload) < length or zlib.crc32(payload) != crc:
+                        break
+                    good_offset = f.tell()
+                    if seq > self.last_seq:
+                        self.last_seq = seq
+                        self.stats["replayed"] += 1
+                        yield seq, pickle.loads(payload)
+                if good_offset < os.path.getsize(path):
+                    print(f"Truncating a torn record at the end of {path}.")
+                    f.truncate(good_offset)
+
+    def start(self, apply, after_group=None):
+        """
+        Opens the log for appending and starts the writer thread.
+
+        Args:
+            apply: Called with (seq, record) for each durable record, in order.
+            after_group: Called with no arguments after each group, and when the
+                writer has been idle for `idle_seconds` (e.g. to checkpoint).
+        """
+        self._apply = apply
+        self._after_group = after_group
+        self._open(self.last_seq + 1)
+        self._thread = threading.Thread(target=self._run, name="wal-writer", daemon=True)
+        self._thread.start()
+
+    def _open(self, first_seq):
+        path = os.path.join(self.directory, f"wal-{first_seq:012d}.log")
+        created = not os.path.exists(path)
+        # Unbuffered, so a failed write leaves nothing behind to be flushed later.
+        self._file = open(path, "ab", buffering=0)
+        if created:
+            self._sync_directory()
+
+    def _sync_directory(self):
+        # Makes the creation and removal of log files durable.
+        fd = os.open(self.directory, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    def submit(self, record):
+        """
+        Queues a record; the returned future resolves once it is durable and applied.
+        """
+        future = Future()
+        if self._failed is not None:
+            future.set_exception(self._failed)
+            return future
+        self._queue.put((record, future))
+        return future
+
+    def _run(self):
+        while True:
+            try:
+                group = [self._queue.get(timeout=self.idle_seconds)]
+            except queue.Empty:
+                if self._after_group:
+                    self._after_group()
+                continue
+            if group[0] is None:
+                return
+            while len(group) < WAL_GROUP_MAX:
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is None:
+                    self._queue.put(None)
+                    break
+                group.append(item)
+
+            try:
+                sequenced = self._write(group)
+            except Exception as e:
+                for _, future in group:
+                    future.set_exception(e)
+                continue
+            for (seq, record), (_, future) in zip(sequenced, group):
+                try:
+                    self._apply(seq, record)
+                    future.set_result(seq)
+                except Exception as e:
+                    future.set_exception(e)
+            if self._after_group:
+                self._after_group()
+
+    def _write(self, group):
+        with self._file_lock:
+            sequenced, frames = [], []
+            for record, _ in group:
+                seq = self.last_seq + 1 + len(sequenced)
+                payload = pickle.dumps(record, protocol=pickle.HIGHEST_PROTOCOL)
+                frames.append(_HEADER.pack(len(payload), seq, zlib.crc32(payload)) + payload)
+                sequenced.append((seq, record))
+            data = b"".join(frames)
+            if self._failed is not None:
+                raise self._failed
+            offset = self._file.tell()
+            try:
+                view = memoryview(data)
+                while view:
+                    view = view[self._file.write(view):]
+                os.fsync(self._file.fileno())
+            except Exception as e:
+                self._roll_back(offset, e)
+                raise
+            self.last_seq += len(sequenced)
+            self.stats["records"] += len(sequenced)
+            self.stats["groups"] += 1
+            self.stats["records_since_checkpoint"] += len(sequenced)
+            self.stats["bytes_since_checkpoint"] += len(data)
+        return sequenced
+
+    def _roll_back(self, offset, error):
+        # Cuts a partly written group off the end of the file.
+        try:
+            self._file.truncate(offset)
+            os.fsync(self._file.fileno())
+        except Exception as e:
+            print(f"Could not roll back a failed write-ahead log append, refusing further writes: {e}")
+            self._failed = WALFailed(f"write-ahead log failed after: {error}")
+
+    def truncate(self, checkpoint_seq):
+        """
+        Drops log files whose records are all covered by a checkpoint at
+        `checkpoint_seq`. Does nothing while newer records are still in the current file.
+        """
+        with self._file_lock:
+            if self.last_seq > checkpoint_seq:
+                return False
+            if self._file is not None:
+                self._file.close()
+            for _, path in self._files():
+                os.remove(path)
+            # The new file's directory fsync also covers the removals.
+            self._open(checkpoint_seq + 1)
+            self.stats["records_since_checkpoint"] = 0
+            self.stats["bytes_since_checkpoint"] = 0
+        return True
+
+    def stop(self):
+        """
+        Stops the writer after the records already queued.
+        """
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+
+    def close(self):
+        self.stop()
+        with self._file_lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None